@@ -101,6 +101,26 @@ def is_clean(ascension_level, gold, player_experience, is_trial,
                  item_purchase_floors, items_purged_floors,
                  potions_floor_spawned)
             )
+
+# is_clean on a runview.RunView
+def check(view, game_dict):
+    a = view.args
+    if not view.regular:
+        return is_clean(**a)
+    floor_reached = a['floor_reached']
+    return (scalars_valid(a['ascension_level'], a['gold'],
+                          a['player_experience'], a['is_trial'],
+                          a['is_prod'], a['is_daily'], a['chose_seed'],
+                          a['is_endless'])
+            and lists_valid(floor_reached, a['gold_per_floor'],
+                            a['current_hp_per_floor'], a['max_hp_per_floor'],
+                            a['path_per_floor'], a['items_purchased'],
+                            a['item_purchase_floors'], a['items_purged'],
+                            a['items_purged_floors'], a['boss_relics'])
+            and 0 <= floor_reached <= 57
+            and (view.floor_range is None
+                 or (0 <= view.floor_range[0]
+                     and view.floor_range[1] <= floor_reached)))
         
 def portal_floor(event_choices, **kwargs):
     for event in event_choices:
@@ -0,0 +1,228 @@
+# Vectorized versions of basic_cleaning.is_clean (scalars_valid, lists_valid
+# and floors_valid) and campfire_shop_cleaning.is_clean for a batch of runs.
+# The fields the checks read are flattened into numpy arrays: one value per
+# run for scalar fields, and ragged arrays (the values of all runs
+# concatenated, plus offsets) for list fields. The verdicts match the
+# per-run functions exactly. Runs with values the arrays cannot represent
+# the same way (missing keys, None, strings, entries without a floor, ...)
+# are checked with the per-run functions instead, so they also fail or
+# raise the same way.
+from itertools import chain
+from operator import itemgetter
+import numpy as np
+import basic_cleaning
+import campfire_shop_cleaning
+
+_number_types = {int, float, bool}
+
+_scalar_fields = ['ascension_level', 'gold', 'player_experience', 'is_trial',
+                  'is_prod', 'is_daily', 'chose_seed', 'is_endless',
+                  'floor_reached']
+# lists of floor numbers
+_floor_lists = ['potions_floor_usage', 'item_purchase_floors',
+                'items_purged_floors', 'potions_floor_spawned']
+# lists of dictionaries with a 'floor' key
+_floor_dicts = ['card_choices', 'relics_obtained', 'event_choices',
+                'damage_taken', 'campfire_choices', 'potions_obtained']
+# lists of which only the length is checked
+_length_lists = ['gold_per_floor', 'current_hp_per_floor',
+                 'max_hp_per_floor', 'path_per_floor', 'items_purchased',
+                 'items_purged', 'boss_relics']
+
+_fields = _scalar_fields + _floor_lists + _floor_dicts + _length_lists
+
+_missing = object()
+
+# {field:values of the field in each run}, _missing where a run lacks it
+def _columns(runs):
+    if len(runs) == 0:
+        return {f:() for f in _fields}
+    try:
+        columns = zip(*map(itemgetter(*_fields), runs))
+    except KeyError:
+        columns = ([r.get(f, _missing) for r in runs] for f in _fields)
+    return dict(zip(_fields, columns))
+
+def _is_number(v):
+    return type(v) in _number_types
+
+def _dict_floors(entries):
+    return list(map(itemgetter('floor'), entries))
+
+def _to_floats(values):
+    try:
+        return np.array(values, dtype = float)
+    except OverflowError:
+        return None
+
+class Ragged:
+    # values: all values of the runs concatenated, offsets: start of the
+    # values of run i at offsets[i] (offsets[n] = len(values))
+    def __init__(self, values, lengths):
+        self.values = values
+        self.lengths = np.asarray(lengths, dtype = np.int64)
+        self.offsets = np.zeros(len(lengths) + 1, dtype = np.int64)
+        np.cumsum(self.lengths, out = self.offsets[1:])
+
+    # run index of each value
+    def owners(self):
+        return np.repeat(np.arange(len(self.lengths)), self.lengths)
+
+    # True for runs with at least one value where bad is True
+    def any(self, bad):
+        return np.bincount(self.owners()[bad],
+                           minlength = len(self.lengths)) > 0
+
+# The fields of a batch of runs as numpy arrays. irregular is True for runs
+# that have to be checked by the per-run functions; their entries in the
+# arrays are placeholders.
+class RunBatch:
+    def __init__(self, runs):
+        self.runs = runs
+        self.n = len(runs)
+        self.irregular = np.zeros(self.n, dtype = bool)
+        self.columns = _columns(runs)
+        self.scalars = {f:self._scalar(f) for f in _scalar_fields}
+        self.floors = {}
+        for f in _floor_lists:
+            self.floors[f] = self._ragged(f, list)
+        for f in _floor_dicts:
+            self.floors[f] = self._ragged(f, _dict_floors)
+        self.lengths = {f:self._lengths(f) for f in _length_lists}
+
+    def _scalar(self, field):
+        values = list(self.columns[field])
+        if not set(map(type, values)) <= _number_types:
+            for i, v in enumerate(values):
+                if not _is_number(v):
+                    self.irregular[i] = True
+                    values[i] = 0
+        arr = _to_floats(values)
+        if arr is None:
+            self.irregular[:] = True
+            return np.zeros(self.n)
+        return arr
+
+    # floor values of a list field. get_floors maps a list of entries to
+    # their floors (raising KeyError or TypeError if it cannot). The whole
+    # batch is converted at once; only if that fails are the runs checked
+    # one at a time.
+    def _ragged(self, field, get_floors):
+        values = list(self.columns[field])
+        if set(map(type, values)) == {list}:
+            try:
+                floors = get_floors(chain.from_iterable(values))
+            except (KeyError, TypeError):
+                floors = None
+            if floors is not None and set(map(type, floors)) <= _number_types:
+                arr = _to_floats(floors)
+                if arr is not None:
+                    return Ragged(arr, list(map(len, values)))
+        lists = [self._run_floors(v, get_floors) for v in values]
+        for i, l in enumerate(lists):
+            if l is None:
+                self.irregular[i] = True
+                lists[i] = []
+        arr = _to_floats(list(chain.from_iterable(lists)))
+        if arr is None:
+            self.irregular[:] = True
+            return Ragged(np.zeros(0), [0] * self.n)
+        return Ragged(arr, list(map(len, lists)))
+
+    # floors of one run, or None if they cannot be vectorized
+    def _run_floors(self, value, get_floors):
+        if type(value) is not list:
+            return None
+        try:
+            floors = get_floors(value)
+        except (KeyError, TypeError):
+            return None
+        if not set(map(type, floors)) <= _number_types:
+            return None
+        return floors
+
+    def _lengths(self, field):
+        values = list(self.columns[field])
+        if set(map(type, values)) == {list}:
+            return np.fromiter(map(len, values), dtype = np.int64,
+                               count = self.n)
+        lengths = np.zeros(self.n, dtype = np.int64)
+        for i, v in enumerate(values):
+            if type(v) is list:
+                lengths[i] = len(v)
+            else:
+                self.irregular[i] = True
+        return lengths
+
+    # verdicts of the per-run function for the irregular runs where where is
+    # True
+    def _fallback(self, verdict, is_clean, where):
+        for i in np.flatnonzero(self.irregular & where):
+            verdict[i] = bool(is_clean(**self.runs[i]))
+        return verdict
+
+def scalars_valid(batch):
+    s = batch.scalars
+    return ((0 <= s['ascension_level']) & (s['ascension_level'] <= 20)
+            & (0 <= s['gold'])
+            & (0 <= s['player_experience'])
+            & (s['is_trial'] == 0)
+            & (s['is_prod'] == 0)
+            & (s['is_daily'] == 0)
+            & (s['chose_seed'] == 0)
+            & (s['is_endless'] == 0))
+
+def lists_valid(batch):
+    floor_reached = batch.scalars['floor_reached']
+    ln = batch.lengths
+    min_len = np.maximum(floor_reached - 1, 1)
+    return ((ln['gold_per_floor'] >= min_len)
+            & (ln['current_hp_per_floor'] >= min_len)
+            & (ln['max_hp_per_floor'] >= min_len)
+            & (ln['path_per_floor'] >= floor_reached - 1)
+            & (ln['items_purchased']
+               == batch.floors['item_purchase_floors'].lengths)
+            & (ln['items_purged']
+               == batch.floors['items_purged_floors'].lengths)
+            & (ln['boss_relics'] <= 2))
+
+def floors_valid(batch):
+    floor_reached = batch.scalars['floor_reached']
+    valid = (0 <= floor_reached) & (floor_reached <= 57)
+    for ragged in batch.floors.values():
+        limit = floor_reached[ragged.owners()]
+        ok = (0 <= ragged.values) & (ragged.values <= limit)
+        valid &= ~ragged.any(~ok)
+    return valid
+
+# basic_cleaning.is_clean for each run of the batch. Irregular runs are only
+# checked where where is True (all runs by default).
+def basic_is_clean(batch, where = None):
+    verdict = scalars_valid(batch) & lists_valid(batch) & floors_valid(batch)
+    if where is None:
+        where = np.ones(batch.n, dtype = bool)
+    return batch._fallback(verdict, basic_cleaning.is_clean, where)
+
+# True for runs where a value appears twice in the ragged array
+def _has_repeats(ragged):
+    owners = ragged.owners()
+    order = np.lexsort((ragged.values, owners))
+    values = ragged.values[order]
+    owners = owners[order]
+    repeat = (values[1:] == values[:-1]) & (owners[1:] == owners[:-1])
+    return np.bincount(owners[1:][repeat],
+                       minlength = len(ragged.lengths)) > 0
+
+# campfire_shop_cleaning.is_clean for each run of the batch. Irregular runs
+# are only checked where where is True (all runs by default).
+def campfire_is_clean(batch, where = None):
+    verdict = ~(_has_repeats(batch.floors['campfire_choices'])
+                | _has_repeats(batch.floors['items_purged_floors']))
+    if where is None:
+        where = np.ones(batch.n, dtype = bool)
+    # floats can make distinct large integers equal, so repeats are
+    # confirmed by the per-run function
+    recheck = ~verdict & ~batch.irregular & where
+    for i in np.flatnonzero(recheck):
+        verdict[i] = bool(campfire_shop_cleaning.is_clean(**batch.runs[i]))
+    return batch._fallback(verdict, campfire_shop_cleaning.is_clean, where)
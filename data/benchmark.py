@@ -0,0 +1,442 @@
+# Import benchmarks on a synthetic data dump. Runs are generated with the
+# fields of the Mega Crit run events that the cleaning validators read,
+# written as .json.gz files and as a 7z archive of .json files, and imported
+# into a temporary database by the datahelper importers. The report gives
+# runs/sec for each importer, the time spent in each stage (decompress,
+# parse, clean, insert), the time of a pass over a solid 7z archive of many
+# small members and peak memory, and can be saved as json to compare
+# changes.
+#
+# usage: python benchmark.py [--files N] [--runs N] [--processes N]
+#                            [--bulk] [--members N] [--reference-db PATH]
+#                            [--out PATH]
+import argparse
+import datetime
+import gzip
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from py7zr import SevenZipFile
+import datahelper
+import jsonstream
+import profiling
+import sources
+
+# reference data of the synthetic database. Skipped card rewards are
+# recorded as the card 'SKIP'.
+_cards = [('SKIP', 'ALL'),
+          ('Strike_R', 'IRONCLAD'), ('Defend_R', 'IRONCLAD'),
+          ('Bash', 'IRONCLAD'), ('Anger', 'IRONCLAD'),
+          ('Feed', 'IRONCLAD'), ('Inflame', 'IRONCLAD'),
+          ('Strike_G', 'THE_SILENT'), ('Defend_G', 'THE_SILENT'),
+          ('Neutralize', 'THE_SILENT'), ('Survivor', 'THE_SILENT'),
+          ('Strike_B', 'DEFECT'), ('Defend_B', 'DEFECT'),
+          ('Zap', 'DEFECT'), ('Dualcast', 'DEFECT'),
+          ('Strike_P', 'WATCHER'), ('Defend_P', 'WATCHER'),
+          ('Eruption', 'WATCHER'), ('Vigilance', 'WATCHER'),
+          ('Wish', 'WATCHER'), ('HandOfGreed', 'ALL'),
+          ('Apotheosis', 'ALL'), ('AscendersBane', 'ALL'),
+          ('Injury', 'ALL')]
+_relics = [('Burning Blood', 'IRONCLAD'), ('Black Blood', 'IRONCLAD'),
+           ('Ring of the Snake', 'THE_SILENT'), ('Cracked Core', 'DEFECT'),
+           ('PureWater', 'WATCHER'), ('Vajra', 'ALL'), ('Anchor', 'ALL'),
+           ('Lantern', 'ALL'), ('Bag of Marbles', 'ALL'),
+           ('Old Coin', 'ALL'), ('CeramicFish', 'ALL'), ('Mango', 'ALL'),
+           ('Tiny House', 'ALL'), ('Astrolabe', 'ALL'),
+           ('Pandora\'s Box', 'ALL')]
+_potions = ['Fire Potion', 'Block Potion', 'Fruit Juice']
+_events = ['Big Fish', 'Dead Adventurer', 'Golden Shrine', 'Living Wall']
+# name, number of enemies, most enemies after splits, most gold dropped
+_encounters = [('Jaw Worm', 1, 1, 20), ('Cultist', 1, 1, 20),
+               ('2 Louse', 2, 2, 20), ('Gremlin Nob', 1, 1, 35),
+               ('Lagavulin', 1, 1, 35), ('Hexaghost', 1, 1, 100),
+               ('The Guardian', 1, 1, 100)]
+
+_characters = {'IRONCLAD':(80, 'Burning Blood', 'R'),
+               'THE_SILENT':(70, 'Ring of the Snake', 'G'),
+               'DEFECT':(75, 'Cracked Core', 'B'),
+               'WATCHER':(72, 'PureWater', 'P')}
+
+# date of the first file of the synthetic dump
+first_date = datetime.datetime(2020, 8, 1)
+
+# creates a database with the reference tables and an empty MegaCritData
+# table. The reference tables are copied from reference_db if it is given,
+# so the runs are cleaned against the real game data.
+def make_database(dbpath, reference_db = None):
+    if os.path.exists(dbpath):
+        os.remove(dbpath)
+    con = sqlite3.connect(dbpath)
+    try:
+        con.execute('CREATE TABLE Files(FileDate TEXT, InDatabase INT)')
+        con.execute('CREATE TABLE MegaCritData(FileDate TEXT, Clean INT, '
+                    'AdjustedFloorReached INT, Abandoned INT)')
+        if reference_db is not None:
+            con.execute('ATTACH DATABASE ? AS ref', (reference_db,))
+            for table in ['Cards', 'Relics', 'Potions', 'Events',
+                          'Encounters']:
+                con.execute('CREATE TABLE {0} AS '
+                            'SELECT * FROM ref.{0}'.format(table))
+            con.commit()
+            con.execute('DETACH DATABASE ref')
+        else:
+            con.execute('CREATE TABLE Cards(Name TEXT, Character TEXT)')
+            con.execute('CREATE TABLE Relics(Name TEXT, Character TEXT)')
+            con.execute('CREATE TABLE Potions(Name TEXT)')
+            con.execute('CREATE TABLE Events(Name TEXT)')
+            con.execute('CREATE TABLE Encounters(Name TEXT, NumEnemies INT, '
+                        'MaxEnemiesSplit INT, MaxGoldReward INT)')
+            con.executemany('INSERT INTO Cards VALUES (?, ?)', _cards)
+            con.executemany('INSERT INTO Relics VALUES (?, ?)', _relics)
+            con.executemany('INSERT INTO Potions VALUES (?)',
+                            [(p,) for p in _potions])
+            con.executemany('INSERT INTO Events VALUES (?)',
+                            [(e,) for e in _events])
+            con.executemany('INSERT INTO Encounters VALUES (?, ?, ?, ?)',
+                            _encounters)
+        con.commit()
+    finally:
+        con.close()
+
+# a synthetic run event. Most runs are consistent enough to pass cleaning;
+# a share of them have the kinds of defects the validators reject.
+def synthetic_run(rng, play_id):
+    character = rng.choice(list(_characters))
+    max_hp, starter, suffix = _characters[character]
+    class_cards = [c for c, ch in _cards if ch == character]
+    floor_reached = rng.randint(3, 56)
+    victory = floor_reached >= 51
+    fights = [e[0] for e in _encounters]
+
+    path = [rng.choice('MMM?$RE') for f in range(floor_reached - 1)]
+    gold_per_floor = [99]
+    current_hp = [max_hp]
+    for f in range(2, floor_reached):
+        gold = gold_per_floor[-1]
+        if path[f - 1] in 'ME':
+            gold += rng.randint(10, 20)
+        gold_per_floor.append(gold)
+        current_hp.append(max(1, min(max_hp,
+                                     current_hp[-1] + rng.randint(-12, 6))))
+
+    card_choices = []
+    damage_taken = []
+    for f in range(1, floor_reached):
+        if path[f - 1] not in 'ME':
+            continue
+        damage_taken.append({'floor':f, 'enemies':rng.choice(fights),
+                             'damage':rng.randint(0, 20),
+                             'turns':rng.randint(1, 8)})
+        offered = rng.sample(class_cards, 3)
+        picked = offered.pop(0) if rng.random() < 0.8 else 'SKIP'
+        if picked != 'SKIP' and rng.random() < 0.2:
+            picked += '+1'
+        card_choices.append({'floor':f, 'picked':picked,
+                             'not_picked':offered})
+
+    shared_relics = [r for r, ch in _relics if ch == 'ALL']
+    relics_obtained = [{'floor':f, 'key':rng.choice(shared_relics)}
+                       for f in range(5, floor_reached, 9)]
+    event_choices = [{'floor':f, 'event_name':rng.choice(_events),
+                      'player_choice':'Ignored', 'damage_taken':0,
+                      'damage_healed':0, 'max_hp_gain':0, 'max_hp_loss':0,
+                      'gold_gain':0, 'gold_loss':0}
+                     for f in range(2, floor_reached, 11)]
+    campfire_choices = [{'floor':f, 'key':'REST'}
+                        for f in range(15, floor_reached, 17)]
+    potions_obtained = [{'floor':f, 'key':rng.choice(_potions)}
+                        for f in range(4, floor_reached, 13)]
+
+    rundict = {
+        'ascension_level':rng.randint(0, 20),
+        'gold':gold_per_floor[-1],
+        'player_experience':rng.randint(0, 1000000),
+        'is_trial':False,
+        'is_prod':False,
+        'is_daily':False,
+        'chose_seed':rng.random() < 0.05,
+        'is_endless':False,
+        'floor_reached':floor_reached,
+        'character_chosen':character,
+        'victory':victory,
+        'play_id':play_id,
+        'build_version':'2020-07-30',
+        'timestamp':1590000000 + rng.randint(0, 10000000),
+        'playtime':rng.randint(300, 5000),
+        'seed_played':str(rng.randint(0, 10 ** 12)),
+        'score':rng.randint(0, 2000),
+        'neow_bonus':rng.choice(['THREE_CARDS', 'ONE_RANDOM_RARE_CARD',
+                                 'REMOVE_CARD', 'THREE_ENEMY_KILL']),
+        'neow_cost':'NONE',
+        'card_choices':card_choices,
+        'relics_obtained':relics_obtained,
+        'event_choices':event_choices,
+        'damage_taken':damage_taken,
+        'campfire_choices':campfire_choices,
+        'potions_obtained':potions_obtained,
+        'potions_floor_usage':[],
+        'potions_floor_spawned':[p['floor'] for p in potions_obtained],
+        'items_purchased':[],
+        'item_purchase_floors':[],
+        'items_purged':[],
+        'items_purged_floors':[],
+        'boss_relics':[],
+        'gold_per_floor':gold_per_floor,
+        'current_hp_per_floor':current_hp,
+        'max_hp_per_floor':[max_hp] * (floor_reached - 1),
+        'path_per_floor':path,
+        'path_taken':[p for p in path if p != 'B'],
+        'master_deck':(['Strike_' + suffix] * 5 + ['Defend_' + suffix] * 4
+                       + [c['picked'] for c in card_choices
+                          if c['picked'] != 'SKIP']),
+        'relics':[starter] + [r['key'] for r in relics_obtained]
+        }
+    if not victory:
+        rundict['killed_by'] = rng.choice(fights)
+
+    defect = rng.random()
+    if defect < 0.05:
+        rundict['current_hp_per_floor'] = [max_hp * 2] * (floor_reached - 1)
+    elif defect < 0.1:
+        rundict['items_purchased'] = ['Bogus Card']
+        rundict['item_purchase_floors'] = [1]
+    elif defect < 0.15:
+        rundict['floor_reached'] = -1
+    return rundict
+
+# writes nfiles dump files of runs_per_file runs each to outdir, as
+# .json.gz files and as a 7z archive (dump.7z) of .json files. Returns the
+# names of the .json.gz files.
+def write_dump(outdir, nfiles, runs_per_file, seed = 0):
+    rng = random.Random(seed)
+    os.makedirs(outdir, exist_ok = True)
+    names = []
+    play_id = 0
+    with SevenZipFile(os.path.join(outdir, 'dump.7z'), 'w') as archive:
+        for i in range(nfiles):
+            date = first_date + datetime.timedelta(hours = i)
+            name = date.strftime('%Y-%m-%d-%H-%M')
+            runs = []
+            for j in range(runs_per_file):
+                runs.append({'event':synthetic_run(rng, 'bench-{:09d}'
+                                                   .format(play_id))})
+                play_id += 1
+            data = json.dumps(runs).encode()
+            with open(os.path.join(outdir, name + '.json.gz'), 'wb') as f:
+                f.write(gzip.compress(data, compresslevel = 6))
+            archive.writestr(data, name + '.json')
+            names.append(name + '.json.gz')
+    return names
+
+# writes a solid 7z archive of nmembers .json members with runs_per_member
+# runs each to path, and times a pass of sources.iter_7z over it. Reading
+# the members of a solid archive one at a time is quadratic in their number.
+def time_read_7z(path, nmembers, runs_per_member, seed = 0):
+    rng = random.Random(seed)
+    with SevenZipFile(path, 'w') as archive:
+        for i in range(nmembers):
+            runs = [{'event':synthetic_run(rng, 'read-{}-{}'.format(i, j))}
+                    for j in range(runs_per_member)]
+            archive.writestr(json.dumps(runs).encode(),
+                             '{:05d}.json'.format(i))
+    t0 = time.perf_counter()
+    nbytes = sum(len(src) for _, src, _ in sources.iter_7z(path))
+    seconds = time.perf_counter() - t0
+    return {'members':nmembers, 'archive_mb':os.path.getsize(path) / 1048576,
+            'mb':nbytes / 1048576, 'seconds':seconds}
+
+# adds the files of the dump to the Files table as not yet imported
+def register_files(dbpath, names):
+    con = sqlite3.connect(dbpath)
+    try:
+        con.executemany('INSERT INTO Files VALUES (?, 0)',
+                        [(datahelper.datetime_tosqlite(n[:16]),)
+                         for n in names])
+        con.commit()
+    finally:
+        con.close()
+
+# times each import stage separately, in a single process: reading and
+# decompressing the files, parsing the json, cleaning the runs and
+# inserting the rows
+def time_stages(dbpath, jsondir, names):
+    stages = {'decompress':0.0, 'parse':0.0, 'clean':0.0, 'insert':0.0}
+    nruns = 0
+    con = sqlite3.connect(dbpath, isolation_level = None)
+    cur = con.cursor()
+    try:
+        datahelper._prepare_tables(cur)
+        game_dict = datahelper._game_dict(cur)
+        for name in names:
+            t0 = time.perf_counter()
+            with open(os.path.join(jsondir, name), 'rb') as f:
+                data = gzip.decompress(f.read())
+            t1 = time.perf_counter()
+            runs = list(jsonstream.iter_runs(io.BytesIO(data)))
+            t2 = time.perf_counter()
+            batch = next(datahelper._batches(
+                datahelper._clean_runs(runs, name[:16], game_dict)),
+                ({}, {}))
+            t3 = time.perf_counter()
+            cur.execute('BEGIN')
+            datahelper._insert_clean_rows(cur, batch)
+            datahelper._update_meta(cur, name[:16])
+            cur.execute('COMMIT')
+            t4 = time.perf_counter()
+
+            stages['decompress'] += t1 - t0
+            stages['parse'] += t2 - t1
+            stages['clean'] += t3 - t2
+            stages['insert'] += t4 - t3
+            nruns += len(runs)
+    finally:
+        datahelper._forget_caches(cur)
+        con.close()
+    total = sum(stages.values())
+    return {'seconds':stages,
+            'share':{s:t / total for s, t in stages.items()},
+            'runs_per_sec':{s:nruns / t if t > 0 else None
+                            for s, t in stages.items()}}
+
+# runs one importer on a fresh copy of the benchmark database
+def time_import(importer, basedb, dbpath, nruns):
+    shutil.copy(basedb, dbpath)
+    t0 = time.perf_counter()
+    rows = importer(dbpath)[0]
+    seconds = time.perf_counter() - t0
+    return {'seconds':seconds, 'runs_per_sec':nruns / seconds,
+            'rows_inserted':rows}
+
+# Generates a synthetic dump of nfiles files with runs_per_file runs each
+# and benchmarks the importers on it, and times a pass over a solid archive
+# of nmembers members (none if 0). Returns the report as a dictionary and
+# writes it to report_path as json if given. Files are generated in workdir
+# (a temporary directory by default, removed afterwards).
+def run_benchmark(nfiles = 8, runs_per_file = 500, processes = 1,
+                  bulk = False, seed = 0, reference_db = None,
+                  workdir = None, report_path = None, trace_memory = True,
+                  verbose = True, nmembers = 300):
+    tmp = tempfile.mkdtemp(dir = workdir)
+    try:
+        dumpdir = os.path.join(tmp, 'dump')
+        basedb = os.path.join(tmp, 'base.db')
+        dbpath = os.path.join(tmp, 'bench.db')
+        nruns = nfiles * runs_per_file
+
+        t0 = time.perf_counter()
+        names = write_dump(dumpdir, nfiles, runs_per_file, seed = seed)
+        make_database(basedb, reference_db = reference_db)
+        register_files(basedb, names)
+        generate_seconds = time.perf_counter() - t0
+        if verbose:
+            print('generated {} runs in {} files ({:.1f} s)'.format(
+                nruns, nfiles, generate_seconds))
+
+        archive = os.path.join(dumpdir, 'dump.7z')
+        json_names = [n[:-3] for n in names]
+        importers = {
+            'jsongz':lambda db: datahelper.pipe_jsongz(
+                db, dumpdir, names, verbose = False, processes = processes,
+                bulk = bulk),
+            'json7z':lambda db: datahelper.pipe_json7z(
+                db, archive, json_names, verbose = False,
+                processes = processes, bulk = bulk)
+            }
+        results = {}
+        for key, importer in importers.items():
+            results[key] = time_import(importer, basedb, dbpath, nruns)
+            if verbose:
+                print('{}: {:.0f} runs/sec'.format(
+                    key, results[key]['runs_per_sec']))
+
+        shutil.copy(basedb, dbpath)
+        stages = time_stages(dbpath, dumpdir, names)
+        if verbose:
+            print('stages (s): {}'.format(', '.join(
+                '{} {:.2f}'.format(s, t)
+                for s, t in stages['seconds'].items())))
+
+        read_7z = None
+        if nmembers > 0:
+            read_7z = time_read_7z(os.path.join(tmp, 'members.7z'),
+                                   nmembers, 20, seed = seed)
+            if verbose:
+                print('read_7z: {} members, {:.1f} MB in {:.2f} s'.format(
+                    nmembers, read_7z['mb'], read_7z['seconds']))
+
+        memory = {}
+        if trace_memory:
+            shutil.copy(basedb, dbpath)
+            tracemalloc.start()
+            try:
+                datahelper.pipe_jsongz(dbpath, dumpdir, names,
+                                       verbose = False)
+                memory['peak_traced_mb'] = (tracemalloc.get_traced_memory()[1]
+                                            / 1048576)
+            finally:
+                tracemalloc.stop()
+        if profiling.resource is not None:
+            memory['peak_rss_mb'] = profiling.peak_rss_mb('self')
+            memory['peak_children_rss_mb'] = profiling.peak_rss_mb(
+                'children')
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+    report = {'config':{'files':nfiles, 'runs_per_file':runs_per_file,
+                        'runs':nruns, 'processes':processes, 'bulk':bulk,
+                        'seed':seed, 'reference_db':reference_db,
+                        'members':nmembers},
+              'platform':{'python':platform.python_version(),
+                          'sqlite':sqlite3.sqlite_version,
+                          'machine':platform.machine(),
+                          'system':platform.system()},
+              'generate_seconds':generate_seconds,
+              'importers':results,
+              'stages':stages,
+              'read_7z':read_7z,
+              'memory':memory}
+    if report_path is not None:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent = 2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description = 'benchmark the importers '
+                                     'on a synthetic data dump')
+    parser.add_argument('--files', type = int, default = 8)
+    parser.add_argument('--runs', type = int, default = 500,
+                        help = 'runs per file')
+    parser.add_argument('--processes', type = int, default = 1)
+    parser.add_argument('--bulk', action = 'store_true')
+    parser.add_argument('--members', type = int, default = 300,
+                        help = 'members of the solid 7z read benchmark '
+                        '(0 to skip it)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--reference-db', default = None,
+                        help = 'database to copy the reference tables from')
+    parser.add_argument('--workdir', default = None)
+    parser.add_argument('--no-trace', action = 'store_true',
+                        help = 'skip the tracemalloc pass')
+    parser.add_argument('--out', default = None,
+                        help = 'path of the json report')
+    args = parser.parse_args()
+    report = run_benchmark(nfiles = args.files, runs_per_file = args.runs,
+                           processes = args.processes, bulk = args.bulk,
+                           seed = args.seed,
+                           reference_db = args.reference_db,
+                           workdir = args.workdir,
+                           report_path = args.out,
+                           trace_memory = not args.no_trace,
+                           nmembers = args.members)
+    if args.out is None:
+        print(json.dumps(report, indent = 2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Bulk-load mode for the importers. While a load runs, the database uses a
+# WAL (or no) journal, relaxed syncing, a large page cache and memory mapped
+# io, and the secondary indexes of the loaded tables are dropped so that
+# they are built once at the end instead of being updated row by row.
+# Afterwards the indexes are rebuilt, ANALYZE is run and the database is
+# returned to its normal configuration.
+#
+# Dropped indexes are recorded in the PendingIndexes table in the same
+# transaction that drops them, so if a load is killed before they are
+# rebuilt, the next bulk load (or restore_indexes) recreates them. Unique
+# indexes are left in place since the inserts rely on them.
+from contextlib import contextmanager
+
+_pragmas = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size']
+
+def _pragma(con, name):
+    return con.execute('PRAGMA {}'.format(name)).fetchone()[0]
+
+def _secondary_indexes(con, tables):
+    qmarks = ','.join(['?'] * len(tables))
+    query = ('SELECT name, sql FROM sqlite_master WHERE type = \'index\' '
+             'AND sql IS NOT NULL AND tbl_name IN ({})'.format(qmarks))
+    return [(name, sql) for name, sql in con.execute(query, tables)
+            if not sql.upper().startswith('CREATE UNIQUE')]
+
+def _drop_indexes(con, tables):
+    con.execute('CREATE TABLE IF NOT EXISTS PendingIndexes('
+                'Name TEXT PRIMARY KEY, Sql TEXT NOT NULL)')
+    indexes = _secondary_indexes(con, tables)
+    con.execute('BEGIN')
+    try:
+        for name, sql in indexes:
+            con.execute('INSERT OR REPLACE INTO PendingIndexes VALUES (?, ?)',
+                        (name, sql))
+            con.execute('DROP INDEX "{}"'.format(name))
+    except Exception as err:
+        con.execute('ROLLBACK')
+        raise err
+    con.execute('COMMIT')
+    return [name for name, sql in indexes]
+
+# rebuilds the indexes dropped by a bulk load and runs ANALYZE. Returns the
+# names of the rebuilt indexes.
+def restore_indexes(con, analyze = True):
+    exists = con.execute('SELECT COUNT(*) FROM sqlite_master WHERE '
+                         'type = \'table\' AND name = \'PendingIndexes\''
+                         ).fetchone()[0]
+    if exists == 0:
+        return []
+    pending = con.execute('SELECT Name, Sql FROM PendingIndexes').fetchall()
+    con.execute('BEGIN')
+    try:
+        for name, sql in pending:
+            con.execute(sql.replace('CREATE INDEX',
+                                    'CREATE INDEX IF NOT EXISTS', 1))
+        con.execute('DROP TABLE PendingIndexes')
+    except Exception as err:
+        con.execute('ROLLBACK')
+        raise err
+    con.execute('COMMIT')
+    if analyze and len(pending) > 0:
+        con.execute('ANALYZE')
+    return [name for name, sql in pending]
+
+# Puts the connection (opened with isolation_level = None) in bulk-load mode
+# for the duration of the with block. journal is 'wal' or 'off'; with the
+# journal off a failed file can no longer be rolled back, so it should only
+# be used for loads into a database that can be rebuilt from the dump.
+@contextmanager
+def bulk_load(con, tables, journal = 'wal', cache_mb = 512, mmap_mb = 1024,
+              analyze = True):
+    if journal not in ('wal', 'off'):
+        raise ValueError('journal must be \'wal\' or \'off\'')
+    saved = {p:_pragma(con, p) for p in _pragmas}
+
+    restore_indexes(con, analyze = False)
+    con.execute('PRAGMA journal_mode = {}'.format(journal))
+    con.execute('PRAGMA synchronous = OFF')
+    con.execute('PRAGMA cache_size = {}'.format(-1024 * cache_mb))
+    con.execute('PRAGMA mmap_size = {}'.format(1048576 * mmap_mb))
+    try:
+        _drop_indexes(con, list(tables))
+        yield con
+    finally:
+        if con.in_transaction:
+            con.execute('ROLLBACK')
+        con.execute('PRAGMA synchronous = FULL')
+        try:
+            restore_indexes(con, analyze = analyze)
+        finally:
+            for p in _pragmas:
+                con.execute('PRAGMA {} = {}'.format(p, saved[p]))
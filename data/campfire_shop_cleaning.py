@@ -12,6 +12,14 @@ def is_clean(campfire_choices, items_purged_floors, **kwargs):
         
     return True
 
+# is_clean on a runview.RunView
+def check(view, game_dict):
+    if not view.regular:
+        return is_clean(**view.args)
+    purged_floors = view.args['items_purged_floors']
+    return (len(set(view.campfire_floors)) == len(view.campfire_floors)
+            and len(set(purged_floors)) == len(purged_floors))
+
 
 
 # ***test code***
@@ -1,15 +1,22 @@
-from math import ceil
+from collections import Counter, deque
+from contextlib import nullcontext
+from itertools import islice
+from multiprocessing import Pool
 import json
 import sqlite3
-import gzip
-from py7zr import SevenZipFile
 import os
 import datetime
+import time
 import basic_cleaning
-import gold_hp_cleaning
-import campfire_shop_cleaning
-import item_cleaning
-import event_encounter_cleaning
+import gamedata
+import jsonstream
+import sources
+import runtables
+import bulkload
+import runindex
+import profiling
+import verdicts
+import vocab
 
 # converts snake case to camel case
 def snake_to_camel(s):
@@ -71,118 +78,310 @@ def to_sql(o):
     else:
         return (o, 'INT')
 
-def pipe_jsongz(dbpath, jsondir, filenames, verbose = True):
-    skipped_err = []
+# imports .json.gz files from the data dump. With processes > 1 the files are
+# decompressed, parsed and cleaned by a pool of worker processes while this
+# process writes the rows (on Windows, call this under
+# if __name__ == '__main__'). Up to prefetch files are read ahead in the
+# background. With bulk = True (or 'off' for no journal), the load runs in
+# bulk-load mode (see bulkload.py). If profile (a profiling.Profile) is
+# given, stage and validator timings and counters are collected in it.
+def pipe_jsongz(dbpath, jsondir, filenames, verbose = True, processes = 1,
+                prefetch = 4, bulk = False, profile = None):
+    open_members = lambda names: sources.iter_dir(jsondir, names)
+    return _pipe_source(dbpath, open_members, filenames, verbose, processes,
+                        prefetch, bulk, profile)
+
+# imports json files from a 7z archive of the data dump. The archive is
+# decompressed in a single pass; batch_size is no longer used and is kept
+# for compatibility.
+def pipe_json7z(dbpath, archive_path, filenames, verbose = True,
+                batch_size = 200, processes = 1, prefetch = 4, bulk = False,
+                profile = None):
+    open_members = lambda names: sources.iter_7z(archive_path, names)
+    return _pipe_source(dbpath, open_members, filenames, verbose, processes,
+                        prefetch, bulk, profile)
+
+# imports the json files of any dump source: a directory of .json.gz or
+# .json files, a 7z or tar archive, or a single json file. If filenames is
+# None, every json file of the source is imported.
+def pipe_dump(dbpath, path, filenames = None, verbose = True, processes = 1,
+              prefetch = 4, bulk = False, profile = None):
+    if filenames is None:
+        filenames = sources.member_names(path)
+    open_members = lambda names: sources.open_source(path, names)
+    return _pipe_source(dbpath, open_members, filenames, verbose, processes,
+                        prefetch, bulk, profile)
+
+# common driver of the dump importers. The Files manifest is loaded once, and
+# files already in the database are skipped before their source is read;
+# open_members(names) returns the members of the remaining files. Each
+# imported file is checkpointed in Files with its row count and content
+# hash, so an interrupted import resumes after the last committed file.
+def _pipe_source(dbpath, open_members, filenames, verbose, processes,
+                 prefetch, bulk = False, profile = None):
     skipped_indb = []
-    totalinserts = 0
-    allcolsadded = []
+    imported = []
     
     con = sqlite3.connect(dbpath, isolation_level = None)
     cur = con.cursor()
+    try:
+        _prepare_tables(cur)
+        manifest = _load_manifest(cur)
+        names = []
+        dates = set()
+        for name in filenames:
+            date = datetime_tosqlite(name[:16])
+            if date in dates or manifest[date] == 1:
+                skipped_indb.append(name)
+            else:
+                names.append(name)
+                dates.add(date)
+        
+        tables = ['MegaCritData'] + list(runtables.child_tables)
+        with _bulk_mode(con, tables, bulk):
+            members = sources.prefetch(open_members(names),
+                                       depth = prefetch)
+            if processes > 1:
+                added = _pipe_parallel(cur, members, len(names), processes,
+                                       verbose, imported, profile)
+            else:
+                added = _pipe_serial(cur, members, len(names), verbose,
+                                     imported, profile)
+    except KeyboardInterrupt as err:
+        if verbose:
+            last = imported[-1] if len(imported) > 0 else None
+            print('----------------------------\n'
+                  'interrupted. last file imported: {} ({}/{} files '
+                  'imported in this session)\n'
+                  'importing again resumes after the last imported '
+                  'file.'.format(last, len(imported), len(names)))
+        raise err
+    finally:
+        _forget_caches(cur)
+        con.close()
+    totalinserts, allcolsadded, skipped_err, duplicates = added
     
-    filecnt = 1
-    totalfiles = len(filenames)
-    for name in filenames:
+    if profile is not None:
+        profile.finish()
+    if verbose:
+        _print_summary(totalinserts, allcolsadded, skipped_indb, skipped_err,
+                       duplicates)
+        if profile is not None:
+            print('\n' + profile.summary())
+    return (totalinserts, allcolsadded)
+
+# bulk-load mode for the given tables if bulk is set. bulk = True uses a WAL
+# journal, a journal mode name ('wal' or 'off') selects it directly.
+def _bulk_mode(con, tables, bulk):
+    if not bulk:
+        return nullcontext()
+    journal = bulk if isinstance(bulk, str) else 'wal'
+    return bulkload.bulk_load(con, tables, journal = journal)
+
+def _print_summary(totalinserts, allcolsadded, skipped_indb, skipped_err,
+                   duplicates = 0):
+    print('----------------------------\n'
+          'rows inserted: {}\n\n'
+          'duplicate runs skipped: {}\n\n'
+          'columns added: {}\n\n'
+          'skipped (already in database): {} \n\n'
+          'skipped (error): {}'.format(totalinserts, duplicates, allcolsadded,
+                                       skipped_indb, skipped_err))
+
+# columns of MegaCritData written by the cleaning importers before the run's
+# own columns. _clean_runs leaves the item name lists in the packed item
+# columns, which _insert_clean_rows packs (see vocab.py).
+_clean_prefix = ('FileDate', 'Clean', 'AdjustedFloorReached', 'Abandoned',
+                 'Verdicts', 'VerdictsStale') + tuple(vocab.packed_cols)
+_packed_pos = [_clean_prefix.index(col) for col in vocab.packed_cols]
+
+# creates the tables, columns and indexes the cleaning importers write to
+def _prepare_tables(sqlcur, table = 'MegaCritData'):
+    runtables.create_tables(sqlcur)
+    vocab.sync(sqlcur)
+    _unique_play_ids(sqlcur, table)
+    _add_cols(sqlcur, table, [('Verdicts', 'INT'), ('VerdictsStale', 'INT')]
+              + [(col, 'BLOB') for col in vocab.packed_cols])
+    verdicts.init_state(sqlcur)
+
+# checkpoint columns recorded in Files for each imported file
+_checkpoint_cols = [('RowCount', 'INT'), ('ContentHash', 'TEXT'),
+                    ('ImportedAt', 'TEXT')]
+
+# loads the Files manifest into a dictionary {FileDate:InDatabase}
+def _load_manifest(sqlcur):
+    _add_cols(sqlcur, 'Files', _checkpoint_cols)
+    return dict(sqlcur.execute('SELECT FileDate, InDatabase FROM Files'))
+
+# summary of the import progress recorded in the Files manifest
+def import_status(dbpath, verbose = True):
+    con = sqlite3.connect(dbpath)
+    try:
+        _add_cols(con.cursor(), 'Files', _checkpoint_cols)
+        nfiles, nimported, nrows = con.execute(
+            'SELECT COUNT(*), TOTAL(InDatabase = 1), TOTAL(RowCount) '
+            'FROM Files').fetchone()
+        last = con.execute('SELECT FileDate, ImportedAt FROM Files '
+                           'WHERE InDatabase = 1 AND ImportedAt IS NOT NULL '
+                           'ORDER BY ImportedAt DESC, FileDate DESC '
+                           'LIMIT 1').fetchone()
+        first_missing = con.execute('SELECT MIN(FileDate) FROM Files '
+                                    'WHERE InDatabase <> 1').fetchone()[0]
+    finally:
+        con.close()
+    status = {'files':nfiles, 'imported':int(nimported),
+              'remaining':nfiles - int(nimported),
+              'rows':int(nrows), 'last_imported':last,
+              'first_remaining':first_missing}
+    if verbose:
+        print('files imported: {imported}/{files}\n'
+              'rows recorded: {rows}\n'
+              'last imported (file, time): {last_imported}\n'
+              'first remaining file: {first_remaining}'.format(**status))
+    return status
+
+# imports members one at a time in this process, with one transaction per
+# file
+def _pipe_serial(sqlcur, members, totalfiles, verbose, imported,
+                 profile = None):
+    skipped_err = []
+    totalinserts = 0
+    allcolsadded = []
+    duplicates = 0
+    game_dict = _game_dict(sqlcur)
+    
+    for filecnt, member in enumerate(members, 1):
+        name = member[0]
         date = name[:16]
-        path = '{}\\{}'.format(jsondir, name)
-        
         if verbose:
             print('importing {} ({}/{})'.format(name, filecnt, totalfiles))
-            filecnt += 1
-        
-        query = 'SELECT InDatabase FROM Files WHERE FileDate = ?'
-        try:
-            indb = cur.execute(query, (datetime_tosqlite(date),)).fetchone()[0]
-        except Exception as err:
-            con.close()
-            raise err
-        if indb == 1:
-            skipped_indb.append(name)
-            continue
         
-        cur.execute('BEGIN')
+        sqlcur.execute('BEGIN')
         try:
-            with gzip.open(path) as jfile:
-                added = _pipe_clean_json(cur, jfile, date)
-            _update_meta(cur, date)
-            totalinserts += added[0]
-            allcolsadded += added[1]
+            t = profile.start() if profile is not None else None
+            contenthash = sources.member_hash(member)
+            if profile is not None:
+                profile.stop('hash', t)
+            with sources.open_member(member) as jfile:
+                added = _pipe_clean_json(sqlcur, jfile, date,
+                                         game_dict = game_dict,
+                                         profile = profile)
+            t = profile.start() if profile is not None else None
+            _update_meta(sqlcur, date, rowcount = added[0],
+                         contenthash = contenthash)
         except Exception:
             skipped_err.append(name)
-            cur.execute('ROLLBACK')
+            sqlcur.execute('ROLLBACK')
+            _forget_caches(sqlcur)
             continue
-        cur.execute('COMMIT')
+        sqlcur.execute('COMMIT')
+        imported.append(name)
+        totalinserts += added[0]
+        allcolsadded += added[1]
+        duplicates += added[2]
+        if profile is not None:
+            profile.stop('commit', t)
+            profile.count('files')
+            profile.tick()
         
-    con.close()
-    
-    if verbose:
-        print('----------------------------\n'
-              'rows inserted: {}\n\n'
-              'columns added: {}\n\n'
-              'skipped (already in database): {} \n\n'
-              'skipped (error): {}'.format(totalinserts, allcolsadded,
-                                           skipped_indb, skipped_err))
-    return (totalinserts, allcolsadded)
+    return (totalinserts, allcolsadded, skipped_err, duplicates)
 
-def pipe_json7z(dbpath, archive_path, filenames, verbose = True,
-                batch_size = 200):
+# reference tables passed to the cleaning validators in the worker processes
+_worker_game_dict = None
+# whether the workers profile the files they clean
+_worker_profiled = False
+
+def _init_worker(game_dict, profiled = False):
+    global _worker_game_dict, _worker_profiled
+    _worker_game_dict = game_dict
+    _worker_profiled = profiled
+
+# worker task: hashes, decompresses, parses and cleans a single member of a
+# dump source. Rows are None if the member could not be read; repeats are
+# the number of runs dropped as repeats of a run earlier in the file. The
+# last item is the profile data of the file if the workers are profiled.
+def _clean_file(member):
+    name = member[0]
+    date = name[:16]
+    profile = profiling.Profile() if _worker_profiled else None
+    try:
+        t = profile.start() if profile is not None else None
+        contenthash = sources.member_hash(member)
+        if profile is not None:
+            profile.stop('hash', t)
+        with sources.open_member(member) as jfile:
+            rows, repeats = _clean_json_rows(jfile, date, _worker_game_dict,
+                                             profile)
+    except Exception:
+        return (name, date, None, None, 0, None)
+    data = profile.data() if profile is not None else None
+    return (name, date, rows, contenthash, repeats, data)
+
+# like Pool.imap, but keeps at most window tasks in flight so that large
+# archives are not read into memory ahead of the workers
+def _imap_bounded(pool, func, tasks, window):
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+# single writer for the parallel importers. Workers clean the files and this
+# process inserts the rows in file order with one transaction per file.
+def _pipe_parallel(sqlcur, members, totalfiles, processes, verbose,
+                   imported, profile = None):
     skipped_err = []
-    skipped_indb = []
     totalinserts = 0
     allcolsadded = []
+    duplicates = 0
+    game_dict = _game_dict(sqlcur)
     
-    con = sqlite3.connect(dbpath, isolation_level = None)
-    cur = con.cursor()
-    
-    filecnt = 1
-    totalfiles = len(filenames)
-    for batch_num in range(ceil(totalfiles / batch_size)):
-        batch = filenames[batch_num * batch_size:(batch_num + 1) * batch_size]
-        with SevenZipFile(archive_path) as archive:
-            file_dict = archive.read(batch)
-            
-        for name in batch:
-            date = name[:16]
-            
+    initargs = (game_dict, profile is not None)
+    with Pool(processes, _init_worker, initargs) as pool:
+        results = _imap_bounded(pool, _clean_file, members, 2 * processes)
+        if profile is not None:
+            results = profile.timed(results, 'wait')
+        for filecnt, result in enumerate(results, 1):
+            name, date, rows, contenthash, repeats, data = result
+            if profile is not None and data is not None:
+                profile.merge(data)
             if verbose:
-                print('importing {} ({}/{})'.format(name, filecnt, totalfiles))
-                filecnt += 1
-            
-            query = 'SELECT InDatabase FROM Files WHERE FileDate = ?'
-            try:
-                indb = cur.execute(query,
-                                   (datetime_tosqlite(date),)).fetchone()[0]
-            except Exception as err:
-                con.close()
-                raise err
-            if indb == 1:
-                skipped_indb.append(name)
+                print('importing {} ({}/{})'.format(name, filecnt,
+                                                    totalfiles))
+            if rows is None:
+                skipped_err.append(name)
                 continue
             
-            cur.execute('BEGIN')
+            sqlcur.execute('BEGIN')
             try:
-                added = _pipe_clean_json(cur, file_dict[name], date)
-                _update_meta(cur, date)
-                totalinserts += added[0]
-                allcolsadded += added[1]
-            except Exception as err:  # debug
+                t = profile.start() if profile is not None else None
+                added = _insert_clean_rows(sqlcur, rows)
+                if profile is not None:
+                    profile.stop('insert', t)
+                    profile.count('rows', added[0])
+                    profile.count('duplicates', added[2])
+                    t = profile.start()
+                _update_meta(sqlcur, date, rowcount = added[0],
+                             contenthash = contenthash)
+            except Exception:
                 skipped_err.append(name)
-                cur.execute('ROLLBACK')
-                raise err  # debug
+                sqlcur.execute('ROLLBACK')
+                _forget_caches(sqlcur)
                 continue
-            cur.execute('COMMIT')
-        
-    con.close()
-    
-    if verbose:
-        print('----------------------------\n'
-              'rows inserted: {}\n\n'
-              'columns added: {}\n\n'
-              'skipped (already in database): {} \n\n'
-              'skipped (error): {}'.format(totalinserts, allcolsadded,
-                                           skipped_indb, skipped_err))
-    return (totalinserts, allcolsadded)
-    
+            sqlcur.execute('COMMIT')
+            imported.append(name)
+            totalinserts += added[0]
+            allcolsadded += added[1]
+            duplicates += added[2] + repeats
+            if profile is not None:
+                profile.stop('commit', t)
+                profile.count('files')
+                profile.count('duplicates', repeats)
+                profile.tick()
+            
+    return (totalinserts, allcolsadded, skipped_err, duplicates)
     
 def _add_cols(sqlcur, table, newcols):
     colsadded = []
@@ -197,144 +396,413 @@ def _add_cols(sqlcur, table, newcols):
             colsadded.append(col)
     return colsadded
 
+# removes the duplicate runs of a table, keeping the first imported copy of
+# each PlayId. The child table rows (see runtables) of MegaCritData runs
+# that had copies held the rows of every copy; they are rebuilt from the
+# kept copy. Runs in the caller's transaction. Returns the number of runs
+# removed.
+def _remove_duplicate_runs(sqlcur, table):
+    sqlcur.execute('DROP TABLE IF EXISTS temp.DuplicatePlayIds')
+    sqlcur.execute('CREATE TEMP TABLE DuplicatePlayIds AS '
+                   'SELECT PlayId, MIN(rowid) AS Kept FROM {} '
+                   'WHERE PlayId IS NOT NULL GROUP BY PlayId '
+                   'HAVING COUNT(*) > 1'.format(table))
+    try:
+        sqlcur.execute('DELETE FROM {} WHERE PlayId IN '
+                       '(SELECT PlayId FROM temp.DuplicatePlayIds) '
+                       'AND rowid NOT IN '
+                       '(SELECT Kept FROM temp.DuplicatePlayIds)'
+                       .format(table))
+        removed = sqlcur.rowcount
+        if removed > 0 and table == 'MegaCritData':
+            runtables.rebuild_runs(sqlcur, 'SELECT PlayId FROM '
+                                   'temp.DuplicatePlayIds', table)
+    finally:
+        sqlcur.execute('DROP TABLE temp.DuplicatePlayIds')
+    return removed
+
+def _create_play_id_index(sqlcur, table):
+    sqlcur.execute('CREATE UNIQUE INDEX IF NOT EXISTS {0}_PlayId '
+                   'ON {0}(PlayId)'.format(table))
+
+# makes PlayId unique in table, so that inserting a run that is already in
+# the table is a no-op (inserts use INSERT OR IGNORE). Tables imported
+# before PlayId was unique can hold duplicate runs: these are removed first,
+# once, in their own transaction unless one is open, and the number of runs
+# removed is printed.
+def _unique_play_ids(sqlcur, table):
+    _add_cols(sqlcur, table, [('PlayId', 'TEXT')])
+    try:
+        _create_play_id_index(sqlcur, table)
+        return
+    except sqlite3.IntegrityError:
+        pass
+    own = not sqlcur.connection.in_transaction
+    if own:
+        sqlcur.execute('BEGIN')
+    try:
+        removed = _remove_duplicate_runs(sqlcur, table)
+        _create_play_id_index(sqlcur, table)
+        if own:
+            sqlcur.execute('COMMIT')
+    except Exception as err:
+        if own and sqlcur.connection.in_transaction:
+            sqlcur.execute('ROLLBACK')
+            _forget_caches(sqlcur)
+        raise err
+    print('{}: removed {} duplicate runs to make PlayId unique'.format(
+        table, removed))
+
+# removes the duplicate runs of a table, keeping the first imported copy of
+# each PlayId, rebuilds the child table rows of the runs that had copies and
+# adds the unique PlayId index, in one transaction
+def dedup_play_ids(dbpath, table = 'MegaCritData'):
+    con = sqlite3.connect(dbpath, isolation_level = None)
+    cur = con.cursor()
+    try:
+        _add_cols(cur, table, [('PlayId', 'TEXT')])
+        cur.execute('BEGIN')
+        removed = _remove_duplicate_runs(cur, table)
+        _create_play_id_index(cur, table)
+        cur.execute('COMMIT')
+    except Exception as err:
+        if con.in_transaction:
+            cur.execute('ROLLBACK')
+        raise err
+    finally:
+        runtables.forget(cur)
+        con.close()
+    print('duplicate runs removed from {}: {}'.format(table, removed))
+    return removed
+
 # method for importing files from the data dump        
-def _pipe_json(sqlcur, jsonrb, filedate, table = 'FullData'):
+def _pipe_json(sqlcur, jsonrb, filedate, table = 'FullData',
+               batch_size = 1000):
     rowsadded = 0
     colsadded = []
-    jdict_raw = json.load(jsonrb)
-    jdict = [jrun['event'] for jrun in jdict_raw]
-
-    for rundict in jdict:
-        keys = [snake_to_camel(key) for key in rundict.keys()]
-        values = list(rundict.values())
-        keystr = ','.join(keys)
-        colstr = 'FileDate,' + keystr
-        sqlvalues = [to_sql(val) for val in values]
-        row = [datetime_tosqlite(filedate)] + [vt[0] for vt in sqlvalues]
-        
-        qmarks = ','.join(['?'] * len(row))
-        query = 'INSERT INTO {}({}) VALUES ({})'.format(table, colstr, qmarks)
+    sqldate = datetime_tosqlite(filedate)
+    triples = ((_columns(tuple(rundict)),
+                [sqldate] + [_sql_value(val) for val in rundict.values()],
+                None)
+               for rundict in jsonstream.iter_runs(jsonrb))
+    
+    for batches, _ in _batches(triples, batch_size):
+        added = _insert_batches(sqlcur, batches, table, ('FileDate',))
+        rowsadded += added[0]
+        colsadded += added[1]
+    return (rowsadded, colsadded)
+
+# game information used by the cleaning validators, loaded once per import
+# session and reloaded only when the reference tables change
+def _game_dict(sqlcur):
+    return gamedata.load(sqlcur).game_dict()
+
+# cleans runs and converts them to rows, yielding (cols, row, children)
+# triples where cols is the column signature (the tuple of column names) of
+# the run. If seen (a Counter) is given, runs whose play id was seen before
+# are counted in it and dropped before they are cleaned. Runs are validated
+# chunk_size at a time (see verdicts.evaluate_batch). If profile is given,
+# cleaning is timed as the 'clean' stage.
+def _clean_runs(runs, filedate, game_dict, seen = None, profile = None,
+                chunk_size = 1000):
+    sqldate = datetime_tosqlite(filedate)
+    relic_names = game_dict['relic_names']
+    runs = iter(_unseen(runs, seen))
+    while True:
+        chunk = list(islice(runs, chunk_size))
+        if len(chunk) == 0:
+            return
+        if profile is not None:
+            t = profile.start()
+        triples = []
+        nclean = 0
+        results = verdicts.evaluate_batch(chunk, game_dict,
+                                          profile = profile)
+        for rundict, (failed, stale) in zip(chunk, results):
+            clean = failed == 0
+            nclean += clean
+            row = ([sqldate, 
+                   int(clean), 
+                   basic_cleaning.adjusted_floor_reached(**rundict),
+                   int(basic_cleaning.is_abandoned(**rundict)),
+                   failed,
+                   stale]
+                   + [rundict.get(key) for key in vocab.packed_cols.values()]
+                   + [_sql_value(val) for val in rundict.values()])
+            children = runtables.run_rows(rundict, relic_names)
+            triples.append((_columns(tuple(rundict)), row, children))
+        if profile is not None:
+            profile.stop('clean', t, len(chunk))
+            profile.count('runs', len(chunk))
+            profile.count('clean', nclean)
+        yield from triples
+
+# drops runs whose play id is already counted in seen
+def _unseen(runs, seen):
+    if seen is None:
+        return runs
+    return _drop_seen(runs, seen)
+
+def _drop_seen(runs, seen):
+    for rundict in runs:
+        play_id = rundict.get('play_id')
+        if play_id is not None:
+            seen[play_id] += 1
+            if seen[play_id] > 1:
+                continue
+        yield rundict
+
+# groups (cols, row, children) triples into batches of at most batch_size
+# rows (no limit if batch_size is None). A batch is a pair of dictionaries:
+# one mapping each column signature to its list of rows, and one mapping
+# each child table (see runtables) to its rows. children may be None.
+def _batches(triples, batch_size = None):
+    batches = {}
+    children = {}
+    n = 0
+    for cols, row, run_children in triples:
+        if cols in batches:
+            batches[cols].append(row)
+        else:
+            batches[cols] = [row]
+        if run_children is not None:
+            for table, rows in run_children.items():
+                if table in children:
+                    children[table] += rows
+                else:
+                    children[table] = rows
+        n += 1
+        if n == batch_size:
+            yield (batches, children)
+            batches = {}
+            children = {}
+            n = 0
+    if n > 0:
+        yield (batches, children)
+
+# number of runs counted in seen (see _clean_runs) that were dropped as
+# repeats
+def _repeats(seen):
+    return sum(seen.values()) - len(seen)
+
+# parses and cleans all runs of a json file from the data dump, returning
+# them as a single batch, together with the number of runs dropped as
+# repeats of a run earlier in the file. Does not touch the database, so it
+# can run in a worker process.
+def _clean_json_rows(jsonrb, filedate, game_dict, profile = None):
+    runs = _parsed_runs(jsonrb, profile)
+    seen = Counter()
+    batch = next(_batches(_clean_runs(runs, filedate, game_dict, seen,
+                                      profile)),
+                 ({}, {}))
+    return (batch, _repeats(seen))
+
+# runs of a json file from the data dump. If profile is given, reading the
+# (decompressed) file is timed as the 'decompress' stage and parsing as the
+# 'parse' stage.
+def _parsed_runs(jsonrb, profile = None):
+    if profile is None:
+        return jsonstream.iter_runs(jsonrb)
+    runs = jsonstream.iter_runs(profile.reader(jsonrb, 'decompress'))
+    return profile.timed(runs, 'parse', inner = 'decompress')
+
+# json keys already converted to column names, by key signature
+_column_cache = {}
+
+def _columns(keys):
+    cols = _column_cache.get(keys)
+    if cols is None:
+        cols = tuple(snake_to_camel(key) for key in keys)
+        _column_cache[keys] = cols
+    return cols
+
+# fast path of to_sql for the exact json types, returning only the value
+def _sql_value(o):
+    t = type(o)
+    if t is str or t is int or t is float:
+        return o
+    elif t is bool:
+        return int(o)
+    elif t is list or t is dict:
+        return json.dumps(o)
+    else:
+        return to_sql(o)[0]
+
+# sql type of a value already converted by to_sql
+def _sql_type(v):
+    if isinstance(v, float):
+        return 'REAL'
+    elif isinstance(v, int):
+        return 'INT'
+    else:
+        return 'TEXT'
+
+# prepared insert statements, by table, prefix columns and column signature
+_query_cache = {}
+
+def _insert_query(table, prefix, cols):
+    query = _query_cache.get((table, prefix, cols))
+    if query is None:
+        colstr = ','.join(prefix + cols)
+        qmarks = ','.join(['?'] * (len(prefix) + len(cols)))
+        query = 'INSERT OR IGNORE INTO {}({}) VALUES ({})'.format(table,
+                                                                  colstr,
+                                                                  qmarks)
+        _query_cache[(table, prefix, cols)] = query
+    return query
+
+# known columns of each table, by connection: {id(con):(con, {table:
+# (columns, checked_signatures)})}. The connection is kept with its entry so
+# that its id cannot be reused while the entry exists.
+_schemas = {}
+
+def _table_schema(sqlcur, table):
+    con = sqlcur.connection
+    if id(con) not in _schemas:
+        _schemas[id(con)] = (con, {})
+    tables = _schemas[id(con)][1]
+    if table not in tables:
+        query = 'SELECT name FROM pragma_table_info(\'{}\')'.format(table)
+        tables[table] = (set(r[0] for r in sqlcur.execute(query)), set())
+    return tables[table]
+
+# drops the cached schema and item ids of a connection, e.g. after a
+# rollback has undone columns or items added in the transaction
+def _forget_caches(sqlcur):
+    _schemas.pop(id(sqlcur.connection), None)
+    runtables.forget(sqlcur)
+
+# adds the new columns of all column signatures in batches before any row is
+# inserted, so that inserts do not fail on missing columns. Signatures seen
+# before are skipped with a single set lookup.
+def _prepare_cols(sqlcur, batches, table, prefix):
+    colsadded = []
+    known, checked = _table_schema(sqlcur, table)
+    for cols, rows in batches.items():
+        if cols in checked:
+            continue
+        newcols = [(col, _sql_type(rows[0][len(prefix) + i]))
+                   for i, col in enumerate(cols) if col not in known]
+        if len(newcols) > 0:
+            colsadded += _add_cols(sqlcur, table, newcols)
+            known.update(col for col, _ in newcols)
+        checked.add(cols)
+    return colsadded
+
+# inserts batches of rows grouped by column signature with one executemany
+# per signature. New columns are added up front; the schema is only reread
+# if an insert still fails because the cache was stale. Rows whose PlayId
+# is already in the table are ignored and counted as duplicates.
+def _insert_batches(sqlcur, batches, table, prefix):
+    rowsadded = 0
+    duplicates = 0
+    con = sqlcur.connection
+    colsadded = _prepare_cols(sqlcur, batches, table, prefix)
+    for cols, rows in batches.items():
+        query = _insert_query(table, prefix, cols)
+        changes = con.total_changes
         try:
-            sqlcur.execute(query, row)
-            rowsadded += 1
+            sqlcur.executemany(query, rows)
         except sqlite3.OperationalError:
-            sqltypes = [vt[1] for vt in sqlvalues]
-            colsch = [(keys[i], sqltypes[i]) for i in range(len(keys))]
+            _forget_caches(sqlcur)
+            values = rows[0][len(prefix):]
+            colsch = [(col, _sql_type(values[i]))
+                      for i, col in enumerate(cols)]
             colsadded += _add_cols(sqlcur, table, colsch)
-            sqlcur.execute(query, row)
-            rowsadded += 1
-    return (rowsadded, colsadded)
+            changes = con.total_changes
+            sqlcur.executemany(query, rows)
+        inserted = con.total_changes - changes
+        rowsadded += inserted
+        duplicates += len(rows) - inserted
+    return (rowsadded, colsadded, duplicates)
+
+# inserts a batch of cleaned runs and their child table rows. Child rows
+# of runs ignored as duplicates are dropped.
+def _insert_clean_rows(sqlcur, batch, table = 'MegaCritData'):
+    batches, children = batch
+    prefix = _clean_prefix
+    for rows in batches.values():
+        for row in rows:
+            for i in _packed_pos:
+                row[i] = vocab.pack(sqlcur, row[i])
+    lastrow = sqlcur.execute('SELECT MAX(rowid) FROM {}'
+                             .format(table)).fetchone()[0]
+    added = _insert_batches(sqlcur, batches, table, prefix)
+    if added[2] > 0:
+        query = 'SELECT PlayId FROM {} WHERE rowid > ?'.format(table)
+        new_ids = set(r[0] for r in sqlcur.execute(query, (lastrow or 0,)))
+        children = {child:[r for r in rows if r[0] in new_ids]
+                    for child, rows in children.items()}
+    runtables.insert_rows(sqlcur, children)
+    return added
 
 # method for importing files from the data dump while performing
-# data cleansing
-def _pipe_clean_json(sqlcur, jsonrb, filedate, table = 'MegaCritData'):
-    game_dict = {}
-    
-    card_names_sql = sqlcur.execute('SELECT Name FROM Cards')
-    game_dict['card_names'] = [r[0] for r in card_names_sql]
-    
-    relic_names_sql = sqlcur.execute('SELECT Name FROM Relics')
-    game_dict['relic_names'] = [r[0] for r in relic_names_sql]
-    
-    potion_names_sql = sqlcur.execute('SELECT Name FROM Potions')
-    game_dict['potion_names'] = [r[0] for r in potion_names_sql]
-    
-    event_names_sql = sqlcur.execute('SELECT Name FROM Events')
-    game_dict['event_names'] = [r[0] for r in event_names_sql]
-    
-    encounters_sql = sqlcur.execute('SELECT Name, '
-                                    'MAX(NumEnemies, MaxEnemiesSplit), '
-                                    'MaxGoldReward '
-                                    'FROM Encounters')
-    encounters = {}
-    for r in encounters_sql:
-        encounters[r[0]] = (r[1], r[2])
-    game_dict['encounters'] = encounters
-    
+# data cleansing. Runs are parsed one at a time and inserted every
+# batch_size runs, so memory use does not grow with the size of the file.
+def _pipe_clean_json(sqlcur, jsonrb, filedate, table = 'MegaCritData',
+                     game_dict = None, batch_size = 1000, profile = None):
+    if game_dict is None:
+        game_dict = _game_dict(sqlcur)
     rowsadded = 0
     colsadded = []
-    jdict_raw = json.load(jsonrb)
-    jdict = [jrun['event'] for jrun in jdict_raw]
-
-    for rundict in jdict:
-        keys = [snake_to_camel(key) for key in rundict.keys()]
-        values = list(rundict.values())
-        keystr = ','.join(keys)
-        colstr = 'FileDate, Clean, AdjustedFloorReached, Abandoned, ' + keystr
-        sqlvalues = [to_sql(val) for val in values]
-        row = ([datetime_tosqlite(filedate), 
-               int(_is_clean(rundict, game_dict)), 
-               basic_cleaning.adjusted_floor_reached(**rundict),
-               int(basic_cleaning.is_abandoned(**rundict))] 
-               + [vt[0] for vt in sqlvalues])
-        qmarks = ','.join(['?'] * len(row))
-        query = 'INSERT INTO {}({}) VALUES ({})'.format(table, colstr, qmarks)
-        try:
-            sqlcur.execute(query, row)
-            rowsadded += 1
-        except sqlite3.OperationalError:
-            sqltypes = [vt[1] for vt in sqlvalues]
-            colsch = [(keys[i], sqltypes[i]) for i in range(len(keys))]
-            colsadded += _add_cols(sqlcur, table, colsch)
-            sqlcur.execute(query, row)
-            rowsadded += 1
-    return (rowsadded, colsadded)
+    duplicates = 0
+    seen = Counter()
+    triples = _clean_runs(_parsed_runs(jsonrb, profile), filedate, game_dict,
+                          seen, profile)
+    
+    for batch in _batches(triples, batch_size):
+        t = profile.start() if profile is not None else None
+        added = _insert_clean_rows(sqlcur, batch, table = table)
+        rowsadded += added[0]
+        colsadded += added[1]
+        duplicates += added[2]
+        if profile is not None:
+            profile.stop('insert', t)
+            profile.count('rows', added[0])
+            profile.count('duplicates', added[2])
+            profile.tick()
+    if profile is not None:
+        profile.count('duplicates', _repeats(seen))
+    return (rowsadded, colsadded, duplicates + _repeats(seen))
 
-# performs all data cleansing procedures on a run. json_dict is the json
+# performs all data cleansing procedures on a run (the validators are listed
+# in verdicts.py). json_dict is the json
 # dictionary from the Mega Crit data set, and game_dict is a dictionary of
-# game information: 
+# game information (see gamedata.GameData): 
 # { 'card_names':set, 'relic_names':set, 'potion_names':set,
 #   'event_names':set,
-#   'encounters':dict{'encounter_name':(max_fatalities, max_gold_reward)} }
+#   'encounters':dict{'encounter_name':(max_fatalities, max_gold_reward)},
+#   'item_names':set, 'encounter_names':set }
 def _is_clean(json_dict, game_dict):
-    args_dict = json_dict.copy()
-    if 'killed_by' not in json_dict:
-        args_dict['killed_by'] = None
-    if 'neow_bonus' not in json_dict:
-        args_dict['neow_bonus'] = None
-    if 'neow_cost' not in json_dict:
-        args_dict['neow_cost'] = None
-    return (basic_cleaning.is_clean(**args_dict)
-            and campfire_shop_cleaning.is_clean(**args_dict)
-            and item_cleaning.is_clean(**args_dict, **game_dict)
-            and event_encounter_cleaning.is_clean(**args_dict, **game_dict)
-            and gold_hp_cleaning.is_clean(**args_dict, **game_dict))
+    return verdicts.evaluate(json_dict, game_dict)[0] == 0
 
 # method for importing individual .run files
 def _pipe_run(sqlcur, runrb, filedate, table = 'MyData'):
-    rowsadded = 0
-    colsadded = []
-    rundict = json.load(runrb)
+    return _insert_run(sqlcur, json.load(runrb), filedate, table)
 
-    keys = list(rundict.keys())
-    values = list(rundict.values())
-    for i, key in enumerate(keys):
-        keys[i] = snake_to_camel(key)
-        
-    keystr = ','.join(keys)
-    colstr = 'FileDate,' + keystr
-    sqlvalues = [to_sql(val) for val in values]
-    row = [filedate] + [vt[0] for vt in sqlvalues]
-    
-    qmarks = ','.join(['?'] * len(row))
-    query = 'INSERT INTO {}({}) VALUES ({})'.format(table, colstr, qmarks)
-    try:
-        sqlcur.execute(query, row)
-        rowsadded += 1
-    except sqlite3.OperationalError:
-        sqltypes = [vt[1] for vt in sqlvalues]
-        colsch = [(keys[i], sqltypes[i]) for i in range(len(keys))]
-        colsadded += _add_cols(sqlcur, table, colsch)
-        sqlcur.execute(query, row)
-        rowsadded += 1
-    return (rowsadded, colsadded)
+def _insert_run(sqlcur, rundict, filedate, table):
+    row = [filedate] + [_sql_value(val) for val in rundict.values()]
+    batches = {_columns(tuple(rundict)):[row]}
+    return _insert_batches(sqlcur, batches, table, ('FileDate',))
 
-def _update_meta(sqlcur, filedate, indatabase = 1):
-    query = 'UPDATE Files SET InDatabase = ? WHERE FileDate = ?'
-    sqlcur.execute(query, (indatabase, datetime_tosqlite(filedate)))
+# marks a file as imported. When a row count or content hash is given, the
+# file's checkpoint is recorded as well.
+def _update_meta(sqlcur, filedate, indatabase = 1, rowcount = None,
+                 contenthash = None):
+    if rowcount is None and contenthash is None:
+        query = 'UPDATE Files SET InDatabase = ? WHERE FileDate = ?'
+        sqlcur.execute(query, (indatabase, datetime_tosqlite(filedate)))
+    else:
+        query = ('UPDATE Files SET InDatabase = ?, RowCount = ?, '
+                 'ContentHash = ?, ImportedAt = datetime(\'now\') '
+                 'WHERE FileDate = ?')
+        sqlcur.execute(query, (indatabase, rowcount, contenthash,
+                               datetime_tosqlite(filedate)))
     return None
 
-def pipe_personal_runs(dbpath, rundir):
+# paths (relative to rundir) of the .run files in the character directories
+# of the game's runs directory
+def _personal_run_files(rundir):
     daily_files = os.listdir('{}\\{}'.format(rundir, 'DAILY'))
     ironclad_files = os.listdir('{}\\{}'.format(rundir, 'IRONCLAD'))
     silent_files = os.listdir('{}\\{}'.format(rundir, 'THE_SILENT'))
@@ -357,6 +825,15 @@ def pipe_personal_runs(dbpath, rundir):
     for file in watcher_files:
         if file[-4:] == '.run':
             run_files.append('{}\\{}'.format('WATCHER', file))
+    return run_files
+
+# imports the .run files of the game's runs directory into MyData. With
+# incremental = True only new or changed files are imported (see
+# _pipe_changed_runs).
+def pipe_personal_runs(dbpath, rundir, incremental = False):
+    run_files = _personal_run_files(rundir)
+    if incremental:
+        return _pipe_changed_runs(dbpath, rundir, run_files, 'MyData')
             
     nruns = len(run_files)
     print('{} runs found. Importing data...'.format(nruns))
@@ -365,28 +842,34 @@ def pipe_personal_runs(dbpath, rundir):
     try:
         con = sqlite3.connect(dbpath, isolation_level = None)
         cur = con.cursor()
+        _unique_play_ids(cur, 'MyData')
         cur.execute('BEGIN')
         n = 0
+        duplicates = 0
         
         for file in run_files:
             with open('{}\\{}'.format(rundir, file), 'r') as rb:
-                _pipe_run(cur, rb, today)
+                duplicates += _pipe_run(cur, rb, today)[2]
            
             n += 1
             print('run imported ({}/{})'.format(n, nruns))
         
         con.commit()
-        print('Complete.')
+        print('Complete. Runs already in the database: {}'.format(duplicates))
         
     except Exception as err:
         print('Error occured. Rolling back...')
         con.close()
         raise err
     finally:
+        _forget_caches(cur)
         con.close()
         
-def pipe_local_runs(dbpath, rundir, table):
+def pipe_local_runs(dbpath, rundir, table, bulk = False,
+                    incremental = False):
     run_files = os.listdir(rundir)
+    if incremental:
+        return _pipe_changed_runs(dbpath, rundir, run_files, table)
             
     nruns = len(run_files)
     print('{} runs found. Importing data...'.format(nruns))
@@ -395,22 +878,142 @@ def pipe_local_runs(dbpath, rundir, table):
     try:
         con = sqlite3.connect(dbpath, isolation_level = None)
         cur = con.cursor()
-        cur.execute('BEGIN')
-        n = 0
-        
-        for file in run_files:
-            with open('{}\\{}'.format(rundir, file), 'r') as rb:
-                _pipe_run(cur, rb, today, table = table)
-           
-            n += 1
-            print('run imported ({}/{})'.format(n, nruns))
-        
-        con.commit()
-        print('Complete.')
+        _unique_play_ids(cur, table)
+        with _bulk_mode(con, [table], bulk):
+            cur.execute('BEGIN')
+            n = 0
+            duplicates = 0
+            
+            for file in run_files:
+                with open('{}\\{}'.format(rundir, file), 'r') as rb:
+                    duplicates += _pipe_run(cur, rb, today, table = table)[2]
+               
+                n += 1
+                print('run imported ({}/{})'.format(n, nruns))
+            
+            con.commit()
+        print('Complete. Runs already in the database: {}'.format(duplicates))
         
     except Exception as err:
         print('Error occured. Rolling back...')
         con.close()
         raise err
     finally:
-        con.close()
\ No newline at end of file
+        _forget_caches(cur)
+        con.close()
+
+# Imports the files in run_files (paths relative to rundir) that are not in
+# the RunFiles index of the table or whose size or modification time
+# changed since they were imported. A changed file whose contents differ
+# replaces the run it was imported as. Files that cannot be parsed (e.g.
+# because the game is still writing them) are skipped and retried on the
+# next import. index is the table's index (see runindex.load) and is
+# updated once the imports are committed. Returns the paths of the
+# imported and skipped files.
+def _import_changed_runs(sqlcur, rundir, run_files, table, index):
+    changed = []
+    for file in run_files:
+        path = os.path.abspath(os.path.join(rundir, file))
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if runindex.is_changed(index, path, st.st_size, st.st_mtime):
+            changed.append((path, st.st_size, st.st_mtime))
+    if len(changed) == 0:
+        return ([], [])
+    
+    today = str(datetime.date.today())
+    imported = []
+    skipped = []
+    updates = {}
+    sqlcur.execute('BEGIN')
+    try:
+        for path, size, mtime in changed:
+            with open(path, 'rb') as rb:
+                data = rb.read()
+            contenthash = runindex.content_hash(data)
+            entry = index.get(path)
+            if entry is not None and entry[2] == contenthash:
+                runindex.record(sqlcur, table, path, size, mtime,
+                                contenthash, entry[3])
+                updates[path] = (size, mtime, contenthash, entry[3])
+                continue
+            try:
+                rundict = json.loads(data)
+            except ValueError:
+                # not recorded, so the file is read again once it changes
+                skipped.append(path)
+                updates[path] = (size, mtime, None, None)
+                continue
+            
+            if entry is not None and entry[3] is not None:
+                sqlcur.execute('DELETE FROM {} WHERE PlayId = ?'
+                               .format(table), (entry[3],))
+            added = _insert_run(sqlcur, rundict, today, table)
+            play_id = rundict.get('play_id')
+            runindex.record(sqlcur, table, path, size, mtime, contenthash,
+                            play_id)
+            updates[path] = (size, mtime, contenthash, play_id)
+            if added[0] > 0:
+                imported.append(path)
+    except Exception as err:
+        sqlcur.execute('ROLLBACK')
+        _forget_caches(sqlcur)
+        raise err
+    sqlcur.execute('COMMIT')
+    index.update(updates)
+    return (imported, skipped)
+
+# incremental import of the new or changed files in run_files
+def _pipe_changed_runs(dbpath, rundir, run_files, table):
+    con = sqlite3.connect(dbpath, isolation_level = None)
+    cur = con.cursor()
+    try:
+        _unique_play_ids(cur, table)
+        runindex.create_table(cur)
+        index = runindex.load(cur, table)
+        imported, skipped = _import_changed_runs(cur, rundir, run_files,
+                                                 table, index)
+        print('{} new or changed runs imported.'.format(len(imported)))
+        if len(skipped) > 0:
+            print('skipped (could not be read): {}'.format(skipped))
+    finally:
+        _forget_caches(cur)
+        con.close()
+    return (imported, skipped)
+
+# polls the files listed by list_files() every interval seconds and imports
+# new or changed runs as they appear, until interrupted or until timeout
+# seconds have passed
+def _watch_runs(dbpath, rundir, list_files, table, interval, timeout):
+    con = sqlite3.connect(dbpath, isolation_level = None)
+    cur = con.cursor()
+    start = time.monotonic()
+    try:
+        _unique_play_ids(cur, table)
+        runindex.create_table(cur)
+        index = runindex.load(cur, table)
+        print('Watching {} for new runs...'.format(rundir))
+        while timeout is None or time.monotonic() - start < timeout:
+            imported, skipped = _import_changed_runs(cur, rundir,
+                                                     list_files(), table,
+                                                     index)
+            for path in imported:
+                print('run imported: {}'.format(path))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print('Stopped.')
+    finally:
+        _forget_caches(cur)
+        con.close()
+
+# keeps MyData up to date with the game's runs directory, importing each new
+# run shortly after the game writes it
+def watch_personal_runs(dbpath, rundir, interval = 0.5, timeout = None):
+    _watch_runs(dbpath, rundir, lambda: _personal_run_files(rundir),
+                'MyData', interval, timeout)
+
+def watch_local_runs(dbpath, rundir, table, interval = 0.5, timeout = None):
+    _watch_runs(dbpath, rundir, lambda: os.listdir(rundir), table,
+                interval, timeout)
@@ -16,14 +16,28 @@ def killed_by_valid(killed_by, encounter_names):
     return killed_by in encounter_names
 
 def is_clean(event_choices, damage_taken, killed_by,
-             event_names, encounters, **kwargs):
-    encounter_names = set(encounters.keys())
+             event_names, encounters, encounter_names = None, **kwargs):
+    if encounter_names is None:
+        encounter_names = set(encounters.keys())
     try:
         return (events_valid(event_choices, event_names)
                 and encounters_valid(damage_taken, encounter_names)
                 and killed_by_valid(killed_by, encounter_names))
     except KeyError:
         return False
+
+# is_clean on a runview.RunView
+def check(view, game_dict):
+    if not view.regular:
+        return is_clean(**view.args, **game_dict)
+    encounter_names = game_dict.get('encounter_names')
+    if encounter_names is None:
+        encounter_names = set(game_dict['encounters'].keys())
+    event_names = game_dict['event_names']
+    killed_by = view.args['killed_by']
+    return (all(name in event_names for name in view.event_names)
+            and all(name in encounter_names for name in view.enemies)
+            and (killed_by is None or killed_by in encounter_names))
     
 
 
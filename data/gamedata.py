@@ -0,0 +1,83 @@
+# Reference data (cards, relics, potions, events and encounters) used by the
+# cleaning validators. It is loaded once per import session and only rebuilt
+# when one of the reference tables changes.
+import hashlib
+
+# reference tables read by GameData
+reference_tables = ['Cards', 'Relics', 'Potions', 'Events', 'Encounters']
+
+# sha1 of the rows of a table, in rowid order. The reference tables have a
+# few hundred rows, so hashing them is cheap and catches any change,
+# including edits in place.
+def table_hash(sqlcur, table):
+    h = hashlib.sha1()
+    for row in sqlcur.execute('SELECT * FROM {} ORDER BY rowid'
+                              .format(table)):
+        h.update(repr(row).encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+# returns a change stamp for each reference table
+def table_stamps(sqlcur):
+    return {table:table_hash(sqlcur, table) for table in reference_tables}
+
+class GameData:
+    def __init__(self, sqlcur):
+        self._stamps = table_stamps(sqlcur)
+
+        card_names = frozenset(r[0] for r in
+                               sqlcur.execute('SELECT Name FROM Cards'))
+        relic_names = frozenset(r[0] for r in
+                                sqlcur.execute('SELECT Name FROM Relics'))
+        potion_names = frozenset(r[0] for r in
+                                 sqlcur.execute('SELECT Name FROM Potions'))
+        event_names = frozenset(r[0] for r in
+                                sqlcur.execute('SELECT Name FROM Events'))
+
+        encounters_sql = sqlcur.execute('SELECT Name, '
+                                        'MAX(NumEnemies, MaxEnemiesSplit), '
+                                        'MaxGoldReward '
+                                        'FROM Encounters')
+        encounters = {}
+        for r in encounters_sql:
+            encounters[r[0]] = (r[1], r[2])
+
+        # the validators accept these as keyword arguments. item_names and
+        # encounter_names are precomputed so that the validators do not
+        # rebuild them for every run.
+        self._dict = {'card_names':card_names,
+                      'relic_names':relic_names,
+                      'potion_names':potion_names,
+                      'event_names':event_names,
+                      'encounters':encounters,
+                      'item_names':card_names | relic_names | potion_names,
+                      'encounter_names':frozenset(encounters)}
+
+    def game_dict(self):
+        return self._dict
+
+    def stamps(self):
+        return self._stamps
+
+    # tables whose contents changed since this object was built
+    def changed_tables(self, sqlcur):
+        stamps = table_stamps(sqlcur)
+        return [t for t in stamps if stamps[t] != self._stamps.get(t)]
+
+    def is_current(self, sqlcur):
+        return len(self.changed_tables(sqlcur)) == 0
+
+# the game data of the current session
+_session = None
+
+# returns the session's game data, rebuilding it only if the reference
+# tables changed since it was loaded
+def load(sqlcur):
+    global _session
+    if _session is None or not _session.is_current(sqlcur):
+        _session = GameData(sqlcur)
+    return _session
+
+def invalidate():
+    global _session
+    _session = None
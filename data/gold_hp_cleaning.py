@@ -1,5 +1,13 @@
+import math
+import operator
 import numpy as np
 
+# boss relic: starter relic it replaces
+boss_relic_upgrades = {'Black Blood':'Burning Blood',
+                       'Ring of the Serpent':'Ring of the Snake',
+                       'FrozenCore':'Cracked Core',
+                       'HolyWater':'PureWater'}
+
 def relic_changes(relics_obtained, boss_relics, event_choices, relics,
                   neow_bonus, items_purchased, item_purchase_floors,
                   relic_names):
@@ -31,14 +39,8 @@ def relic_changes(relics_obtained, boss_relics, event_choices, relics,
                 rc[floor] = [set(), set()]
             rc[floor][0].add(rel)
         
-            if rel == 'Black Blood':
-                rc[floor][1].add('Burning Blood')
-            elif rel == 'Ring of the Serpent':
-                rc[floor][1].add('Ring of the Snake')
-            elif rel == 'FrozenCore':
-                rc[floor][1].add('Cracked Core')
-            elif rel == 'HolyWater':
-                rc[floor][1].add('PureWater')           
+            if rel in boss_relic_upgrades:
+                rc[floor][1].add(boss_relic_upgrades[rel])
             
     for d in event_choices:
         rels = set()
@@ -63,20 +65,77 @@ def relic_changes(relics_obtained, boss_relics, event_choices, relics,
             
     return rc
 
-def relics_by_floor(relic_changes, floor_reached):
+# Relic inventories are ints with one bit per relic held. The bits index
+# the relics of the reference Relics table (relic_names) in sorted order,
+# so the same table gives the same masks in every process and session, and
+# masks can be stored alongside it. Relics outside the table get no bit;
+# relics_by_floor keeps them in a set per floor instead.
+class RelicBits:
+    def __init__(self, relic_names):
+        self.names = sorted(set(relic_names))
+        self.bits = {name:1 << i for i, name in enumerate(self.names)}
+
+    def mask(self, relics):
+        return self.split(relics)[0]
+
+    # (mask of the relics in the table, frozenset of the others)
+    def split(self, relics):
+        mask = 0
+        others = None
+        bits = self.bits
+        for rel in relics:
+            bit = bits.get(rel)
+            if bit is not None:
+                mask |= bit
+            elif others is None:
+                others = [rel]
+            else:
+                others.append(rel)
+        return (mask, _no_relics if others is None else frozenset(others))
+
+    def relics(self, mask):
+        return {name for name, bit in self.bits.items() if mask & bit}
+
+_no_relics = frozenset()
+
+# (relic_names, RelicBits) of the last relic_names seen; a session uses one
+# reference table
+_relic_bits = (None, None)
+
+def relic_bits(relic_names):
+    global _relic_bits
+    if _relic_bits[0] is not relic_names:
+        _relic_bits = (relic_names, RelicBits(relic_names))
+    return _relic_bits[1]
+
+# The relic inventory (see RelicBits) held on each floor, and the relics
+# outside relic_names held on each floor (None if the run has none)
+def relics_by_floor(relic_changes, floor_reached, relic_names):
     if floor_reached == 0:
-        return []
-    
-    rbf = [None] * (floor_reached + 1)
-    rbf[0] = relic_changes[0][0]
-    
-    for i in range(1, floor_reached + 1):
-        if i in relic_changes:
-            rbf[i] = (rbf[i - 1] | relic_changes[i][0]) - relic_changes[i][1]
-        else:
-            rbf[i] = rbf[i - 1]
+        return ([], None)
+    
+    bits = relic_bits(relic_names)
+    rbf = [0] * (floor_reached + 1)
+    obf = None
+    held, others = bits.split(relic_changes[0][0])
+    # raises IndexError for a negative floor_reached
+    rbf[0] = held
+    
+    for i in range(floor_reached + 1):
+        change = relic_changes.get(i) if i > 0 else None
+        if change is not None:
+            gained, gained_others = bits.split(change[0])
+            lost, lost_others = bits.split(change[1])
+            held = (held | gained) & ~lost
+            if others or gained_others:
+                others = (others | gained_others) - lost_others
+        rbf[i] = held
+        if others:
+            if obf is None:
+                obf = [_no_relics] * (floor_reached + 1)
+            obf[i] = others
         
-    return rbf
+    return (rbf, obf)
 
 def trim_card(card_name):
     upgrade_ind = card_name.find('+')
@@ -85,91 +144,188 @@ def trim_card(card_name):
     else:
         return card_name
 
+# Effects of cards, relics, potions and events on the gold and max hp
+# bounds, keyed by item name (the names of the run logs and of the reference
+# tables, which the validators are given). An item only needs an entry here
+# for the bounds to account for it.
+
+# relic: (gold, max hp) gained on the floor it is obtained
+relic_gains = {'Old Coin':(300, 0),
+               'Strawberry':(0, 7),
+               'Pear':(0, 10),
+               'Mango':(0, 14),
+               'Lee\'s Waffle':(0, 7),
+               'Tiny House':(50, 5)}
+
+# relic: cards it adds to the deck when obtained, for Ceramic Fish
+relic_cards = {'Tiny House':1,
+               'Calling Bell':1,
+               'Necronomicon':1,
+               'Astrolabe':3,
+               'Pandora\'s Box':11,
+               'DollysMirror':1}
+
+# relic: (gold, rooms) gained on every floor from the one it is obtained on
+# whose room is in rooms (every floor if rooms is None)
+relic_floor_gold = {'SsserpentHead':(50, frozenset('?MT$')),
+                    'MawBank':(12, None)}
+
+# relic: gold gained for every card added to the deck from the floor it is
+# obtained on
+relic_card_gold = {'CeramicFish':9}
+# relic: cards (curses) it adds on every chest floor, for relic_card_gold
+relic_chest_cards = {'Cursed Key':1}
+# relic: max hp gained for every card reward skipped with it, which the log
+# records as picking the relic
+relic_skip_hp = {'Singing Bowl':2}
+# (relic, other relic): gold gained on the floor of the other relic if the
+# relic was obtained on that floor or before. It seems Golden Idol affects
+# the Tiny House gold bonus (glitch?).
+relic_pair_gold = {('Golden Idol', 'Tiny House'):13}
+
+# relic: (gold factor, max hp) added to each combat while it is held
+held_relic_combat = {'Golden Idol':(0.25, 0),
+                     'FaceOfCleric':(0, 1)}
+
+# relics that add or transform random cards without logging them
+relic_random_cards = frozenset(['Tiny House', 'Pandora\'s Box', 'Astrolabe'])
+# relic: card of gold_hp_cards it can add without logging it
+relic_unlogged_cards = {'Nilry\'s Codex':'HandOfGreed',
+                        'Dead Branch':'HandOfGreed'}
+# relics from whose floor random cards can be of any character
+relic_any_character = frozenset(['PrismaticShard'])
+# relic: cards it can add, remove or transform without logging them, all of
+# which may be curses (for relic_curse_hp)
+relic_unlogged_curses = {'Empty Cage':2, 'Astrolabe':3, 'DollysMirror':1}
+# relic: max hp gained for every curse obtained
+relic_curse_hp = {'Darkstone Periapt':6}
+
+# neow bonuses that add or transform random cards
+neow_random_cards = frozenset(['ONE_RANDOM_RARE_CARD', 'TRANSFORM_CARD',
+                               'TRANSFORM_TWO_CARDS'])
+
+# card: (index in the earliest floors of earliest_gold_hp_cards, character
+# whose random cards include it, None for colorless cards)
+gold_hp_cards = {'HandOfGreed':(0, None),
+                 'Feed':(1, 'IRONCLAD'),
+                 'Wish':(2, 'WATCHER')}
+
+# potion: max hp it gives when obtained (see relic_potion_factor)
+potion_max_hp = {'Fruit Juice':5}
+# relic: factor of the potion max hp. As in the original bounds it applies to
+# the potions obtained up to the floor of the relic, and to all of them if
+# the run has not obtained it.
+relic_potion_factor = {'SacredBark':2}
+# max hp potions obtained through Entropic Brew, which cannot be tracked
+untracked_potions = 10
+
+# event: gold gained that the event log does not record
+event_gold = {'Dead Adventurer':30}
+# event log key: sign of the gold or max hp it records
+event_gold_keys = {'gold_gain':1, 'gold_loss':-1}
+event_max_hp_keys = {'max_hp_gain':1, 'max_hp_loss':-1}
+
+curses = frozenset(['Injury', 'Shame', 'Doubt', 'Regret', 'Pain',
+                    'Necronomicurse', 'AscendersBane', 'Parasite', 'Pride',
+                    'Clumsy', 'Writhe', 'CurseOfTheBell', 'Decay',
+                    'Normality'])
+
+chest_rooms = frozenset('T')
+chest_gold = 82
+greed_gold = 25
+feed_hp = 4
+
+# relics whose floors the bounds need
+_relic_effects = (set(relic_gains) | set(relic_cards) | set(relic_floor_gold)
+                  | set(relic_card_gold) | set(relic_chest_cards)
+                  | set(relic_skip_hp)
+                  | {rel for pair in relic_pair_gold for rel in pair}
+                  | relic_random_cards | set(relic_unlogged_cards)
+                  | relic_any_character | set(relic_unlogged_curses)
+                  | set(relic_curse_hp) | set(relic_potion_factor))
+
+# Per-floor gold and max hp bounds are kept in plain lists, copied from a
+# zero list cached per length (numpy arrays of at most 58 floats are slower
+# to create and index). Like the arrays they replace, the lists have
+# floor_reached + 1 entries, so floors past floor_reached raise IndexError.
+_zero_lists = {}
+
+def _zeros(n):
+    zeros = _zero_lists.get(n)
+    if zeros is None:
+        zeros = _zero_lists[n] = [0.0] * n
+    return zeros.copy()
+
+# a floor of item_purchase_floors (which are not cast to int) as an index of
+# the bound lists; other values than ints raise IndexError, as they did as
+# indices of the numpy arrays
+def _index(floor):
+    if type(floor) is not int:
+        raise IndexError(floor)
+    return floor
+
+# The relics of relic_changes that have an effect on the bounds, as a list
+# of (floor, relic) in the order relic_changes lists them, the last floor
+# each one was obtained on, and the last floor of relic_changes.
+def _relic_floors(relic_changes):
+    gained = []
+    last_floor = {}
+    for floor, (relics_added, _) in relic_changes.items():
+        for rel in relics_added:
+            if rel in _relic_effects:
+                gained.append((floor, rel))
+                last_floor[rel] = floor
+    return (gained, last_floor, floor)
+
 def earliest_gold_hp_cards(card_choices, event_choices,
                            items_purchased, item_purchase_floors,
-                           neow_bonus, relic_changes, character_chosen):
-    
-    unlogged_additions = []
-    unlogged_removals = []
-    unlogged_transforms = []
-    hog_floor = 57
-    wish_floor = 57
-    feed_floor = 57
-    prismatic_floor = 57
-    
-    neow_removals = {'REMOVE_CARD', 'REMOVE_TWO'}
-    neow_transforms = {'TRANSFORM_CARD', 'TRANSFORM_TWO_CARDS'}
-    if neow_bonus == 'ONE_RANDOM_RARE_CARD':
-        unlogged_additions.append(0)
-    elif neow_bonus in neow_removals:
-        unlogged_removals.append(0)
-    elif neow_bonus in neow_transforms:
-        unlogged_transforms.append(0)
-        
-    for floor in iter(relic_changes):
-        relics_gained = relic_changes[floor][0]
-        if 'Tiny House' in relics_gained:
-            unlogged_additions.append(floor)
-        if 'Empty Cage' in relics_gained:
-            unlogged_removals.append(floor)
-        if 'Pandora\'s Box' in relics_gained or 'Astrolabe' in relics_gained:
-            unlogged_transforms.append(floor)
-        if 'PrismaticShard' in relics_gained:
-            prismatic_floor = floor
-        if 'Nilry\'s Codex' in relics_gained or 'Dead Branch' in relics_gained:
-            hog_floor = min(hog_floor, floor)
-            
-    if character_chosen == 'IRONCLAD':
-        min_wish_floor = prismatic_floor
-        min_feed_floor = 0
-    elif character_chosen == 'THE_SILENT' or character_chosen == 'DEFECT':
-        min_wish_floor = prismatic_floor
-        min_feed_floor = prismatic_floor
-    elif character_chosen == 'WATCHER':
-        min_wish_floor = 0
-        min_feed_floor = prismatic_floor
-            
+                           neow_bonus, relic_floors, character_chosen):
+    gained, last_floor, _ = relic_floors
+    earliest = [57] * len(gold_hp_cards)
+
+    unlogged = []
+    if neow_bonus in neow_random_cards:
+        unlogged.append(0)
+    for floor, rel in gained:
+        if rel in relic_random_cards:
+            unlogged.append(floor)
+        card = relic_unlogged_cards.get(rel)
+        if card is not None:
+            i = gold_hp_cards[card][0]
+            earliest[i] = min(earliest[i], floor)
+    prismatic_floor = min((last_floor[rel] for rel in relic_any_character
+                           if rel in last_floor), default = 57)
+
+    def obtained(card, floor):
+        entry = gold_hp_cards.get(card)
+        if entry is None and '+' in card:
+            entry = gold_hp_cards.get(trim_card(card))
+        if entry is not None:
+            earliest[entry[0]] = min(earliest[entry[0]], floor)
+
     for choice in card_choices:
-        picked = trim_card(choice['picked'])
-        floor = int(choice['floor'])
-        if picked == 'HandOfGreed':
-            hog_floor = min(hog_floor, floor)
-        elif picked == 'Wish':
-            wish_floor = min(wish_floor, floor)
-        elif picked == 'Feed':
-            feed_floor = min(feed_floor, floor)
-            
+        obtained(choice['picked'], int(choice['floor']))
     for event in event_choices:
         if 'cards_obtained' in event:
             floor = int(event['floor'])
-            card_reward = [trim_card(card) 
-                           for card in event['cards_obtained']]
-            if 'HandOfGreed' in card_reward:
-                hog_floor = min(hog_floor, floor)
-            if 'Wish' in card_reward:
-                wish_floor = min(wish_floor, floor)
-            if 'Feed' in card_reward:
-                feed_floor = min(feed_floor, floor)
-        
+            for card in event['cards_obtained']:
+                obtained(card, floor)
         if 'cards_transformed' in event:
-            unlogged_transforms.append(int(event['floor']))
-
+            unlogged.append(int(event['floor']))
     for i, item in enumerate(items_purchased):
-        if trim_card(item) == 'HandOfGreed':
-            hog_floor = min(hog_floor, item_purchase_floors[i])
-        elif trim_card(item) == 'Wish':
-            wish_floor = min(wish_floor, item_purchase_floors[i])           
-        elif trim_card(item) == 'Feed':
-            feed_floor = min(feed_floor, item_purchase_floors[i])
-            
-    for floor in unlogged_additions + unlogged_transforms:
-        hog_floor = min(hog_floor, floor)
-        if min_wish_floor <= floor:
-            wish_floor = min(wish_floor, floor)
-        if min_feed_floor <= floor:
-            feed_floor = min(feed_floor, floor)
-            
-    return (hog_floor, feed_floor, wish_floor)
+        obtained(item, item_purchase_floors[i])
+
+    # random cards of another character need Prismatic Shard
+    for i, character in gold_hp_cards.values():
+        if character is None or character == character_chosen:
+            min_floor = 0
+        else:
+            min_floor = prismatic_floor
+        for floor in unlogged:
+            if min_floor <= floor:
+                earliest[i] = min(earliest[i], floor)
+
+    return tuple(earliest)
         
 def current_hp_isvalid(current_hp_per_floor, max_hp_per_floor):
     isvalid = True
@@ -178,38 +334,42 @@ def current_hp_isvalid(current_hp_per_floor, max_hp_per_floor):
             isvalid = False
     return isvalid
 
-def fruit_juice_hp(relic_changes, potions_obtained, items_purchased, 
-                   item_purchase_floors, event_choices, floor_reached):
-    bark_floor = 57
-    for floor in iter(relic_changes):
-        if 'SacredBark' in relic_changes[floor][0]:
-            bark_floor = floor
-            
-    hp_by_floor = np.zeros(floor_reached + 1, dtype = int)
-    
+def potion_hp(relic_floors, potions_obtained, items_purchased,
+              item_purchase_floors, event_choices, hp):
+    factors = [(relic_floors[1].get(rel, 57), factor)
+               for rel, factor in relic_potion_factor.items()]
+    # floor of the last max hp potion, or of the last relic change if there
+    # is none; it decides whether the untracked potions are multiplied
+    last_floor = relic_floors[2]
+
+    def gain(potion_hp, floor):
+        for relic_floor, factor in factors:
+            if relic_floor >= floor:
+                potion_hp *= factor
+        return potion_hp
+
+    def obtained(potion, floor):
+        potion_hp = potion_max_hp.get(potion)
+        if potion_hp is not None:
+            hp[_index(floor)] += gain(potion_hp, floor)
+            return floor
+        return last_floor
+
+    # names are checked to be strings before the table lookups: corrupt runs
+    # can have lists or dicts there, which are no potion
     for pot in potions_obtained:
-        if pot['key'] == 'Fruit Juice':
-            floor = int(pot['floor'])
-            hp_by_floor[floor] += 5 * (1 + (bark_floor >= floor))
-            
+        if isinstance(pot['key'], str) and pot['key'] in potion_max_hp:
+            last_floor = obtained(pot['key'], int(pot['floor']))
     for i, item in enumerate(items_purchased):
-        if item == 'Fruit Juice':
-            floor = item_purchase_floors[i]
-            hp_by_floor[floor] += 5 * (1 + (bark_floor >= floor))
-            
+        if item in potion_max_hp:
+            last_floor = obtained(item, item_purchase_floors[i])
     for event in event_choices:
         if 'potions_obtained' in event:
-            potions = event['potions_obtained']
-            for pot in potions:
-                if pot == 'Fruit Juice':
-                    floor = int(event['floor'])
-                    hp_by_floor[floor] += 5 * (1 + (bark_floor >= floor))
-                    
-    # fruit juice obtained through Entropic Brew cannot be tracked.
-    extra = 10
-    hp_by_floor[0] += extra * 5 * (1 + (bark_floor >= floor))
-                    
-    return hp_by_floor
+            for pot in event['potions_obtained']:
+                if isinstance(pot, str) and pot in potion_max_hp:
+                    last_floor = obtained(pot, int(event['floor']))
+
+    hp[0] += untracked_potions * gain(max(potion_max_hp.values()), last_floor)
                     
 def neow_gold(neow_bonus, neow_cost):
     if neow_cost == 'NO_GOLD':
@@ -246,29 +406,16 @@ def neow_hp(neow_bonus, neow_cost, character_chosen):
         
     return hp
 
-def periapt_hp(master_deck, relic_changes, event_choices, items_purged,
+def periapt_hp(master_deck, relic_floors, event_choices, items_purged,
                campfire_choices):
-    astrolabe = False
-    cage = False
-    periapt = False
-    mirror = False
-    for rels, _ in iter(relic_changes.values()):
-        if 'Astrolabe' in rels:
-            astrolabe = True
-        if 'Empty Cage' in rels:
-            cage = True
-        if 'Darkstone Periapt' in rels:
-            periapt = True
-        if 'DollysMirror' in rels:
-            mirror = True
-            
-    if not periapt:
+    last_floor = relic_floors[1]
+    hp_per_curse = sum(hp for rel, hp in relic_curse_hp.items()
+                       if rel in last_floor)
+    if hp_per_curse == 0:
         return 0
     
-    curses = {'Injury', 'Shame', 'Doubt', 'Regret', 'Pain', 'Necronomicurse',
-              'AscendersBane', 'Parasite', 'Pride', 'Clumsy', 'Writhe',
-              'CurseOfTheBell', 'Decay', 'Normality'}
-    num_curses = 2 * cage + 3 * astrolabe + mirror
+    num_curses = sum(n for rel, n in relic_unlogged_curses.items()
+                     if rel in last_floor)
     
     for card in master_deck:
         if card in curses:
@@ -293,191 +440,168 @@ def periapt_hp(master_deck, relic_changes, event_choices, items_purged,
         if fire['key'] == 'PURGE' and fire['data'] in curses:
             num_curses += 1
             
-    return num_curses * 6
+    return num_curses * hp_per_curse
 
 # encounters = {encounter_name:(max_fatalities, max_gold_reward)}
-def combat_gold_hp(damage_taken, floor_reached, encounters, relics_by_floor, 
-                   greed_floor, feed_floor, wish_floor):
-    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
-    hp_by_floor = np.zeros(floor_reached + 1, dtype = float)
-    
+# relics_by_floor = (inventories, other relics) as returned by
+# relics_by_floor
+def combat_gold_hp(damage_taken, encounters, relics_by_floor, feed_floor,
+                   wish_floor, gold, hp, relic_names):
+    held_by_floor, others_by_floor = relics_by_floor
+    bits = relic_bits(relic_names).bits
+    combat_bits = [(bits.get(rel, 0), rel, gold_factor, max_hp)
+                   for rel, (gold_factor, max_hp) in held_relic_combat.items()]
     for dmg in damage_taken:
         if 'floor' in dmg and 'enemies' in dmg:
             floor = int(dmg['floor'])
-            enc_name = dmg['enemies']
+            max_fat, max_gold = encounters[dmg['enemies']]
             
-            max_fat, max_gold = encounters[enc_name]
-            gold = max_gold * (1 + 0.25 * ('Golden Idol' in 
-                                           relics_by_floor[floor - 1]))
-            gold_by_floor[floor] += np.ceil(gold)
+            held = held_by_floor[floor - 1]
+            others = (others_by_floor[floor - 1]
+                      if others_by_floor is not None else _no_relics)
+            factor = 1
+            for bit, rel, gold_factor, max_hp in combat_bits:
+                if held & bit or rel in others:
+                    factor += gold_factor
+                    hp[floor] += max_hp
+            gold[floor] += math.ceil(max_gold * factor)
             
-            if True:
-                gold_by_floor[floor] += 25 * max_fat
+            gold[floor] += greed_gold * max_fat
             if wish_floor < floor:
-                gold_by_floor[floor] += np.inf
+                gold[floor] += math.inf
             if feed_floor < floor:
-                hp_by_floor[floor] += 4 * max_fat
-                
-            if 'FaceOfCleric' in relics_by_floor[floor - 1]:
-                hp_by_floor[floor] += 1
-                
-    return (gold_by_floor, hp_by_floor)
+                hp[floor] += feed_hp * max_fat
 
-def chest_gold(path_per_floor, event_choices, floor_reached):
-    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
-    
+def chest_gold_hp(path_per_floor, event_choices, gold):
     event_floors = set()
     for event in event_choices:
         event_floors.add(int(event['floor']))
         
     for i, room in enumerate(path_per_floor):
-        if room == 'T' or (room == '?' and (i + 1 not in event_floors)):
-            gold_by_floor[i + 1] += 82
-
-    return gold_by_floor
+        if ((isinstance(room, str) and room in chest_rooms)
+            or (room == '?' and (i + 1 not in event_floors))):
+            gold[i + 1] += chest_gold
     
-def event_gold_hp(event_choices, floor_reached):
-    hp_by_floor = np.zeros(floor_reached + 1, dtype = float)
-    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
+def event_gold_hp(event_choices, gold, hp):
     for event in event_choices:
         floor = int(event['floor'])
-        if 'max_hp_gain' in event:
-            hp_by_floor[floor] += event['max_hp_gain']
-        if 'max_hp_loss' in event:
-            hp_by_floor[floor] -= event['max_hp_loss']
-        if 'gold_gain' in event:
-            gold_by_floor[floor] += event['gold_gain']
-        if 'gold_loss' in event:
-            gold_by_floor[floor] -= event['gold_loss']
-        if event['event_name'] == 'Dead Adventurer':
-            gold_by_floor[floor] += 30
-            
-    return (gold_by_floor, hp_by_floor)
-
-def relic_gold_hp(relic_changes, card_choices, event_choices,
-                  path_per_floor, items_purchased, item_purchase_floors,
-                  floor_reached, card_names):
-    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
-    hp_by_floor = np.zeros(floor_reached + 1, dtype = float)
-    key_floor = -1
-    fish_floor = -1
-    house_floor = -1
-    box_floor = -1
-    astrolabe_floor = -1
-    bell_floor = -1
-    necro_floor = -1
-    serpent_floor = -1
-    maw_floor = -1
-    idol_floor = -1
-    mirror_floor = -1
-    has_bowl = False
-    for floor in relic_changes:
-        relics_added = relic_changes[floor][0]
-        if 'Old Coin' in relics_added:
-            gold_by_floor[floor] += 300
-        if 'Strawberry' in relics_added:
-            hp_by_floor[floor] += 7
-        if 'Pear' in relics_added:
-            hp_by_floor[floor] += 10
-        if 'Mango' in relics_added:
-            hp_by_floor[floor] += 14
-        if 'Lee\'s Waffle' in relics_added:
-            hp_by_floor[floor] += 7
-            
-        if 'Cursed Key' in relics_added:
-            key_floor = floor
-        if 'CeramicFish' in relics_added:
-            fish_floor = floor
-        if 'Pandora\'s Box' in relics_added:
-            box_floor = floor
-        if 'Astrolabe' in relics_added:
-            astrolabe_floor = floor
-        if 'Calling Bell' in relics_added:
-            bell_floor = floor
-        if 'Necronomicon' in relics_added:
-            necro_floor = floor
-        if 'SsserpentHead' in relics_added:
-            serpent_floor = floor
-        if 'MawBank' in relics_added:
-            maw_floor = floor
-        if 'Golden Idol' in relics_added:
-            idol_floor = floor
-        if 'DollysMirror' in relics_added:
-            mirror_floor = floor
-            
-        if 'Tiny House' in relics_added:
-            gold_by_floor[floor] += 50
-            hp_by_floor[floor] += 5
-            house_floor = floor
-        if 'Singing Bowl' in relics_added:
-            has_bowl = True
-    
-    # it seems Golden Idol affects the Tiny House gold bonus (glitch?)
-    if idol_floor >= 0 and house_floor >= 0 and idol_floor <= house_floor:
-        gold_by_floor[house_floor] += 13
+        for key, sign in event_max_hp_keys.items():
+            if key in event:
+                hp[floor] += sign * event[key]
+        for key, sign in event_gold_keys.items():
+            if key in event:
+                gold[floor] += sign * event[key]
+        name = event['event_name']
+        extra = event_gold.get(name) if isinstance(name, str) else None
+        if extra is not None:
+            gold[floor] += extra
+
+def relic_gold_hp(relic_floors, card_choices, event_choices, path_per_floor,
+                  items_purchased, item_purchase_floors, floor_reached,
+                  card_names, gold, hp):
+    gained, last_floor, _ = relic_floors
+    for floor, rel in gained:
+        gains = relic_gains.get(rel)
+        if gains is not None:
+            gold[_index(floor)] += gains[0]
+            hp[floor] += gains[1]
+
+    for (rel, other), pair_gold in relic_pair_gold.items():
+        rel_floor = last_floor.get(rel, -1)
+        other_floor = last_floor.get(other, -1)
+        if rel_floor >= 0 and other_floor >= 0 and rel_floor <= other_floor:
+            gold[other_floor] += pair_gold
         
-    if fish_floor >= 0 or has_bowl == True:
+    # (floor obtained, gold per card) of the relic_card_gold relics held.
+    # As in the original bounds, if only skip relics are held every card
+    # reward counts for all the relic_card_gold relics.
+    card_gold = [(last_floor[rel], rel_gold)
+                 for rel, rel_gold in relic_card_gold.items()
+                 if rel in last_floor]
+    skip_hp = [(rel, rel_hp) for rel, rel_hp in relic_skip_hp.items()
+               if rel in last_floor]
+    reward_gold = card_gold
+    if len(card_gold) == 0 and len(skip_hp) > 0:
+        reward_gold = [(-1, rel_gold) for rel_gold in relic_card_gold.values()]
+    if len(reward_gold) > 0 or len(skip_hp) > 0:
         for card in card_choices:
             floor = int(card['floor'])
-            if floor >= fish_floor:
-                gold_by_floor[floor] += 9
-            if has_bowl and card['picked'] == 'Singing Bowl':
-                hp_by_floor[floor] += 2
+            for gold_floor, rel_gold in reward_gold:
+                if floor >= gold_floor:
+                    gold[floor] += rel_gold
+            for rel, rel_hp in skip_hp:
+                if card['picked'] == rel:
+                    hp[floor] += rel_hp
                 
-    if fish_floor >= 0:
-        if house_floor >= fish_floor:
-            gold_by_floor[house_floor] += 9
-        if bell_floor >= fish_floor:
-            gold_by_floor[bell_floor] += 9
-        if necro_floor >= fish_floor:
-            gold_by_floor[necro_floor] += 9
-        if astrolabe_floor >= fish_floor:
-            gold_by_floor[astrolabe_floor] += 9 * 3
-        if box_floor >= fish_floor:
-            gold_by_floor[box_floor] += 9 * 11
-        if mirror_floor >= fish_floor:
-            gold_by_floor[mirror_floor] += 9
+    for gold_floor, rel_gold in card_gold:
+        for rel, ncards in relic_cards.items():
+            floor = last_floor.get(rel, -1)
+            if floor >= gold_floor:
+                gold[floor] += rel_gold * ncards
             
         for event in event_choices:
             floor = int(event['floor'])
-            if floor < fish_floor:
+            if floor < gold_floor:
                 continue
             if 'cards_obtained' in event:
-                gold_by_floor[floor] += 9 * len(event['cards_obtained'])
+                gold[floor] += rel_gold * len(event['cards_obtained'])
             if 'cards_transformed' in event:
-                gold_by_floor[floor] += 9 * len(event['cards_transformed'])
+                gold[floor] += rel_gold * len(event['cards_transformed'])
 
         for i, item in enumerate(items_purchased):
             floor = item_purchase_floors[i]
-            if floor >= fish_floor and item in card_names:
-                gold_by_floor[floor] += 9
+            if floor >= gold_floor and item in card_names:
+                gold[floor] += rel_gold
                 
-        if key_floor >= 0:
-            start_floor = max(key_floor, fish_floor)
+        for rel, ncards in relic_chest_cards.items():
+            if rel not in last_floor:
+                continue
+            start_floor = max(last_floor[rel], gold_floor)
             for floor in range(start_floor, floor_reached + 1):
-                if path_per_floor[floor - 1] == 'T' or path_per_floor == '?':
-                    gold_by_floor[floor] += 9
+                room = path_per_floor[floor - 1]
+                if isinstance(room, str) and room in chest_rooms:
+                    gold[floor] += rel_gold * ncards
                     
-    if serpent_floor >= 0:
-        for floor in range(serpent_floor, floor_reached + 1):
-            if (path_per_floor[floor - 1] == '?' 
-                or path_per_floor[floor - 1] == 'M'
-                or path_per_floor[floor - 1] == 'T'
-                or path_per_floor[floor - 1] == '$'):
-                gold_by_floor[floor] += 50
-                
-    if maw_floor >= 0:
-        for floor in range(maw_floor, floor_reached + 1):
-            gold_by_floor[floor] += 12
-            
-    return (gold_by_floor, hp_by_floor)
+    for rel, (floor_gold, rooms) in relic_floor_gold.items():
+        if rel not in last_floor:
+            continue
+        for floor in range(last_floor[rel], floor_reached + 1):
+            if rooms is None:
+                gold[floor] += floor_gold
+                continue
+            room = path_per_floor[floor - 1]
+            if isinstance(room, str) and room in rooms:
+                gold[floor] += floor_gold
 
-                        
+# Upper bounds on the gold gained on each floor before cutoff (as an array)
+# and on the max hp at cutoff. The rules of the tables above are applied to
+# the items the run obtained. changes: the run's relic_changes, if already
+# known.
 def max_gold_hp(card_choices, event_choices, relics_obtained, boss_relics,
                 damage_taken, campfire_choices, items_purchased, items_purged,
                 item_purchase_floors, potions_obtained, neow_bonus, neow_cost,
                 relics, master_deck, path_per_floor, character_chosen,
-                floor_reached, relic_names, card_names, encounters):
+                floor_reached, relic_names, card_names, encounters,
+                changes = None):
+    max_gold, max_hp = _max_gold_hp(card_choices, event_choices,
+                                    relics_obtained, boss_relics,
+                                    damage_taken, campfire_choices,
+                                    items_purchased, items_purged,
+                                    item_purchase_floors, potions_obtained,
+                                    neow_bonus, neow_cost, relics,
+                                    master_deck, path_per_floor,
+                                    character_chosen, floor_reached,
+                                    relic_names, card_names, encounters,
+                                    changes)
+    return (np.array(max_gold), max_hp)
+
+# max_gold_hp with the gold bounds as a list
+def _max_gold_hp(card_choices, event_choices, relics_obtained, boss_relics,
+                 damage_taken, campfire_choices, items_purchased,
+                 items_purged, item_purchase_floors, potions_obtained,
+                 neow_bonus, neow_cost, relics, master_deck, path_per_floor,
+                 character_chosen, floor_reached, relic_names, card_names,
+                 encounters, changes):
     
     if floor_reached <= 2:
         cutoff = 2
@@ -486,49 +610,46 @@ def max_gold_hp(card_choices, event_choices, relics_obtained, boss_relics,
     else:
         cutoff = floor_reached
     
-    max_gold = np.zeros(cutoff, dtype = float)
-    max_hp = 0
-    
-    _relic_changes = relic_changes(relics_obtained, boss_relics, event_choices,
-                                  relics, neow_bonus, items_purchased,
-                                  item_purchase_floors, relic_names)
-    _relics_by_floor = relics_by_floor(_relic_changes, floor_reached)
+    gold = _zeros(operator.index(floor_reached) + 1)
+    hp = _zeros(len(gold))
+    
+    if changes is None:
+        changes = relic_changes(relics_obtained, boss_relics, event_choices,
+                                relics, neow_bonus, items_purchased,
+                                item_purchase_floors, relic_names)
+    _relic_changes = changes
+    _relics_by_floor = relics_by_floor(_relic_changes, floor_reached,
+                                       relic_names)
+    relic_floors = _relic_floors(_relic_changes)
     earliest = earliest_gold_hp_cards(card_choices, event_choices,
                                       items_purchased, item_purchase_floors,
-                                      neow_bonus, _relic_changes,
+                                      neow_bonus, relic_floors,
                                       character_chosen)
     greed_floor, feed_floor, wish_floor = earliest
     
-    max_gold[0] += neow_gold(neow_bonus, neow_cost)
-    max_hp += neow_hp(neow_bonus, neow_cost, character_chosen)
-    
-    max_hp += periapt_hp(master_deck, _relic_changes, event_choices,
+    # the bounds are computed in the order of the original max_gold_hp, so
+    # that corrupt runs fail in the same step
+    neow = neow_gold(neow_bonus, neow_cost)
+    max_hp = neow_hp(neow_bonus, neow_cost, character_chosen)
+    max_hp += periapt_hp(master_deck, relic_floors, event_choices,
                          items_purged, campfire_choices)
-    
-    max_hp += fruit_juice_hp(_relic_changes, potions_obtained, items_purchased,
-                             item_purchase_floors, event_choices,
-                             floor_reached)[:cutoff].sum()
-    
-    max_gold += chest_gold(path_per_floor, event_choices,
-                           floor_reached)[:cutoff]
-    
-    combat_gold, combat_hp = combat_gold_hp(damage_taken, floor_reached,
-                                            encounters, _relics_by_floor,
-                                            greed_floor, feed_floor,
-                                            wish_floor)
-    max_gold += combat_gold[:cutoff]
-    max_hp += combat_hp[:cutoff].sum()
-    
-    event_gold, event_hp = event_gold_hp(event_choices, floor_reached)
-    max_gold += event_gold[:cutoff]
-    max_hp += event_hp[:cutoff].sum()
-    
-    relic_gold, relic_hp = relic_gold_hp(_relic_changes, card_choices,
-                                         event_choices, path_per_floor,
-                                         items_purchased, item_purchase_floors,
-                                         floor_reached, card_names)
-    max_gold += relic_gold[:cutoff]
-    max_hp += relic_hp[:cutoff].sum()
+    potion_hp(relic_floors, potions_obtained, items_purchased,
+              item_purchase_floors, event_choices, hp)
+    chest_gold_hp(path_per_floor, event_choices, gold)
+    combat_gold_hp(damage_taken, encounters, _relics_by_floor, feed_floor,
+                   wish_floor, gold, hp, relic_names)
+    event_gold_hp(event_choices, gold, hp)
+    relic_gold_hp(relic_floors, card_choices, event_choices, path_per_floor,
+                  items_purchased, item_purchase_floors, floor_reached,
+                  card_names, gold, hp)
+    
+    # with floor_reached 0 the floor 0 bound counts for both floors before
+    # the cutoff
+    max_gold = gold[:cutoff]
+    if len(max_gold) < cutoff:
+        max_gold = max_gold * cutoff
+    max_gold[0] += neow
+    max_hp += sum(hp[:cutoff])
     
     return (max_gold, max_hp)
 
@@ -602,6 +723,61 @@ def is_clean(gold_per_floor, max_hp_per_floor, card_choices,
                               floor_reached, relic_names, card_names,
                               encounters, **kwargs)
         )
+
+# is_clean on a runview.RunView: the bounds use the view's relic changes and
+# are compared without numpy. Lists whose lengths make numpy broadcast are
+# left to is_clean.
+def check(view, game_dict):
+    a = view.args
+    if not view.regular or view.relic_changes is None:
+        return is_clean(**a, **game_dict)
+    chp = a['current_hp_per_floor']
+    mhp = a['max_hp_per_floor']
+    gold_per_floor = a['gold_per_floor']
+    if len(chp) != len(mhp) or len(gold_per_floor) == 0:
+        return is_clean(**a, **game_dict)
+    for cur_hp, max_hp in zip(chp, mhp):
+        if not cur_hp <= max_hp:
+            return False
+    
+    try:
+        max_gold, max_hp = _max_gold_hp(a['card_choices'], a['event_choices'],
+                                        a['relics_obtained'],
+                                        a['boss_relics'], a['damage_taken'],
+                                        a['campfire_choices'],
+                                        a['items_purchased'],
+                                        a['items_purged'],
+                                        a['item_purchase_floors'],
+                                        a['potions_obtained'],
+                                        a['neow_bonus'], a['neow_cost'],
+                                        a['relics'], a['master_deck'],
+                                        a['path_per_floor'],
+                                        a['character_chosen'],
+                                        a['floor_reached'],
+                                        game_dict['relic_names'],
+                                        game_dict['card_names'],
+                                        game_dict['encounters'],
+                                        view.relic_changes)
+    except IndexError:
+        return False
+    except KeyError:
+        return False
+    
+    if len(max_gold) <= 1:
+        max_gold_by_floor = max_gold
+    else:
+        max_gold_by_floor = [max_gold[0] + max_gold[1]] + max_gold[2:]
+    n = len(max_gold_by_floor)
+    if n > len(gold_per_floor):
+        return is_clean(**a, **game_dict)
+    
+    if max_gold_by_floor[0] < gold_per_floor[0]:
+        return False
+    for i in range(1, n):
+        if max_gold_by_floor[i] < gold_per_floor[i] - gold_per_floor[i - 1]:
+            return False
+    
+    return not max_hp < mhp[n - 1]
     
 
 
@@ -8,7 +8,10 @@ def trim_card_name(name):
 def is_clean(master_deck, card_choices, items_purchased, items_purged,
              event_choices, relics, relics_obtained, boss_relics,
              potions_obtained, card_names, relic_names, potion_names,
-             **kwargs):
+             item_names = None, **kwargs):
+    if item_names is None:
+        item_names = set(card_names) | set(relic_names) | set(potion_names)
+        
     cards_chosen = []
     cards_skipped = []
     for c in card_choices:
@@ -44,13 +47,21 @@ def is_clean(master_deck, card_choices, items_purchased, items_purged,
                     + event_relics + event_potions + items_purchased)
     
     for name in all_items:
-        trimmed_name = trim_card_name(name)
-        if ((trimmed_name not in card_names)
-            and (trimmed_name not in relic_names) 
-            and (trimmed_name not in potion_names)):
+        if trim_card_name(name) not in item_names:
             return False
         
     return True
+
+# is_clean on a runview.RunView
+def check(view, game_dict):
+    if not view.regular:
+        return is_clean(**view.args, **game_dict)
+    item_names = game_dict.get('item_names')
+    if item_names is None:
+        item_names = (set(game_dict['card_names'])
+                      | set(game_dict['relic_names'])
+                      | set(game_dict['potion_names']))
+    return all(name in item_names for name in view.item_set)
     
     
     
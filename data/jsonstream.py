@@ -0,0 +1,89 @@
+# Incremental parsing of the json arrays in the data dump. The elements of a
+# top level array are yielded one at a time, so memory use is bounded by the
+# size of a single run rather than the size of the file.
+import codecs
+import json
+
+_whitespace = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+# reads a binary or text file object in chunks, decoding bytes as utf-8
+def _text_chunks(fileobj, chunk_size):
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            if isinstance(chunk, bytes):
+                tail = utf8.decode(b'', final = True)
+                if tail:
+                    yield tail
+            return
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk)
+        yield chunk
+
+# yields the elements of the json array in fileobj one at a time
+def iter_array(fileobj, chunk_size = 1 << 16):
+    chunks = _text_chunks(fileobj, chunk_size)
+    buf = ''
+    pos = 0
+    started = False
+    expect_value = True
+    empty = True
+    eof = False
+
+    while True:
+        while pos < len(buf) and buf[pos] in _whitespace:
+            pos += 1
+        if pos == len(buf):
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('unexpected end of json array')
+            buf = chunk
+            pos = 0
+            continue
+
+        c = buf[pos]
+        if not started:
+            if c != '[':
+                raise ValueError('json data is not an array')
+            started = True
+            pos += 1
+        elif c == ']' and (not expect_value or empty):
+            return
+        elif c == ',' and not expect_value:
+            expect_value = True
+            pos += 1
+        elif expect_value:
+            try:
+                obj, end = _decoder.raw_decode(buf, pos)
+                nxt = end
+                while nxt < len(buf) and buf[nxt] in _whitespace:
+                    nxt += 1
+            except json.JSONDecodeError:
+                obj, end, nxt = None, -1, -1
+            # an element is only accepted once the separator after it has
+            # been read, since part of a number split between chunks also
+            # decodes
+            complete = nxt >= 0 and nxt < len(buf) and buf[nxt] in ',]'
+            if not complete and not eof:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    eof = True
+                else:
+                    buf = buf[pos:] + chunk
+                    pos = 0
+                continue
+            if end < 0:
+                raise ValueError('invalid json array element')
+            yield obj
+            pos = end
+            expect_value = False
+            empty = False
+        else:
+            raise ValueError('invalid json array')
+
+# yields the run dictionaries of a json file from the data dump
+def iter_runs(fileobj, chunk_size = 1 << 16):
+    for jrun in iter_array(fileobj, chunk_size = chunk_size):
+        yield jrun['event']
@@ -0,0 +1,196 @@
+# Instrumentation for the importers. A Profile collects the wall and CPU time
+# spent in each import stage (hash, decompress, parse, clean, insert,
+# commit) and in each cleaning validator, counts runs, rows and runs
+# rejected by each validator, and reports them with rows/sec and peak RSS as
+# a json-serializable dictionary. Pass one to the dump importers with
+# profile = Profile(); when no profile is given the importers skip all
+# timing.
+import json
+import platform
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# peak resident set size in MB of this process (who = 'self') or of its
+# terminated child processes (who = 'children'). None where the resource
+# module is not available.
+def peak_rss_mb(who = 'self'):
+    if resource is None:
+        return None
+    if who == 'self':
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    else:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    if platform.system() == 'Darwin':
+        return peak / 1048576
+    return peak / 1024
+
+# file object wrapper that adds the time spent in read() to a stage
+class _TimedReader:
+    def __init__(self, fileobj, profile, stage):
+        self._fileobj = fileobj
+        self._profile = profile
+        self._stage = stage
+
+    def read(self, size = -1):
+        t = self._profile.start()
+        data = self._fileobj.read(size)
+        self._profile.stop(self._stage, t)
+        return data
+
+class Profile:
+    # log_interval: if set, tick() prints a progress line at most every
+    # log_interval seconds
+    def __init__(self, log_interval = None):
+        self.stages = {}
+        self.validators = {}
+        self.rejected = {}
+        self.counters = {}
+        self.log_interval = log_interval
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        self._last_log = self._wall0
+        self._elapsed = None
+
+    def start(self):
+        return (time.perf_counter(), time.process_time())
+
+    # adds the time since start() (t) to a stage
+    def stop(self, stage, t, calls = 1):
+        self.add(stage, time.perf_counter() - t[0],
+                 time.process_time() - t[1], calls)
+
+    def add(self, stage, wall, cpu, calls = 1, table = None):
+        if table is None:
+            table = self.stages
+        entry = table.get(stage)
+        if entry is None:
+            table[stage] = [wall, cpu, calls]
+        else:
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] += calls
+
+    def stop_validator(self, name, t, calls = 1):
+        self.add(name, time.perf_counter() - t[0],
+                 time.process_time() - t[1], calls, table = self.validators)
+
+    def reject(self, validator, n = 1):
+        self.rejected[validator] = self.rejected.get(validator, 0) + n
+
+    def count(self, key, n = 1):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def reader(self, fileobj, stage = 'decompress'):
+        return _TimedReader(fileobj, self, stage)
+
+    # yields the items of iterable, adding the time spent producing them to
+    # stage. Time spent in the inner stage meanwhile (e.g. decompressing
+    # while parsing) is not counted twice.
+    def timed(self, iterable, stage, inner = None):
+        it = iter(iterable)
+        while True:
+            t = self.start()
+            before = self.stages.get(inner, (0.0, 0.0))[:2]
+            try:
+                item = next(it)
+            except StopIteration:
+                self._stop_outer(stage, t, inner, before, 0)
+                return
+            self._stop_outer(stage, t, inner, before, 1)
+            yield item
+
+    def _stop_outer(self, stage, t, inner, before, calls):
+        wall = time.perf_counter() - t[0]
+        cpu = time.process_time() - t[1]
+        after = self.stages.get(inner, (0.0, 0.0))[:2]
+        self.add(stage, wall - (after[0] - before[0]),
+                 cpu - (after[1] - before[1]), calls)
+
+    # raw data, e.g. to send a worker's profile to the main process
+    def data(self):
+        return {'stages':self.stages, 'validators':self.validators,
+                'rejected':self.rejected, 'counters':self.counters}
+
+    # adds the data of another profile (see data())
+    def merge(self, data):
+        for stage, (wall, cpu, calls) in data['stages'].items():
+            self.add(stage, wall, cpu, calls)
+        for name, (wall, cpu, calls) in data['validators'].items():
+            self.add(name, wall, cpu, calls, table = self.validators)
+        for name, n in data['rejected'].items():
+            self.rejected[name] = self.rejected.get(name, 0) + n
+        for key, n in data['counters'].items():
+            self.count(key, n)
+
+    # stops the clock of the report
+    def finish(self):
+        self._elapsed = (time.perf_counter() - self._wall0,
+                         time.process_time() - self._cpu0)
+
+    def _elapsed_now(self):
+        if self._elapsed is not None:
+            return self._elapsed
+        return (time.perf_counter() - self._wall0,
+                time.process_time() - self._cpu0)
+
+    def _rate(self, key, seconds):
+        n = self.counters.get(key, 0)
+        return n / seconds if seconds > 0 else None
+
+    # prints a progress line if log_interval seconds have passed since the
+    # last one
+    def tick(self):
+        if self.log_interval is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_log < self.log_interval:
+            return
+        self._last_log = now
+        wall = now - self._wall0
+        top = sorted(self.stages.items(), key = lambda s: -s[1][0])[:3]
+        print('[{:.0f}s] files {}, runs {}, rows {} ({:.0f} rows/s), '
+              '{}'.format(wall, self.counters.get('files', 0),
+                          self.counters.get('runs', 0),
+                          self.counters.get('rows', 0),
+                          self._rate('rows', wall) or 0,
+                          ', '.join('{} {:.1f}s'.format(s, e[0])
+                                    for s, e in top)))
+
+    def report(self):
+        wall, cpu = self._elapsed_now()
+        def entries(table):
+            return {k:{'wall':e[0], 'cpu':e[1], 'calls':e[2]}
+                    for k, e in table.items()}
+        return {'elapsed':{'wall':wall, 'cpu':cpu},
+                'counters':dict(self.counters),
+                'rows_per_sec':self._rate('rows', wall),
+                'runs_per_sec':self._rate('runs', wall),
+                'stages':entries(self.stages),
+                'validators':entries(self.validators),
+                'rejected_by_validator':dict(self.rejected),
+                'peak_rss_mb':peak_rss_mb('self'),
+                'peak_children_rss_mb':peak_rss_mb('children')}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent = 2)
+
+    # a few lines for the import summary
+    def summary(self):
+        report = self.report()
+        lines = ['elapsed: {:.1f}s wall, {:.1f}s cpu ({} rows/s)'.format(
+            report['elapsed']['wall'], report['elapsed']['cpu'],
+            '{:.0f}'.format(report['rows_per_sec'])
+            if report['rows_per_sec'] is not None else '-')]
+        for stage, e in report['stages'].items():
+            lines.append('  {}: {:.2f}s wall, {:.2f}s cpu'.format(
+                stage, e['wall'], e['cpu']))
+        for name, e in report['validators'].items():
+            lines.append('  {}: {:.2f}s wall, rejected {}'.format(
+                name, e['wall'], self.rejected.get(name, 0)))
+        return '\n'.join(lines)
@@ -0,0 +1,134 @@
+# Re-cleaning of MegaCritData after a reference table (Cards, Relics, ...)
+# or a validator module changed. Only the validators that read a changed
+# table or whose module changed are re-run, and only on the runs that none
+# of the other validators rejected (see verdicts.py). For the other runs the
+# re-run validators are marked stale, so they are checked if a later
+# re-clean makes the run a candidate again. Runs imported before the
+# verdict columns existed are checked by all validators.
+#
+# usage: python reclean.py DBPATH [--tables T ...] [--modules M ...]
+import argparse
+import json
+import sqlite3
+import datahelper
+import gamedata
+import verdicts
+
+# json text columns are stored as json.dumps of a list or dictionary
+def _from_sql(v):
+    if isinstance(v, str) and v[:1] in ('[', '{'):
+        return json.loads(v)
+    return v
+
+# Re-runs the validators depending on the given reference tables and
+# modules. If both are None, the tables and modules that changed since the
+# verdicts were computed are used. Returns the number of runs whose Clean
+# value changed.
+def reclean(dbpath, tables = None, modules = None, table = 'MegaCritData',
+            chunk_size = 10000, verbose = True):
+    con = sqlite3.connect(dbpath, isolation_level = None)
+    cur = con.cursor()
+    try:
+        datahelper._prepare_tables(cur, table)
+        if tables is None and modules is None:
+            tables, modules = verdicts.changes(cur)
+        mask = (verdicts.depending_on(tables or [])
+                | verdicts.mask_of(modules or []))
+        if verbose:
+            print('validators to re-run: {}'.format(
+                verdicts.names_of(mask)))
+        if mask == 0:
+            cur.execute('BEGIN')
+            verdicts.save_state(cur, verdicts.current_state(cur))
+            cur.execute('COMMIT')
+            return 0
+
+        game_dict = gamedata.load(cur).game_dict()
+        keys = verdicts.run_keys(game_keys = game_dict)
+        cols = [datahelper.snake_to_camel(k) for k in keys]
+        known = set(r[0] for r in cur.execute(
+            'SELECT name FROM pragma_table_info(\'{}\')'.format(table)))
+        keys = [k for k, c in zip(keys, cols) if c in known]
+        cols = [c for c in cols if c in known]
+
+        # runs another validator rejected keep that verdict; mark the
+        # re-run validators stale for them
+        cur.execute('BEGIN')
+        cur.execute('UPDATE {} SET VerdictsStale = VerdictsStale | ? '
+                    'WHERE Verdicts IS NOT NULL '
+                    'AND (Verdicts & ~(? | VerdictsStale)) <> 0'
+                    .format(table), (mask, mask))
+        cur.execute('COMMIT')
+
+        query = ('SELECT rowid, Clean, Verdicts, VerdictsStale, {} FROM {} '
+                 'WHERE rowid > ? AND (Verdicts IS NULL '
+                 'OR (Verdicts & ~(? | VerdictsStale)) = 0) '
+                 'ORDER BY rowid LIMIT ?'.format(','.join(cols), table))
+        update = ('UPDATE {} SET Clean = ?, Verdicts = ?, VerdictsStale = ? '
+                  'WHERE rowid = ?'.format(table))
+        lastrow = 0
+        nruns = 0
+        changed = 0
+        while True:
+            chunk = con.execute(query, (lastrow, mask, chunk_size)).fetchall()
+            if len(chunk) == 0:
+                break
+            updates = []
+            for r in chunk:
+                rowid, clean, failed, stale = r[:4]
+                if failed is None:
+                    run_mask, failed, stale = verdicts.ALL, 0, 0
+                else:
+                    run_mask = mask | stale
+                rundict = {k:_from_sql(v) for k, v in zip(keys, r[4:])}
+                try:
+                    new_failed, new_stale = verdicts.evaluate(
+                        rundict, game_dict, mask = run_mask)
+                except Exception:
+                    # a validator that cannot read the run rejects it
+                    new_failed = run_mask & -run_mask
+                    new_stale = run_mask & ~new_failed
+                failed = (failed & ~run_mask) | new_failed
+                stale = (stale & ~run_mask) | new_stale
+                new_clean = int(failed == 0)
+                changed += new_clean != clean
+                updates.append((new_clean, failed, stale, rowid))
+            cur.execute('BEGIN')
+            cur.executemany(update, updates)
+            cur.execute('COMMIT')
+            lastrow = chunk[-1][0]
+            nruns += len(chunk)
+            if verbose:
+                print('runs checked: {}'.format(nruns))
+
+        cur.execute('BEGIN')
+        verdicts.save_state(cur, verdicts.current_state(cur))
+        cur.execute('COMMIT')
+    except Exception as err:
+        if con.in_transaction:
+            cur.execute('ROLLBACK')
+        raise err
+    finally:
+        datahelper._forget_caches(cur)
+        con.close()
+    if verbose:
+        print('runs whose Clean value changed: {}'.format(changed))
+    return changed
+
+def main():
+    parser = argparse.ArgumentParser(description = 're-run the cleaning '
+                                     'validators affected by changed '
+                                     'reference tables or modules')
+    parser.add_argument('dbpath')
+    parser.add_argument('--tables', nargs = '*', default = None,
+                        help = 'changed reference tables')
+    parser.add_argument('--modules', nargs = '*', default = None,
+                        choices = verdicts.names,
+                        help = 'changed validator modules')
+    parser.add_argument('--table', default = 'MegaCritData')
+    args = parser.parse_args()
+    reclean(args.dbpath, tables = args.tables, modules = args.modules,
+            table = args.table)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+# Index of the .run files imported by the incremental run importers. Each
+# file is recorded with its size, modification time and content hash, and
+# the play id of the run it was imported as, so a later import only reads
+# files that are new or changed (and only reimports them if their contents
+# changed).
+import hashlib
+
+def create_table(sqlcur):
+    sqlcur.execute('CREATE TABLE IF NOT EXISTS RunFiles('
+                   'Path TEXT NOT NULL, TableName TEXT NOT NULL, Size INT, '
+                   'MTime REAL, Hash TEXT, PlayId TEXT, ImportedAt TEXT, '
+                   'PRIMARY KEY (Path, TableName))')
+
+# the index of a table as a dictionary {path:(size, mtime, hash, play_id)}
+def load(sqlcur, table):
+    sql = sqlcur.execute('SELECT Path, Size, MTime, Hash, PlayId '
+                         'FROM RunFiles WHERE TableName = ?', (table,))
+    return {r[0]:tuple(r[1:]) for r in sql}
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+# True if the file's size or modification time differs from its entry
+def is_changed(index, path, size, mtime):
+    entry = index.get(path)
+    return entry is None or entry[0] != size or entry[1] != mtime
+
+def record(sqlcur, table, path, size, mtime, contenthash, play_id):
+    sqlcur.execute('INSERT OR REPLACE INTO RunFiles VALUES '
+                   '(?, ?, ?, ?, ?, ?, datetime(\'now\'))',
+                   (path, table, size, mtime, contenthash, play_id))
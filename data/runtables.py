@@ -0,0 +1,194 @@
+# Normalized child tables for the per-run event lists that MegaCritData
+# stores as json text. Rows are keyed by PlayId, and card and relic names are
+# stored as integer ids from the item vocabulary (see vocab.py; upgrades are
+# split off into their own column), so pick rates, encounters and item counts can be
+# queried with indexed SQL instead of decoding json.
+import json
+import sqlite3
+import vocab
+
+# table: (column definitions, indexes)
+_tables = {
+    'RunCardChoices': ('PlayId TEXT NOT NULL, Floor INT, ItemId INT, '
+                       'Upgrades INT, Picked INT',
+                       ['PlayId', 'ItemId, Floor']),
+    'RunFights': ('PlayId TEXT NOT NULL, Floor INT, Encounter TEXT, '
+                  'Damage REAL, Turns INT',
+                  ['PlayId', 'Encounter, Floor']),
+    'RunEvents': ('PlayId TEXT NOT NULL, Floor INT, EventName TEXT, '
+                  'PlayerChoice TEXT',
+                  ['PlayId', 'EventName, Floor']),
+    'RunRelics': ('PlayId TEXT NOT NULL, Floor INT, ItemId INT',
+                  ['PlayId', 'ItemId, Floor'])
+    }
+
+child_tables = tuple(_tables)
+
+# position of the item name in the rows of the tables that store item ids
+_name_col = {'RunCardChoices':2, 'RunRelics':2}
+
+def create_tables(sqlcur):
+    vocab.create_tables(sqlcur)
+    for table, (cols, indexes) in _tables.items():
+        sqlcur.execute('CREATE TABLE IF NOT EXISTS {}({})'.format(table,
+                                                                  cols))
+        for i, idx_cols in enumerate(indexes):
+            sqlcur.execute('CREATE INDEX IF NOT EXISTS {0}_{1} '
+                           'ON {0}({2})'.format(table, i, idx_cols))
+
+def _card_choice_rows(play_id, card_choices):
+    rows = []
+    for c in card_choices:
+        floor = int(c['floor'])
+        rows.append((play_id, floor) + vocab.split_upgrades(c['picked'])
+                    + (1,))
+        for name in c['not_picked']:
+            rows.append((play_id, floor) + vocab.split_upgrades(name) + (0,))
+    return rows
+
+def _fight_rows(play_id, damage_taken):
+    return [(play_id, int(d['floor']), d['enemies'], d.get('damage'),
+             d.get('turns')) for d in damage_taken]
+
+def _event_rows(play_id, event_choices):
+    return [(play_id, int(e['floor']), e['event_name'],
+             e.get('player_choice')) for e in event_choices]
+
+def _relic_rows(play_id, relics_obtained, boss_relics, event_choices,
+                items_purchased, item_purchase_floors, relic_names):
+    rows = []
+    for r in relics_obtained:
+        rows.append((play_id, int(r['floor']), r['key']))
+    for i, br in enumerate(boss_relics[:2]):
+        if 'picked' in br:
+            rows.append((play_id, 17 if i == 0 else 34, br['picked']))
+    for e in event_choices:
+        for name in e.get('relics_obtained', []):
+            rows.append((play_id, int(e['floor']), name))
+    if relic_names is not None:
+        for i, item in enumerate(items_purchased):
+            if item in relic_names:
+                rows.append((play_id, int(item_purchase_floors[i]), item))
+    return rows
+
+# child table rows of a run, with item names not yet converted to ids. A
+# malformed list leaves its table without rows for the run instead of
+# rejecting it.
+def run_rows(rundict, relic_names = None):
+    play_id = rundict.get('play_id')
+    if play_id is None:
+        return {}
+    get = rundict.get
+    builders = {
+        'RunCardChoices': lambda: _card_choice_rows(play_id,
+                                                    get('card_choices', [])),
+        'RunFights': lambda: _fight_rows(play_id, get('damage_taken', [])),
+        'RunEvents': lambda: _event_rows(play_id, get('event_choices', [])),
+        'RunRelics': lambda: _relic_rows(play_id, get('relics_obtained', []),
+                                         get('boss_relics', []),
+                                         get('event_choices', []),
+                                         get('items_purchased', []),
+                                         get('item_purchase_floors', []),
+                                         relic_names)
+        }
+    rows = {}
+    for table, build in builders.items():
+        try:
+            rows[table] = build()
+        except (KeyError, TypeError, ValueError, IndexError,
+                AttributeError):
+            continue
+    return rows
+
+# drops cached item ids, e.g. after a rollback has undone new items
+def forget(sqlcur):
+    vocab.forget(sqlcur)
+
+# inserts child rows produced by run_rows, merged by table
+def insert_rows(sqlcur, children):
+    for table, rows in children.items():
+        if len(rows) == 0:
+            continue
+        if table in _name_col:
+            i = _name_col[table]
+            rows = [r[:i] + (vocab.item_id(sqlcur, r[i]),) + r[i + 1:]
+                    for r in rows]
+        qmarks = ','.join(['?'] * len(rows[0]))
+        sqlcur.executemany('INSERT INTO {} VALUES ({})'.format(table, qmarks),
+                           rows)
+
+# json columns of the runs that the child rows are built from, and their
+# keys in the run dicts
+_json_cols = ['PlayId', 'CardChoices', 'DamageTaken', 'EventChoices',
+              'RelicsObtained', 'BossRelics', 'ItemsPurchased',
+              'ItemPurchaseFloors']
+_json_keys = ['play_id', 'card_choices', 'damage_taken', 'event_choices',
+              'relics_obtained', 'boss_relics', 'items_purchased',
+              'item_purchase_floors']
+
+def _relic_names(sqlcur):
+    return frozenset(r[0] for r in sqlcur.execute('SELECT Name FROM Relics'))
+
+# inserts the child rows of the runs of a query on _json_cols, chunk_size
+# runs at a time. Returns the number of runs.
+def _insert_runs(sqlcur, sql, relic_names, chunk_size, verbose = False):
+    nruns = 0
+    while True:
+        chunk = sql.fetchmany(chunk_size)
+        if len(chunk) == 0:
+            break
+        children = {}
+        for r in chunk:
+            rundict = {_json_keys[0]:r[0]}
+            for k, v in zip(_json_keys[1:], r[1:]):
+                if v is not None:
+                    rundict[k] = json.loads(v)
+            for child, rows in run_rows(rundict, relic_names).items():
+                children.setdefault(child, []).extend(rows)
+        insert_rows(sqlcur, children)
+        nruns += len(chunk)
+        if verbose:
+            print('runs processed: {}'.format(nruns))
+    return nruns
+
+# rebuilds the child tables from the json columns of runs already in the
+# database, chunk_size runs at a time
+def build(dbpath, table = 'MegaCritData', chunk_size = 10000):
+    con = sqlite3.connect(dbpath, isolation_level = None)
+    cur = con.cursor()
+    try:
+        create_tables(cur)
+        relic_names = _relic_names(cur)
+        cur.execute('BEGIN')
+        for child in _tables:
+            cur.execute('DELETE FROM {}'.format(child))
+
+        sql = con.execute('SELECT {} FROM {}'.format(','.join(_json_cols),
+                                                     table))
+        _insert_runs(cur, sql, relic_names, chunk_size, verbose = True)
+        cur.execute('COMMIT')
+    except Exception as err:
+        if con.in_transaction:
+            cur.execute('ROLLBACK')
+        raise err
+    finally:
+        forget(cur)
+        con.close()
+
+# replaces the child rows of the runs of table whose PlayId is returned by
+# the query play_ids, e.g. after duplicate copies of these runs were
+# removed. Runs in the caller's transaction; does nothing if the database
+# has no child tables.
+def rebuild_runs(sqlcur, play_ids, table = 'MegaCritData',
+                 chunk_size = 10000):
+    names = set(r[0] for r in sqlcur.execute(
+        'SELECT name FROM sqlite_master WHERE type = \'table\''))
+    if not names.issuperset(_tables):
+        return 0
+    for child in _tables:
+        sqlcur.execute('DELETE FROM {} WHERE PlayId IN ({})'.format(
+            child, play_ids))
+    sql = sqlcur.connection.execute('SELECT {} FROM {} WHERE PlayId IN ({})'
+                                    .format(','.join(_json_cols), table,
+                                            play_ids))
+    return _insert_runs(sqlcur, sql, _relic_names(sqlcur), chunk_size)
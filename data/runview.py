@@ -0,0 +1,224 @@
+# The fields of a run that the cleaning validators read, gathered in a
+# single pass over its lists (see verdicts.evaluate). Each validator module
+# has a check(view, game_dict) that reads a RunView instead of walking the
+# raw lists again:
+#   floor_range: (lowest, highest) floor of all floor lists and of the
+#       entries of the lists of dictionaries, None if there are none
+#   campfire_floors: floors of the campfire choices
+#   item_set: names of all cards, relics and potions of the run
+#       (item_cleaning), upgrades trimmed
+#   event_names, enemies: names of the events and fights of the run
+#   relic_changes: gold_hp_cleaning.relic_changes of the run, None if it
+#       cannot be computed (no starting relics, a purchase without a floor)
+# The validators only read the view of regular runs: runs whose lists are
+# shaped the way the game writes them (every key present, floors ints,
+# names strings, ...). Anything else marks the run irregular and the
+# validators run their is_clean functions on view.args instead, so those
+# runs are rejected, or raise, exactly as before.
+from itertools import chain
+from operator import itemgetter
+import gold_hp_cleaning
+import item_cleaning
+
+_number_types = {int, float}
+_int_types = {int}
+_str_types = {str}
+_list_types = {list}
+_name_types = {str, type(None)}
+# gold and hp values of regular runs (and their differences) are exact as
+# floats, so comparing them matches numpy
+_exact = 2 ** 52
+
+# keys with a default of None when missing from a run
+optional_keys = ['killed_by', 'neow_bonus', 'neow_cost']
+
+_number_fields = ['ascension_level', 'gold', 'player_experience']
+# fields only compared to 0 or passed through
+_other_fields = ['is_trial', 'is_prod', 'is_daily', 'chose_seed',
+                 'is_endless', 'character_chosen']
+_floor_lists = ['potions_floor_usage', 'item_purchase_floors',
+                'items_purged_floors', 'potions_floor_spawned']
+_value_lists = ['gold_per_floor', 'current_hp_per_floor', 'max_hp_per_floor']
+_name_lists = ['master_deck', 'relics', 'items_purchased', 'items_purged']
+_event_items = ['cards_obtained', 'cards_removed', 'cards_transformed',
+                'relics_obtained', 'potions_obtained']
+
+_neow_relics = frozenset(['RANDOM_COMMON_RELIC', 'THREE_ENEMY_KILL',
+                          'ONE_RARE_RELIC'])
+
+_floor = itemgetter('floor')
+_key = itemgetter('key')
+_picked = itemgetter('picked')
+_not_picked = itemgetter('not_picked')
+_enemies = itemgetter('enemies')
+_event_name = itemgetter('event_name')
+
+def validator_args(json_dict):
+    args_dict = json_dict.copy()
+    for key in optional_keys:
+        if key not in json_dict:
+            args_dict[key] = None
+    return args_dict
+
+def _new_floor(rc, floor):
+    change = rc.get(floor)
+    if change is None:
+        change = rc[floor] = [set(), set()]
+    return change
+
+class RunView:
+    __slots__ = ('args', 'regular', 'floor_range', 'campfire_floors',
+                 'item_set', 'event_names', 'enemies', 'relic_changes')
+
+    def __init__(self, json_dict, game_dict):
+        self.args = validator_args(json_dict)
+        try:
+            self.regular = self._build(self.args,
+                                       game_dict.get('relic_names', ()))
+        except Exception:
+            # whatever went wrong, the is_clean functions will meet it too
+            self.regular = False
+
+    # fills the fields in one pass over the run's lists. Returns whether the
+    # run is regular.
+    def _build(self, a, relic_names):
+        for key in _number_fields:
+            if type(a[key]) not in _number_types:
+                return False
+        if any(key not in a for key in _other_fields):
+            return False
+        floor_reached = a['floor_reached']
+        if type(floor_reached) is not int:
+            return False
+        if type(a['killed_by']) not in _name_types:
+            return False
+        if (type(a['neow_bonus']) not in _name_types
+                or type(a['neow_cost']) not in _name_types):
+            return False
+        for key in _name_lists + _floor_lists + _value_lists:
+            if type(a[key]) is not list:
+                return False
+        for key in _value_lists:
+            values = a[key]
+            if not set(map(type, values)) <= _number_types:
+                return False
+            if values and not (-_exact < min(values)
+                               and max(values) < _exact):
+                return False
+        path = a['path_per_floor']
+        if type(path) is not list or not set(map(type, path)) <= _name_types:
+            return False
+
+        floors = []
+        # strings the view relies on: item names, relic keys, event and
+        # enemy names
+        names = []
+        items = (a['master_deck'] + a['items_purged']
+                 + a['items_purchased'])
+        names += a['relics']
+
+        # relic changes, in the order of gold_hp_cleaning.relic_changes
+        relics = a['relics']
+        rc = None
+        if len(relics) > 0:
+            if a['neow_bonus'] in _neow_relics:
+                rc = {0:[set(relics[0:2]), set()]}
+            else:
+                rc = {0:[{relics[0]}, set()]}
+
+        relics_obtained = a['relics_obtained']
+        obtained_floors = list(map(_floor, relics_obtained))
+        obtained = list(map(_key, relics_obtained))
+        floors += obtained_floors
+        names += obtained
+        if rc is not None:
+            for floor, rel in zip(obtained_floors, obtained):
+                _new_floor(rc, floor)[0].add(rel)
+
+        boss_relics = a['boss_relics']
+        if len(boss_relics) > 2:
+            return False
+        for i, d in enumerate(boss_relics):
+            skipped = d['not_picked']
+            if type(skipped) is not list:
+                return False
+            items += skipped
+            if 'picked' in d:
+                rel = d['picked']
+                items.append(rel)
+                if rc is not None:
+                    change = _new_floor(rc, 17 if i == 0 else 34)
+                    change[0].add(rel)
+                    if rel in gold_hp_cleaning.boss_relic_upgrades:
+                        change[1].add(
+                            gold_hp_cleaning.boss_relic_upgrades[rel])
+
+        event_choices = a['event_choices']
+        event_names = list(map(_event_name, event_choices))
+        for d in event_choices:
+            floor = d['floor']
+            floors.append(floor)
+            for key in _event_items:
+                if key in d:
+                    if type(d[key]) is not list:
+                        return False
+                    items += d[key]
+            lost = ()
+            if 'relics_lost' in d:
+                lost = d['relics_lost']
+                if type(lost) is not list:
+                    return False
+                names += lost
+            # item_cleaning reads relics_lost when relics_removed is logged
+            if 'relics_removed' in d:
+                items += d['relics_lost']
+            if rc is not None:
+                change = _new_floor(rc, floor)
+                change[0].update(d.get('relics_obtained', ()))
+                change[1].update(lost)
+        names += event_names
+
+        purchase_floors = a['item_purchase_floors']
+        if rc is not None:
+            if len(a['items_purchased']) > len(purchase_floors):
+                rc = None
+            else:
+                for i, item in enumerate(a['items_purchased']):
+                    if item in relic_names:
+                        _new_floor(rc, purchase_floors[i])[0].add(item)
+
+        card_choices = a['card_choices']
+        floors += map(_floor, card_choices)
+        items += map(_picked, card_choices)
+        skipped = list(map(_not_picked, card_choices))
+        if not set(map(type, skipped)) <= _list_types:
+            return False
+        items += chain.from_iterable(skipped)
+
+        damage_taken = a['damage_taken']
+        floors += map(_floor, damage_taken)
+        enemies = list(map(_enemies, damage_taken))
+        names += enemies
+
+        campfire_floors = list(map(_floor, a['campfire_choices']))
+        floors += campfire_floors
+
+        potions_obtained = a['potions_obtained']
+        floors += map(_floor, potions_obtained)
+        names += map(_key, potions_obtained)
+
+        for key in _floor_lists:
+            floors += a[key]
+
+        names += items
+        if not (set(map(type, floors)) <= _int_types
+                and set(map(type, names)) <= _str_types):
+            return False
+
+        self.floor_range = (min(floors), max(floors)) if floors else None
+        self.campfire_floors = campfire_floors
+        self.item_set = set(map(item_cleaning.trim_card_name, set(items)))
+        self.event_names = event_names
+        self.enemies = enemies
+        self.relic_changes = rc
+        return True
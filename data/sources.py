@@ -0,0 +1,398 @@
+# Source readers for the data dump. Each reader makes a single pass over a
+# directory or archive and yields its json members as (name, src, gzipped)
+# tuples, where src is either the raw bytes of the member or a path to it,
+# and gzipped tells whether those bytes are gzip compressed. Members that
+# were requested but could not be found are yielded last with src = None.
+# Members are plain tuples so they can be handed to worker processes.
+import gzip
+import hashlib
+import io
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+from py7zr import SevenZipFile
+from py7zr.callbacks import ExtractCallback
+try:
+    from py7zr.io import Py7zIO, WriterFactory
+except ImportError:
+    Py7zIO = WriterFactory = None
+
+def _is_gzipped(name):
+    return name.endswith('.gz')
+
+def _is_json(name):
+    return name.endswith('.json') or name.endswith('.json.gz')
+
+def _is_tar(path):
+    return (path.endswith('.tar') or path.endswith('.tar.gz')
+            or path.endswith('.tgz') or path.endswith('.tar.xz')
+            or path.endswith('.tar.bz2'))
+
+# opens a member as a binary file object, decompressing it if necessary
+def open_member(member):
+    name, src, gzipped = member
+    if src is None:
+        raise FileNotFoundError(name)
+    if isinstance(src, bytes):
+        fileobj = io.BytesIO(src)
+        if gzipped:
+            return gzip.GzipFile(fileobj = fileobj)
+        return fileobj
+    if gzipped:
+        return gzip.open(src)
+    return open(src, 'rb')
+
+# sha1 hex digest of the raw (possibly compressed) contents of a member
+def member_hash(member):
+    name, src, gzipped = member
+    if src is None:
+        raise FileNotFoundError(name)
+    if isinstance(src, bytes):
+        return hashlib.sha1(src).hexdigest()
+    h = hashlib.sha1()
+    with open(src, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# members of a directory of .json.gz or .json files. Compressed files are
+# read into memory (so that prefetching them overlaps disk reads with
+# cleaning), plain json files are passed by path and streamed when opened.
+def iter_dir(jsondir, filenames):
+    for name in filenames:
+        path = os.path.join(jsondir, name)
+        if not os.path.isfile(path):
+            yield (name, None, _is_gzipped(name))
+        elif _is_gzipped(name):
+            with open(path, 'rb') as f:
+                yield (name, f.read(), True)
+        else:
+            yield (name, path, False)
+
+_end = object()
+
+# Raised in the extraction thread of iter_7z when the reader has stopped
+class _Stopped(Exception):
+    pass
+
+# Bounded handoff of members from an extraction thread to the reader. put
+# blocks while depth members are waiting and raises _Stopped once the
+# reader has stopped, which aborts the extraction.
+class _Handoff:
+    def __init__(self, depth):
+        self.q = queue.Queue(maxsize = max(depth, 1))
+        self.stop = threading.Event()
+
+    def check(self):
+        if self.stop.is_set():
+            raise _Stopped()
+
+    def put(self, item):
+        while True:
+            self.check()
+            try:
+                self.q.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                continue
+
+if WriterFactory is not None:
+    # buffer of the member being extracted; stops the extraction as soon as
+    # the reader has stopped
+    class _MemberWriter(Py7zIO):
+        def __init__(self, handoff):
+            self._handoff = handoff
+            self._buf = io.BytesIO()
+
+        def write(self, s):
+            self._handoff.check()
+            return self._buf.write(s)
+
+        def read(self, size = None):
+            return self._buf.read(size)
+
+        def seek(self, offset, whence = 0):
+            return self._buf.seek(offset, whence)
+
+        def flush(self):
+            pass
+
+        def size(self):
+            return self._buf.getbuffer().nbytes
+
+    # Members are written one at a time (the archive is read sequentially),
+    # so a member is complete, and its CRC checked, once the next one is
+    # created or the extraction returns; it is handed over then.
+    class _HandoffFactory(WriterFactory):
+        def __init__(self, handoff):
+            self._handoff = handoff
+            self._current = None
+
+        def create(self, filename):
+            self.finish()
+            self._current = (filename, _MemberWriter(self._handoff))
+            return self._current[1]
+
+        def finish(self):
+            if self._current is not None:
+                name, writer = self._current
+                self._current = None
+                self._handoff.put((name, writer._buf.getvalue()))
+
+# calls f once it has been called n times, from any threads
+class _Countdown:
+    def __init__(self, n, f):
+        self._n = n
+        self._f = f
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self._n -= 1
+            last = self._n == 0
+        if last:
+            self._f()
+
+# reports the members extracted into spool to ready as (name, None), once
+# they are complete and their CRC checked; once the reader has stopped they
+# are emptied instead
+class _SpoolCallback(ExtractCallback):
+    def __init__(self, spool, ready, handoff):
+        self._spool = spool
+        self._ready = ready
+        self._handoff = handoff
+
+    def report_start_preparation(self):
+        pass
+
+    def report_start(self, processing_file_path, processing_bytes):
+        pass
+
+    def report_end(self, processing_file_path, wrote_bytes):
+        if self._handoff.stop.is_set():
+            _truncate(os.path.join(self._spool, processing_file_path))
+        else:
+            self._ready.put((processing_file_path, None))
+
+    def report_warning(self, message):
+        pass
+
+    def report_postprocess(self):
+        pass
+
+# empties a spooled member; py7zr sets the times of the extracted files
+# once the extraction is done, so they are not removed before that
+def _truncate(path):
+    if os.path.isfile(path):
+        open(path, 'wb').close()
+
+# py7zr before 1.0 has no writer hook, and reading members one at a time
+# decompresses a solid block again for every member. The archive is
+# extracted once into a spool directory by a second thread instead, and the
+# members are handed over, and their files emptied, as soon as they are
+# complete; only the handoff is bounded, not the spool. A stopped reader
+# cannot abort the extraction: it runs to its end in the background,
+# emptying members as they come, and the spool is removed by whichever
+# thread finishes last.
+def _spool_7z(archive_path, order, handoff):
+    spool = tempfile.mkdtemp(prefix = 'iter_7z-')
+    ready = queue.Queue()
+    release = _Countdown(2, lambda: shutil.rmtree(spool,
+                                                  ignore_errors = True))
+
+    def extract():
+        try:
+            with open(archive_path, 'rb') as f, SevenZipFile(f) as archive:
+                archive.extractall(path = spool, callback = _SpoolCallback(
+                    spool, ready, handoff))
+            ready.put((_end, None))
+        except Exception as err:
+            ready.put((None, err))
+        finally:
+            release()
+
+    threading.Thread(target = extract, daemon = True).start()
+    targets = set(order)
+    try:
+        while True:
+            handoff.check()
+            name, err = ready.get()
+            if name is None:
+                raise err
+            if name is _end:
+                return
+            path = os.path.join(spool, name)
+            if name in targets and os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                _truncate(path)
+                handoff.put((name, data))
+            else:
+                _truncate(path)
+    finally:
+        release()
+
+# extracts the members in order from a 7z archive into handoff, as
+# (name, bytes)
+def _extract_7z(archive_path, order, handoff):
+    if WriterFactory is None:
+        _spool_7z(archive_path, order, handoff)
+        return
+    with open(archive_path, 'rb') as f, SevenZipFile(f) as archive:
+        factory = _HandoffFactory(handoff)
+        archive.extract(targets = order, factory = factory)
+        factory.finish()
+
+# members of a 7z archive. The archive is decompressed in a single pass, in
+# archive order, by a background thread that hands the members over in
+# memory, keeping at most depth of them waiting: the extraction pauses when
+# the reader falls behind, and stops when the generator is closed (with
+# py7zr 1.0 and later; see _spool_7z for older versions).
+def iter_7z(archive_path, filenames = None, depth = 4):
+    with SevenZipFile(archive_path) as archive:
+        names = archive.getnames()
+    if filenames is None:
+        order = [n for n in names if _is_json(n)]
+        missing = []
+    else:
+        targets = set(filenames)
+        order = [n for n in names if n in targets]
+        found = set(order)
+        missing = [n for n in filenames if n not in found]
+
+    handoff = _Handoff(depth)
+
+    def extract():
+        try:
+            if len(order) > 0:
+                _extract_7z(archive_path, order, handoff)
+            handoff.put((_end, None))
+        except _Stopped:
+            pass
+        except Exception as err:
+            try:
+                handoff.put((None, err))
+            except _Stopped:
+                pass
+
+    thread = threading.Thread(target = extract, daemon = True)
+    thread.start()
+    extracted = set()
+    try:
+        while True:
+            name, data = handoff.q.get()
+            if name is None:
+                raise data
+            if name is _end:
+                break
+            extracted.add(name)
+            yield (name, data, _is_gzipped(name))
+    finally:
+        handoff.stop.set()
+        thread.join()
+
+    for name in order + missing:
+        if name not in extracted:
+            yield (name, None, _is_gzipped(name))
+
+# members of a tar archive (optionally compressed), read as a stream in a
+# single pass. Members are matched by their base name.
+def iter_tar(tar_path, filenames = None):
+    targets = None if filenames is None else set(filenames)
+    found = set()
+    with tarfile.open(tar_path, 'r|*') as tar:
+        for info in tar:
+            name = os.path.basename(info.name)
+            if not info.isfile():
+                continue
+            if targets is None:
+                if not _is_json(name):
+                    continue
+            elif name not in targets:
+                continue
+            found.add(name)
+            yield (name, tar.extractfile(info).read(), _is_gzipped(name))
+
+    if targets is not None:
+        for name in filenames:
+            if name not in found:
+                yield (name, None, _is_gzipped(name))
+
+# names of the json members of a source. Listing a tar archive requires a
+# pass over the whole archive.
+def member_names(path):
+    if os.path.isdir(path):
+        return sorted(n for n in os.listdir(path) if _is_json(n))
+    elif path.endswith('.7z'):
+        with SevenZipFile(path) as archive:
+            return [n for n in archive.getnames() if _is_json(n)]
+    elif _is_tar(path):
+        with tarfile.open(path, 'r|*') as tar:
+            return [os.path.basename(info.name) for info in tar
+                    if info.isfile() and _is_json(info.name)]
+    else:
+        return [os.path.basename(path)]
+
+# chooses a reader from the path: a directory, a 7z archive, a tar archive or
+# a single .json/.json.gz file
+def open_source(path, filenames = None):
+    if os.path.isdir(path):
+        if filenames is None:
+            filenames = member_names(path)
+        return iter_dir(path, filenames)
+    elif path.endswith('.7z'):
+        return iter_7z(path, filenames)
+    elif _is_tar(path):
+        return iter_tar(path, filenames)
+    else:
+        jsondir, name = os.path.split(path)
+        return iter_dir(jsondir, [name])
+
+# reads members in a background thread, keeping up to depth members ready
+# while the current ones are being cleaned and inserted
+def prefetch(members, depth = 4):
+    if depth <= 0:
+        yield from members
+        return
+
+    q = queue.Queue(maxsize = depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for member in members:
+                if not put((member, None)):
+                    break
+        except Exception as err:
+            put((None, err))
+        finally:
+            close = getattr(members, 'close', None)
+            if close is not None:
+                close()
+        put((_end, None))
+
+    thread = threading.Thread(target = produce, daemon = True)
+    thread.start()
+    try:
+        while True:
+            member, err = q.get()
+            if err is not None:
+                raise err
+            if member is _end:
+                return
+            yield member
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,841 @@
+# Checks the cleaning validators against the original code on fuzzed runs.
+# usage: python -m unittest test_cleaning (from this directory)
+import copy
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+import benchmark
+import gamedata
+import gold_hp_cleaning
+import runview
+import verdicts
+
+# relics of the fuzzed relic changes: the relics of the rule tables, relics
+# of the reference tables and names outside them
+_fuzz_relics = (sorted(gold_hp_cleaning._relic_effects
+                       | set(gold_hp_cleaning.held_relic_combat))
+                + [r for r, _ in benchmark._relics] + ['Not A Relic', 'Junk'])
+
+# Frozen copy of the original gold and max hp bounds of gold_hp_cleaning,
+# the reference of the tests below. It is not to be updated with the module.
+
+def ref_relic_changes(relics_obtained, boss_relics, event_choices, relics,
+                      neow_bonus, items_purchased, item_purchase_floors,
+                      relic_names):
+
+    if (neow_bonus == 'RANDOM_COMMON_RELIC'
+        or neow_bonus == 'THREE_ENEMY_KILL'
+        or neow_bonus == 'ONE_RARE_RELIC'):
+        starting_relics = relics[0:2]
+    else:
+        starting_relics = [relics[0]]
+
+    rc = {0:[set(starting_relics), set()]}
+
+    for d in relics_obtained:
+        floor = int(d['floor'])
+        rel = d['key']
+        if floor not in rc:
+            rc[floor] = [set(), set()]
+        rc[floor][0].add(rel)
+
+    for i, d in enumerate(boss_relics):
+        if 'picked' in d:
+            rel = d['picked']
+            if i == 0:
+                floor = 17
+            elif i == 1:
+                floor = 34
+            if floor not in rc:
+                rc[floor] = [set(), set()]
+            rc[floor][0].add(rel)
+
+            if rel == 'Black Blood':
+                rc[floor][1].add('Burning Blood')
+            elif rel == 'Ring of the Serpent':
+                rc[floor][1].add('Ring of the Snake')
+            elif rel == 'FrozenCore':
+                rc[floor][1].add('Cracked Core')
+            elif rel == 'HolyWater':
+                rc[floor][1].add('PureWater')
+
+    for d in event_choices:
+        rels = set()
+        rels_lost = set()
+        if 'relics_obtained' in d:
+            rels = set(d['relics_obtained'])
+        if 'relics_lost' in d:
+            rels_lost = set(d['relics_lost'])
+        floor = int(d['floor'])
+        if floor not in rc:
+            rc[floor] = [set(), set()]
+        rc[floor][0] |= rels
+        rc[floor][1] |= rels_lost
+
+    for i in range(len(items_purchased)):
+        item = items_purchased[i]
+        floor = item_purchase_floors[i]
+        if item in relic_names:
+            if floor not in rc:
+                rc[floor] = [set(), set()]
+            rc[floor][0].add(item)
+
+    return rc
+
+def ref_relics_by_floor(relic_changes, floor_reached):
+    if floor_reached == 0:
+        return []
+
+    rbf = [None] * (floor_reached + 1)
+    rbf[0] = relic_changes[0][0]
+
+    for i in range(1, floor_reached + 1):
+        if i in relic_changes:
+            rbf[i] = (rbf[i - 1] | relic_changes[i][0]) - relic_changes[i][1]
+        else:
+            rbf[i] = rbf[i - 1]
+
+    return rbf
+
+def ref_trim_card(card_name):
+    upgrade_ind = card_name.find('+')
+    if upgrade_ind >= 0:
+        return card_name[:upgrade_ind]
+    else:
+        return card_name
+
+def ref_earliest_gold_hp_cards(card_choices, event_choices,
+                               items_purchased, item_purchase_floors,
+                               neow_bonus, relic_changes, character_chosen):
+
+    unlogged_additions = []
+    unlogged_removals = []
+    unlogged_transforms = []
+    hog_floor = 57
+    wish_floor = 57
+    feed_floor = 57
+    prismatic_floor = 57
+
+    neow_removals = {'REMOVE_CARD', 'REMOVE_TWO'}
+    neow_transforms = {'TRANSFORM_CARD', 'TRANSFORM_TWO_CARDS'}
+    if neow_bonus == 'ONE_RANDOM_RARE_CARD':
+        unlogged_additions.append(0)
+    elif neow_bonus in neow_removals:
+        unlogged_removals.append(0)
+    elif neow_bonus in neow_transforms:
+        unlogged_transforms.append(0)
+
+    for floor in iter(relic_changes):
+        relics_gained = relic_changes[floor][0]
+        if 'Tiny House' in relics_gained:
+            unlogged_additions.append(floor)
+        if 'Empty Cage' in relics_gained:
+            unlogged_removals.append(floor)
+        if 'Pandora\'s Box' in relics_gained or 'Astrolabe' in relics_gained:
+            unlogged_transforms.append(floor)
+        if 'PrismaticShard' in relics_gained:
+            prismatic_floor = floor
+        if 'Nilry\'s Codex' in relics_gained or 'Dead Branch' in relics_gained:
+            hog_floor = min(hog_floor, floor)
+
+    if character_chosen == 'IRONCLAD':
+        min_wish_floor = prismatic_floor
+        min_feed_floor = 0
+    elif character_chosen == 'THE_SILENT' or character_chosen == 'DEFECT':
+        min_wish_floor = prismatic_floor
+        min_feed_floor = prismatic_floor
+    elif character_chosen == 'WATCHER':
+        min_wish_floor = 0
+        min_feed_floor = prismatic_floor
+
+    for choice in card_choices:
+        picked = ref_trim_card(choice['picked'])
+        floor = int(choice['floor'])
+        if picked == 'HandOfGreed':
+            hog_floor = min(hog_floor, floor)
+        elif picked == 'Wish':
+            wish_floor = min(wish_floor, floor)
+        elif picked == 'Feed':
+            feed_floor = min(feed_floor, floor)
+
+    for event in event_choices:
+        if 'cards_obtained' in event:
+            floor = int(event['floor'])
+            card_reward = [ref_trim_card(card)
+                           for card in event['cards_obtained']]
+            if 'HandOfGreed' in card_reward:
+                hog_floor = min(hog_floor, floor)
+            if 'Wish' in card_reward:
+                wish_floor = min(wish_floor, floor)
+            if 'Feed' in card_reward:
+                feed_floor = min(feed_floor, floor)
+
+        if 'cards_transformed' in event:
+            unlogged_transforms.append(int(event['floor']))
+
+    for i, item in enumerate(items_purchased):
+        if ref_trim_card(item) == 'HandOfGreed':
+            hog_floor = min(hog_floor, item_purchase_floors[i])
+        elif ref_trim_card(item) == 'Wish':
+            wish_floor = min(wish_floor, item_purchase_floors[i])
+        elif ref_trim_card(item) == 'Feed':
+            feed_floor = min(feed_floor, item_purchase_floors[i])
+
+    for floor in unlogged_additions + unlogged_transforms:
+        hog_floor = min(hog_floor, floor)
+        if min_wish_floor <= floor:
+            wish_floor = min(wish_floor, floor)
+        if min_feed_floor <= floor:
+            feed_floor = min(feed_floor, floor)
+
+    return (hog_floor, feed_floor, wish_floor)
+
+def ref_fruit_juice_hp(relic_changes, potions_obtained, items_purchased,
+                       item_purchase_floors, event_choices, floor_reached):
+    bark_floor = 57
+    for floor in iter(relic_changes):
+        if 'SacredBark' in relic_changes[floor][0]:
+            bark_floor = floor
+
+    hp_by_floor = np.zeros(floor_reached + 1, dtype = int)
+
+    for pot in potions_obtained:
+        if pot['key'] == 'Fruit Juice':
+            floor = int(pot['floor'])
+            hp_by_floor[floor] += 5 * (1 + (bark_floor >= floor))
+
+    for i, item in enumerate(items_purchased):
+        if item == 'Fruit Juice':
+            floor = item_purchase_floors[i]
+            hp_by_floor[floor] += 5 * (1 + (bark_floor >= floor))
+
+    for event in event_choices:
+        if 'potions_obtained' in event:
+            potions = event['potions_obtained']
+            for pot in potions:
+                if pot == 'Fruit Juice':
+                    floor = int(event['floor'])
+                    hp_by_floor[floor] += 5 * (1 + (bark_floor >= floor))
+
+    # fruit juice obtained through Entropic Brew cannot be tracked.
+    extra = 10
+    hp_by_floor[0] += extra * 5 * (1 + (bark_floor >= floor))
+
+    return hp_by_floor
+
+def ref_neow_gold(neow_bonus, neow_cost):
+    if neow_cost == 'NO_GOLD':
+        gold = 0
+    else:
+        gold = 99
+
+    if neow_bonus == 'HUNDRED_GOLD':
+        gold += 100
+    elif neow_bonus == 'TWO_FIFTY_GOLD':
+        gold += 250
+
+    return gold
+
+def ref_neow_hp(neow_bonus, neow_cost, character_chosen):
+    hp = 0
+
+    if character_chosen == 'IRONCLAD':
+        hp = 80
+    elif character_chosen == 'THE_SILENT':
+        hp = 70
+    elif character_chosen == 'DEFECT':
+        hp = 75
+    else:
+        hp = 72
+
+    if neow_bonus == 'TEN_PERCENT_HP_BONUS':
+        hp = np.ceil(1.1 * hp)
+    elif neow_bonus == 'TWENTY_PERCENT_HP_BONUS':
+        hp = np.ceil(1.2 * hp)
+
+    if neow_cost == 'TEN_PERCENT_HP_LOSS':
+        hp = np.ceil(0.9 * hp)
+
+    return hp
+
+def ref_periapt_hp(master_deck, relic_changes, event_choices, items_purged,
+                   campfire_choices):
+    astrolabe = False
+    cage = False
+    periapt = False
+    mirror = False
+    for rels, _ in iter(relic_changes.values()):
+        if 'Astrolabe' in rels:
+            astrolabe = True
+        if 'Empty Cage' in rels:
+            cage = True
+        if 'Darkstone Periapt' in rels:
+            periapt = True
+        if 'DollysMirror' in rels:
+            mirror = True
+
+    if not periapt:
+        return 0
+
+    curses = {'Injury', 'Shame', 'Doubt', 'Regret', 'Pain', 'Necronomicurse',
+              'AscendersBane', 'Parasite', 'Pride', 'Clumsy', 'Writhe',
+              'CurseOfTheBell', 'Decay', 'Normality'}
+    num_curses = 2 * cage + 3 * astrolabe + mirror
+
+    for card in master_deck:
+        if card in curses:
+            num_curses += 1
+
+    for card in items_purged:
+        if card in curses:
+            num_curses += 1
+
+    for event in event_choices:
+        if 'cards_removed' in event:
+            for card in event['cards_removed']:
+                if card in curses:
+                    num_curses += 1
+
+        if 'cards_transformed' in event:
+            for card in event['cards_transformed']:
+                if card in curses:
+                    num_curses += 1
+
+    for fire in campfire_choices:
+        if fire['key'] == 'PURGE' and fire['data'] in curses:
+            num_curses += 1
+
+    return num_curses * 6
+
+# encounters = {encounter_name:(max_fatalities, max_gold_reward)}
+def ref_combat_gold_hp(damage_taken, floor_reached, encounters,
+                       relics_by_floor, greed_floor, feed_floor, wish_floor):
+    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
+    hp_by_floor = np.zeros(floor_reached + 1, dtype = float)
+
+    for dmg in damage_taken:
+        if 'floor' in dmg and 'enemies' in dmg:
+            floor = int(dmg['floor'])
+            enc_name = dmg['enemies']
+
+            max_fat, max_gold = encounters[enc_name]
+            gold = max_gold * (1 + 0.25 * ('Golden Idol' in
+                                           relics_by_floor[floor - 1]))
+            gold_by_floor[floor] += np.ceil(gold)
+
+            if True:
+                gold_by_floor[floor] += 25 * max_fat
+            if wish_floor < floor:
+                gold_by_floor[floor] += np.inf
+            if feed_floor < floor:
+                hp_by_floor[floor] += 4 * max_fat
+
+            if 'FaceOfCleric' in relics_by_floor[floor - 1]:
+                hp_by_floor[floor] += 1
+
+    return (gold_by_floor, hp_by_floor)
+
+def ref_chest_gold(path_per_floor, event_choices, floor_reached):
+    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
+
+    event_floors = set()
+    for event in event_choices:
+        event_floors.add(int(event['floor']))
+
+    for i, room in enumerate(path_per_floor):
+        if room == 'T' or (room == '?' and (i + 1 not in event_floors)):
+            gold_by_floor[i + 1] += 82
+
+    return gold_by_floor
+
+def ref_event_gold_hp(event_choices, floor_reached):
+    hp_by_floor = np.zeros(floor_reached + 1, dtype = float)
+    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
+    for event in event_choices:
+        floor = int(event['floor'])
+        if 'max_hp_gain' in event:
+            hp_by_floor[floor] += event['max_hp_gain']
+        if 'max_hp_loss' in event:
+            hp_by_floor[floor] -= event['max_hp_loss']
+        if 'gold_gain' in event:
+            gold_by_floor[floor] += event['gold_gain']
+        if 'gold_loss' in event:
+            gold_by_floor[floor] -= event['gold_loss']
+        if event['event_name'] == 'Dead Adventurer':
+            gold_by_floor[floor] += 30
+
+    return (gold_by_floor, hp_by_floor)
+
+def ref_relic_gold_hp(relic_changes, card_choices, event_choices,
+                      path_per_floor, items_purchased, item_purchase_floors,
+                      floor_reached, card_names):
+    gold_by_floor = np.zeros(floor_reached + 1, dtype = float)
+    hp_by_floor = np.zeros(floor_reached + 1, dtype = float)
+    key_floor = -1
+    fish_floor = -1
+    house_floor = -1
+    box_floor = -1
+    astrolabe_floor = -1
+    bell_floor = -1
+    necro_floor = -1
+    serpent_floor = -1
+    maw_floor = -1
+    idol_floor = -1
+    mirror_floor = -1
+    has_bowl = False
+    for floor in relic_changes:
+        relics_added = relic_changes[floor][0]
+        if 'Old Coin' in relics_added:
+            gold_by_floor[floor] += 300
+        if 'Strawberry' in relics_added:
+            hp_by_floor[floor] += 7
+        if 'Pear' in relics_added:
+            hp_by_floor[floor] += 10
+        if 'Mango' in relics_added:
+            hp_by_floor[floor] += 14
+        if 'Lee\'s Waffle' in relics_added:
+            hp_by_floor[floor] += 7
+
+        if 'Cursed Key' in relics_added:
+            key_floor = floor
+        if 'CeramicFish' in relics_added:
+            fish_floor = floor
+        if 'Pandora\'s Box' in relics_added:
+            box_floor = floor
+        if 'Astrolabe' in relics_added:
+            astrolabe_floor = floor
+        if 'Calling Bell' in relics_added:
+            bell_floor = floor
+        if 'Necronomicon' in relics_added:
+            necro_floor = floor
+        if 'SsserpentHead' in relics_added:
+            serpent_floor = floor
+        if 'MawBank' in relics_added:
+            maw_floor = floor
+        if 'Golden Idol' in relics_added:
+            idol_floor = floor
+        if 'DollysMirror' in relics_added:
+            mirror_floor = floor
+
+        if 'Tiny House' in relics_added:
+            gold_by_floor[floor] += 50
+            hp_by_floor[floor] += 5
+            house_floor = floor
+        if 'Singing Bowl' in relics_added:
+            has_bowl = True
+
+    # it seems Golden Idol affects the Tiny House gold bonus (glitch?)
+    if idol_floor >= 0 and house_floor >= 0 and idol_floor <= house_floor:
+        gold_by_floor[house_floor] += 13
+
+    if fish_floor >= 0 or has_bowl == True:
+        for card in card_choices:
+            floor = int(card['floor'])
+            if floor >= fish_floor:
+                gold_by_floor[floor] += 9
+            if has_bowl and card['picked'] == 'Singing Bowl':
+                hp_by_floor[floor] += 2
+
+    if fish_floor >= 0:
+        if house_floor >= fish_floor:
+            gold_by_floor[house_floor] += 9
+        if bell_floor >= fish_floor:
+            gold_by_floor[bell_floor] += 9
+        if necro_floor >= fish_floor:
+            gold_by_floor[necro_floor] += 9
+        if astrolabe_floor >= fish_floor:
+            gold_by_floor[astrolabe_floor] += 9 * 3
+        if box_floor >= fish_floor:
+            gold_by_floor[box_floor] += 9 * 11
+        if mirror_floor >= fish_floor:
+            gold_by_floor[mirror_floor] += 9
+
+        for event in event_choices:
+            floor = int(event['floor'])
+            if floor < fish_floor:
+                continue
+            if 'cards_obtained' in event:
+                gold_by_floor[floor] += 9 * len(event['cards_obtained'])
+            if 'cards_transformed' in event:
+                gold_by_floor[floor] += 9 * len(event['cards_transformed'])
+
+        for i, item in enumerate(items_purchased):
+            floor = item_purchase_floors[i]
+            if floor >= fish_floor and item in card_names:
+                gold_by_floor[floor] += 9
+
+        if key_floor >= 0:
+            start_floor = max(key_floor, fish_floor)
+            for floor in range(start_floor, floor_reached + 1):
+                if path_per_floor[floor - 1] == 'T' or path_per_floor == '?':
+                    gold_by_floor[floor] += 9
+
+    if serpent_floor >= 0:
+        for floor in range(serpent_floor, floor_reached + 1):
+            if (path_per_floor[floor - 1] == '?'
+                or path_per_floor[floor - 1] == 'M'
+                or path_per_floor[floor - 1] == 'T'
+                or path_per_floor[floor - 1] == '$'):
+                gold_by_floor[floor] += 50
+
+    if maw_floor >= 0:
+        for floor in range(maw_floor, floor_reached + 1):
+            gold_by_floor[floor] += 12
+
+    return (gold_by_floor, hp_by_floor)
+
+def ref_max_gold_hp(card_choices, event_choices, relics_obtained, boss_relics,
+                    damage_taken, campfire_choices, items_purchased,
+                    items_purged, item_purchase_floors, potions_obtained,
+                    neow_bonus, neow_cost, relics, master_deck, path_per_floor,
+                    character_chosen, floor_reached, relic_names, card_names,
+                    encounters):
+
+    if floor_reached <= 2:
+        cutoff = 2
+    elif path_per_floor[-1] == '?':
+        cutoff = floor_reached - 1
+    else:
+        cutoff = floor_reached
+
+    max_gold = np.zeros(cutoff, dtype = float)
+    max_hp = 0
+
+    _relic_changes = ref_relic_changes(relics_obtained, boss_relics,
+                                       event_choices, relics, neow_bonus,
+                                       items_purchased, item_purchase_floors,
+                                       relic_names)
+    _relics_by_floor = ref_relics_by_floor(_relic_changes, floor_reached)
+    earliest = ref_earliest_gold_hp_cards(card_choices, event_choices,
+                                          items_purchased,
+                                          item_purchase_floors, neow_bonus,
+                                          _relic_changes, character_chosen)
+    greed_floor, feed_floor, wish_floor = earliest
+
+    max_gold[0] += ref_neow_gold(neow_bonus, neow_cost)
+    max_hp += ref_neow_hp(neow_bonus, neow_cost, character_chosen)
+
+    max_hp += ref_periapt_hp(master_deck, _relic_changes, event_choices,
+                             items_purged, campfire_choices)
+
+    max_hp += ref_fruit_juice_hp(_relic_changes, potions_obtained,
+                                 items_purchased, item_purchase_floors,
+                                 event_choices, floor_reached)[:cutoff].sum()
+
+    max_gold += ref_chest_gold(path_per_floor, event_choices,
+                               floor_reached)[:cutoff]
+
+    combat_gold, combat_hp = ref_combat_gold_hp(damage_taken, floor_reached,
+                                                encounters, _relics_by_floor,
+                                                greed_floor, feed_floor,
+                                                wish_floor)
+    max_gold += combat_gold[:cutoff]
+    max_hp += combat_hp[:cutoff].sum()
+
+    event_gold, event_hp = ref_event_gold_hp(event_choices, floor_reached)
+    max_gold += event_gold[:cutoff]
+    max_hp += event_hp[:cutoff].sum()
+
+    relic_gold, relic_hp = ref_relic_gold_hp(_relic_changes, card_choices,
+                                             event_choices, path_per_floor,
+                                             items_purchased,
+                                             item_purchase_floors,
+                                             floor_reached, card_names)
+    max_gold += relic_gold[:cutoff]
+    max_hp += relic_hp[:cutoff].sum()
+
+    return (max_gold, max_hp)
+
+def ref_gold_max_hp_valid(gold_per_floor, max_hp_per_floor, card_choices,
+                          event_choices, relics_obtained, boss_relics,
+                          damage_taken, campfire_choices, items_purchased,
+                          items_purged, item_purchase_floors, potions_obtained,
+                          neow_bonus, neow_cost, relics, master_deck,
+                          path_per_floor, character_chosen, floor_reached,
+                          relic_names, card_names, encounters, **kwargs):
+
+    gold_by_floor = np.zeros(len(gold_per_floor))
+    gold_by_floor[0] = gold_per_floor[0]
+    for i in range(1, len(gold_per_floor)):
+        gold_by_floor[i] = gold_per_floor[i] - gold_per_floor[i - 1]
+
+    try:
+        max_gold, max_hp = ref_max_gold_hp(card_choices, event_choices,
+                                            relics_obtained, boss_relics,
+                                            damage_taken, campfire_choices,
+                                            items_purchased, items_purged,
+                                            item_purchase_floors,
+                                            potions_obtained, neow_bonus,
+                                            neow_cost, relics, master_deck,
+                                            path_per_floor, character_chosen,
+                                            floor_reached, relic_names,
+                                            card_names, encounters)
+    except IndexError:
+        return False
+    except KeyError:
+        return False
+
+    max_gold_by_floor = np.zeros(len(max_gold) - 1)
+    if len(max_gold) <= 1:
+        max_gold_by_floor = max_gold
+    else:
+        max_gold_by_floor[0] = max_gold[0] + max_gold[1]
+        max_gold_by_floor[1:] = max_gold[2:]
+
+    mask = (max_gold_by_floor < gold_by_floor[:len(max_gold_by_floor)])
+    if mask.any():
+        return False
+
+    ending_max_hp = max_hp_per_floor[len(max_gold_by_floor) - 1]
+    if max_hp < ending_max_hp:
+        return False
+
+    return True
+
+def ref_current_hp_valid(current_hp_per_floor, max_hp_per_floor, **kwargs):
+    chp = np.array(current_hp_per_floor)
+    mhp = np.array(max_hp_per_floor)
+    return (chp <= mhp).all()
+
+def ref_gold_is_clean(gold_per_floor, max_hp_per_floor, card_choices,
+                      event_choices, relics_obtained, boss_relics,
+                      damage_taken, campfire_choices, items_purchased,
+                      items_purged, item_purchase_floors, potions_obtained,
+                      neow_bonus, neow_cost, relics, master_deck,
+                      path_per_floor, character_chosen, floor_reached,
+                      relic_names, card_names, encounters,
+                      current_hp_per_floor, **kwargs):
+    return (
+        ref_current_hp_valid(current_hp_per_floor, max_hp_per_floor)
+        and ref_gold_max_hp_valid(gold_per_floor, max_hp_per_floor,
+                                  card_choices, event_choices,
+                                  relics_obtained, boss_relics, damage_taken,
+                                  campfire_choices, items_purchased,
+                                  items_purged, item_purchase_floors,
+                                  potions_obtained, neow_bonus, neow_cost,
+                                  relics, master_deck, path_per_floor,
+                                  character_chosen, floor_reached,
+                                  relic_names, card_names, encounters,
+                                  **kwargs)
+        )
+
+# adds random relic gains and losses to a synthetic run
+def add_relic_changes(rng, run):
+    floor_reached = run['floor_reached']
+    floor = lambda: rng.randint(0, max(floor_reached, 0))
+    run['relics'] = rng.sample(_fuzz_relics, 3)
+    run['neow_bonus'] = rng.choice(['ONE_RARE_RELIC', 'THREE_CARDS'])
+    run['relics_obtained'] = [{'floor':floor(),
+                               'key':rng.choice(_fuzz_relics)}
+                              for _ in range(rng.randint(0, 8))]
+    run['boss_relics'] = [{'picked':rng.choice(_fuzz_relics),
+                           'not_picked':[]}
+                          for _ in range(rng.randint(0, 2))]
+    for event in run['event_choices']:
+        if rng.random() < 0.4:
+            event['relics_obtained'] = rng.sample(_fuzz_relics, 1)
+        if rng.random() < 0.4:
+            event['relics_lost'] = rng.sample(_fuzz_relics, 1)
+    if rng.random() < 0.3:
+        run['items_purchased'] = rng.sample(_fuzz_relics, 2)
+        run['item_purchase_floors'] = [floor(), floor()]
+    return run
+
+_bad_values = [None, 'x', float('nan'), 10 ** 30, -1, True, 2.5, [], {}, [1],
+               0, 60, 3, 'Cultist', 'Strike_R', 'Strike_R+1']
+
+# replaces a random part of a value (a run, or a list or dict in it)
+def corrupt(rng, value):
+    if isinstance(value, list) and value and rng.random() < 0.7:
+        value = list(value)
+        i = rng.randrange(len(value))
+        if rng.random() < 0.15:
+            del value[i]
+        else:
+            value[i] = corrupt(rng, value[i])
+        return value
+    if isinstance(value, dict) and value and rng.random() < 0.8:
+        value = dict(value)
+        key = rng.choice(list(value))
+        if rng.random() < 0.2:
+            del value[key]
+        else:
+            value[key] = corrupt(rng, value[key])
+        return value
+    return copy.deepcopy(rng.choice(_bad_values))
+
+def fuzzed_runs(n, seed):
+    rng = random.Random(seed)
+    runs = []
+    for i in range(n):
+        run = benchmark.synthetic_run(rng, str(i))
+        if rng.random() < 0.5:
+            add_relic_changes(rng, run)
+        if rng.random() < 0.3:
+            run = corrupt(rng, run)
+        runs.append(run)
+    return runs
+
+# the result of f(*args), or the type of the exception it raises
+def outcome(f, *args, **kwargs):
+    try:
+        return f(*args, **kwargs)
+    except Exception as err:
+        return type(err)
+
+# game_dict of a database made by benchmark.make_database
+def reference_game_dict():
+    tmp = tempfile.mkdtemp()
+    dbpath = os.path.join(tmp, 'reference.db')
+    benchmark.make_database(dbpath)
+    con = sqlite3.connect(dbpath)
+    try:
+        return gamedata.GameData(con.cursor()).game_dict()
+    finally:
+        con.close()
+        os.remove(dbpath)
+        os.rmdir(tmp)
+
+# evaluate with the validators' is_clean functions run one after the other,
+# and the frozen bounds in place of gold_hp_cleaning's
+def legacy_evaluate(run, game_dict, mask = verdicts.ALL):
+    args = runview.validator_args(run)
+    for i, (module, tables) in enumerate(verdicts.validators):
+        bit = 1 << i
+        if not mask & bit:
+            continue
+        if module is gold_hp_cleaning:
+            clean = ref_gold_is_clean(**args, **game_dict)
+        elif len(tables) > 0:
+            clean = module.is_clean(**args, **game_dict)
+        else:
+            clean = module.is_clean(**args)
+        if not clean:
+            return (bit, mask & ~((bit << 1) - 1))
+    return (0, 0)
+
+class GoldHpTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.game_dict = reference_game_dict()
+
+    def setUp(self):
+        self.encounters = {e[0]:(max(e[1], e[2]), e[3])
+                           for e in benchmark._encounters}
+
+    def check_relics(self, relic_names, seed):
+        rng = random.Random(seed)
+        for i in range(2000):
+            run = add_relic_changes(rng, benchmark.synthetic_run(rng, str(i)))
+            floor_reached = run['floor_reached']
+            if floor_reached < 0:
+                continue
+            changes = outcome(gold_hp_cleaning.relic_changes,
+                              run['relics_obtained'], run['boss_relics'],
+                              run['event_choices'], run['relics'],
+                              run['neow_bonus'], run['items_purchased'],
+                              run['item_purchase_floors'], relic_names)
+            if isinstance(changes, type):
+                continue
+            self.assertEqual(changes, ref_relic_changes(
+                run['relics_obtained'], run['boss_relics'],
+                run['event_choices'], run['relics'], run['neow_bonus'],
+                run['items_purchased'], run['item_purchase_floors'],
+                relic_names))
+            ref = ref_relics_by_floor(changes, floor_reached)
+            masks, others = gold_hp_cleaning.relics_by_floor(
+                changes, floor_reached, relic_names)
+            bits = gold_hp_cleaning.relic_bits(relic_names)
+            held = [bits.relics(m) | (others[f] if others is not None
+                                      else set())
+                    for f, m in enumerate(masks)]
+            self.assertEqual(held, ref)
+
+            feed_floor = rng.choice([math.inf, rng.randint(0, 60)])
+            wish_floor = rng.choice([math.inf, rng.randint(0, 60)])
+            expected = outcome(ref_combat_gold_hp, run['damage_taken'],
+                               floor_reached, self.encounters, ref, 57,
+                               feed_floor, wish_floor)
+            gold = [0.0] * (floor_reached + 1)
+            hp = [0.0] * (floor_reached + 1)
+            result = outcome(gold_hp_cleaning.combat_gold_hp,
+                             run['damage_taken'], self.encounters,
+                             (masks, others), feed_floor, wish_floor, gold,
+                             hp, relic_names)
+            if isinstance(expected, type):
+                self.assertEqual(result, expected)
+            else:
+                self.assertEqual(gold, list(expected[0]))
+                self.assertEqual(hp, list(expected[1]))
+
+    def test_relics_in_reference_table(self):
+        self.check_relics(frozenset(_fuzz_relics), 1)
+
+    # relics outside relic_names, including the held_relic_combat ones
+    def test_relics_outside_reference_table(self):
+        self.check_relics(frozenset(r for r, _ in benchmark._relics), 2)
+
+    # masks depend only on the reference relics, not on the order relics
+    # are seen in
+    def test_relic_bits_are_stable(self):
+        names = [r for r, _ in benchmark._relics]
+        a = gold_hp_cleaning.RelicBits(names)
+        b = gold_hp_cleaning.RelicBits(list(reversed(names)))
+        self.assertEqual(a.bits, b.bits)
+        mask, others = a.split(['Vajra', 'Junk', 'Anchor'])
+        self.assertEqual(a.relics(mask), {'Vajra', 'Anchor'})
+        self.assertEqual(others, frozenset(['Junk']))
+
+    # bounds and verdicts of the runs the original code gives them for.
+    # Corrupt runs it raises on may raise as well, or get a verdict.
+    def test_max_gold_hp(self):
+        names = ref_max_gold_hp.__code__.co_varnames[
+            :ref_max_gold_hp.__code__.co_argcount]
+        nbounds = 0
+        for run in fuzzed_runs(4000, 5):
+            if not isinstance(run, dict):
+                continue
+            args = dict(runview.validator_args(run), **self.game_dict)
+            kwargs = {k:args[k] for k in names if k in args}
+            expected = outcome(ref_max_gold_hp, **kwargs)
+            if not isinstance(expected, type):
+                nbounds += 1
+                np.testing.assert_equal(
+                    gold_hp_cleaning.max_gold_hp(**kwargs), expected)
+            expected = outcome(ref_gold_is_clean, **args)
+            if not isinstance(expected, type):
+                self.assertEqual(outcome(gold_hp_cleaning.is_clean, **args),
+                                 expected)
+        self.assertGreater(nbounds, 1000)
+
+# verdicts of the runs legacy_evaluate gives a verdict
+class VerdictsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.game_dict = reference_game_dict()
+
+    def test_evaluate(self):
+        masks = [verdicts.ALL, verdicts.ALL & ~3, 1 << 2, 1 << 4]
+        for run in fuzzed_runs(3000, 3):
+            for mask in masks:
+                expected = outcome(legacy_evaluate, run, self.game_dict, mask)
+                if not isinstance(expected, type):
+                    self.assertEqual(outcome(verdicts.evaluate, run,
+                                             self.game_dict, mask), expected)
+
+    def test_evaluate_batch(self):
+        runs = [run for run in fuzzed_runs(3000, 4)
+                if not isinstance(outcome(legacy_evaluate, run,
+                                          self.game_dict), type)]
+        for i in range(0, len(runs), 200):
+            batch = runs[i:i + 200]
+            self.assertEqual(verdicts.evaluate_batch(batch, self.game_dict),
+                             [legacy_evaluate(run, self.game_dict)
+                              for run in batch])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+# Validate-only pass over a data dump: streams the runs of any dump source
+# (see sources.py) through the cleaning validators without writing to a
+# database, e.g. to profile and tune the validators on the full dataset.
+# iter_verdicts yields (run, clean, validator) for each run, where validator
+# is the name of the validator that rejected the run (None if clean). Runs
+# are read, deduplicated and validated as by the importers, one dump file at
+# a time, optionally in worker processes. The reference tables are read
+# from an existing database, opened read-only.
+#
+# Unlike the importers, which skip a whole file when a validator raises on
+# one of its runs, a run that a validator cannot read is rejected by that
+# validator. Files that cannot be read or parsed are skipped.
+#
+# usage: python validate.py SOURCE REFDB [--files NAME ...] [--processes N]
+#                           [--profile PATH]
+import argparse
+import json
+import pathlib
+import sqlite3
+from collections import Counter
+from itertools import islice
+from multiprocessing import Pool
+import datahelper
+import gamedata
+import profiling
+import sources
+import verdicts
+
+# reference data of the database at dbpath, which is opened read-only
+def load_game_dict(dbpath):
+    uri = pathlib.Path(dbpath).resolve().as_uri() + '?mode=ro'
+    con = sqlite3.connect(uri, uri = True)
+    try:
+        return gamedata.GameData(con.cursor()).game_dict()
+    finally:
+        con.close()
+
+# bit of the validator that rejects a run, 0 if none does. If a validator
+# raises on the run, it rejects it.
+def _run_failed(run, game_dict, profile = None):
+    try:
+        return verdicts.evaluate(run, game_dict, profile = profile)[0]
+    except Exception:
+        pass
+    for i, name in enumerate(verdicts.names):
+        bit = 1 << i
+        try:
+            failed = verdicts.evaluate(run, game_dict, mask = bit)[0]
+        except Exception:
+            failed = bit
+        if failed:
+            if profile is not None:
+                profile.reject(name)
+            return failed
+    return 0
+
+# _run_failed for a chunk of runs, validated as a batch unless a validator
+# raises on one of them
+def _chunk_failed(chunk, game_dict, profile = None):
+    chunk_profile = profiling.Profile() if profile is not None else None
+    try:
+        results = verdicts.evaluate_batch(chunk, game_dict,
+                                          profile = chunk_profile)
+        failed = [f for f, _ in results]
+    except Exception:
+        chunk_profile = profiling.Profile() if profile is not None else None
+        failed = [_run_failed(run, game_dict, chunk_profile)
+                  for run in chunk]
+    if profile is not None:
+        profile.merge(chunk_profile.data())
+    return failed
+
+# (run, failed) for the runs of a dump member, and the number of runs
+# dropped as repeats of a run earlier in the member. Runs are replaced by
+# None unless keep_runs is set. If profile is given, validation is timed as
+# the 'clean' stage.
+def _member_verdicts(member, game_dict, keep_runs = True, profile = None,
+                     chunk_size = 1000):
+    results = []
+    seen = Counter()
+    with sources.open_member(member) as jfile:
+        runs = datahelper._parsed_runs(jfile, profile)
+        runs = iter(datahelper._unseen(runs, seen))
+        while True:
+            chunk = list(islice(runs, chunk_size))
+            if len(chunk) == 0:
+                break
+            if profile is not None:
+                t = profile.start()
+            failed = _chunk_failed(chunk, game_dict, profile)
+            if profile is not None:
+                profile.stop('clean', t, len(chunk))
+                profile.count('runs', len(chunk))
+                profile.count('clean', failed.count(0))
+            if not keep_runs:
+                chunk = [None] * len(chunk)
+            results += zip(chunk, failed)
+    return (results, datahelper._repeats(seen))
+
+# (name, results, repeats, profile data) of a member; results is None if the
+# member could not be read
+def _validate_member(member, game_dict, keep_runs, profiled):
+    profile = profiling.Profile() if profiled else None
+    try:
+        results, repeats = _member_verdicts(member, game_dict, keep_runs,
+                                            profile)
+    except Exception:
+        return (member[0], None, 0, None)
+    data = profile.data() if profile is not None else None
+    return (member[0], results, repeats, data)
+
+# (game_dict, keep_runs, profiled) of the worker processes
+_worker_args = None
+
+def _init_worker(game_dict, keep_runs, profiled):
+    global _worker_args
+    _worker_args = (game_dict, keep_runs, profiled)
+
+def _validate_file(member):
+    return _validate_member(member, *_worker_args)
+
+# Yields (run, clean, validator) for the runs of the dump source at path
+# (all of its json files if filenames is None), validated against game_dict
+# (see load_game_dict). With keep_runs = False, run is None, which saves
+# sending the runs back from the worker processes. Names of the files that
+# could not be read are appended to skipped if it is given. If profile (a
+# profiling.Profile) is given, stage and validator timings, runs, clean
+# runs, duplicates and files are counted in it.
+def iter_verdicts(path, game_dict, filenames = None, processes = 1,
+                  prefetch = 4, keep_runs = True, skipped = None,
+                  profile = None):
+    members = sources.prefetch(sources.open_source(path, filenames),
+                               depth = prefetch)
+    profiled = profile is not None
+    if processes > 1:
+        initargs = (game_dict, keep_runs, profiled)
+        with Pool(processes, _init_worker, initargs) as pool:
+            results = datahelper._imap_bounded(pool, _validate_file, members,
+                                               2 * processes)
+            if profile is not None:
+                results = profile.timed(results, 'wait')
+            yield from _file_verdicts(results, skipped, profile)
+    else:
+        results = (_validate_member(m, game_dict, keep_runs, profiled)
+                   for m in members)
+        yield from _file_verdicts(results, skipped, profile)
+
+def _file_verdicts(results, skipped, profile):
+    for name, runs, repeats, data in results:
+        if profile is not None and data is not None:
+            profile.merge(data)
+        if runs is None:
+            if skipped is not None:
+                skipped.append(name)
+            if profile is not None:
+                profile.count('skipped_files')
+            continue
+        if profile is not None:
+            profile.count('files')
+            profile.count('duplicates', repeats)
+            profile.tick()
+        for run, failed in runs:
+            if failed:
+                yield (run, False, verdicts.names_of(failed)[0])
+            else:
+                yield (run, True, None)
+
+# validates a dump source and returns the profile report (see
+# profiling.Profile.report), printing the rejections by validator
+def validate(path, refdb, filenames = None, processes = 1, prefetch = 4,
+             log_interval = 10, verbose = True):
+    game_dict = load_game_dict(refdb)
+    profile = profiling.Profile(log_interval = log_interval if verbose
+                                else None)
+    skipped = []
+    rejected = Counter()
+    for _, clean, validator in iter_verdicts(path, game_dict, filenames,
+                                             processes, prefetch,
+                                             keep_runs = False,
+                                             skipped = skipped,
+                                             profile = profile):
+        if not clean:
+            rejected[validator] += 1
+    profile.finish()
+    report = profile.report()
+    if verbose:
+        nruns = report['counters'].get('runs', 0)
+        print('files validated: {}, skipped: {}'.format(
+            report['counters'].get('files', 0), len(skipped)))
+        for name in skipped:
+            print('  skipped {}'.format(name))
+        print('runs: {}, clean: {}, duplicates dropped: {} ({:.0f} '
+              'runs/s)'.format(nruns, nruns - sum(rejected.values()),
+                               report['counters'].get('duplicates', 0),
+                               report['runs_per_sec'] or 0))
+        for name in verdicts.names:
+            print('  rejected by {}: {} ({:.1%})'.format(
+                name, rejected[name], rejected[name] / max(nruns, 1)))
+        print(profile.summary())
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description = 'run the cleaning '
+                                     'validators over a data dump without '
+                                     'importing it')
+    parser.add_argument('source', help = 'directory, 7z or tar archive, or '
+                        'json file of the dump')
+    parser.add_argument('refdb', help = 'database with the reference tables '
+                        '(opened read-only)')
+    parser.add_argument('--files', nargs = '*', default = None,
+                        help = 'json files of the source to validate')
+    parser.add_argument('--processes', type = int, default = 1)
+    parser.add_argument('--prefetch', type = int, default = 4)
+    parser.add_argument('--log-interval', type = float, default = 10,
+                        help = 'seconds between progress lines')
+    parser.add_argument('--profile', default = None,
+                        help = 'write the timings and counts as json')
+    args = parser.parse_args()
+    report = validate(args.source, args.refdb, args.files, args.processes,
+                      args.prefetch, args.log_interval)
+    if args.profile is not None:
+        with open(args.profile, 'w') as f:
+            json.dump(report, f, indent = 2)
+
+if __name__ == '__main__':
+    main()
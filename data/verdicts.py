@@ -0,0 +1,181 @@
+# Per-validator cleaning verdicts. Each run in MegaCritData stores two bit
+# masks over the validators below (bit i stands for validators[i]):
+#   Verdicts: validators that rejected the run
+#   VerdictsStale: validators whose verdict is not known, either because an
+#       earlier validator already rejected the run or because the validator
+#       or a reference table it reads changed since the run was checked
+# A run is clean if Verdicts is 0 (a run with no rejections has no stale
+# verdicts). See reclean.py for re-running single validators.
+import hashlib
+import inspect
+import json
+import basic_cleaning
+import campfire_shop_cleaning
+import item_cleaning
+import event_encounter_cleaning
+import gold_hp_cleaning
+import batch_cleaning
+import runview
+import gamedata
+
+# (module, reference tables read through the game dictionary), in the order
+# evaluate checks them
+validators = [(basic_cleaning, ()),
+              (campfire_shop_cleaning, ()),
+              (item_cleaning, ('Cards', 'Relics', 'Potions')),
+              (event_encounter_cleaning, ('Events', 'Encounters')),
+              (gold_hp_cleaning, ('Cards', 'Relics', 'Encounters'))]
+
+names = [m.__name__ for m, _ in validators]
+ALL = (1 << len(validators)) - 1
+
+# Runs the validators in mask on a run in order, stopping at the first
+# rejection. The run is read once into a runview.RunView that all validators
+# check. Returns (failed, stale): the bit of the validator that rejected
+# the run (0 if none did) and the bits of the validators in mask that were
+# not run. If profile is given, each validator is timed and its rejections
+# counted (the view is built outside the validators' time).
+def evaluate(json_dict, game_dict, mask = ALL, profile = None):
+    view = runview.RunView(json_dict, game_dict)
+    for i, (module, _) in enumerate(validators):
+        bit = 1 << i
+        if not mask & bit:
+            continue
+        if profile is not None:
+            t = profile.start()
+        clean = module.check(view, game_dict)
+        if profile is not None:
+            profile.stop_validator(names[i], t)
+        if not clean:
+            if profile is not None:
+                profile.reject(names[i])
+            return (bit, mask & ~((bit << 1) - 1))
+    return (0, 0)
+
+# evaluate for a list of runs. The first two validators (basic_cleaning and
+# campfire_shop_cleaning) are run on the whole batch at once (see
+# batch_cleaning), the others run by run on the runs that pass them.
+def evaluate_batch(runs, game_dict, profile = None):
+    if profile is not None:
+        t = profile.start()
+    batch = batch_cleaning.RunBatch(runs)
+    basic = batch_cleaning.basic_is_clean(batch)
+    if profile is not None:
+        profile.stop_validator(names[0], t, len(runs))
+        profile.reject(names[0], int(len(runs) - basic.sum()))
+        t = profile.start()
+    campfire = batch_cleaning.campfire_is_clean(batch, where = basic)
+    if profile is not None:
+        profile.stop_validator(names[1], t, int(basic.sum()))
+        profile.reject(names[1], int((basic & ~campfire).sum()))
+
+    rest = ALL & ~3
+    results = []
+    for rundict, basic_ok, campfire_ok in zip(runs, basic.tolist(),
+                                              campfire.tolist()):
+        if not basic_ok:
+            results.append((1, ALL & ~1))
+        elif not campfire_ok:
+            results.append((2, ALL & ~3))
+        else:
+            results.append(evaluate(rundict, game_dict, mask = rest,
+                                    profile = profile))
+    return results
+
+def mask_of(validator_names):
+    mask = 0
+    for name in validator_names:
+        mask |= 1 << names.index(name)
+    return mask
+
+def names_of(mask):
+    return [name for i, name in enumerate(names) if mask & (1 << i)]
+
+# validators that read any of the given reference tables
+def depending_on(tables):
+    tables = set(tables)
+    mask = 0
+    for i, (_, reads) in enumerate(validators):
+        if tables.intersection(reads):
+            mask |= 1 << i
+    return mask
+
+# run keys read by the validators in mask
+def run_keys(mask = ALL, game_keys = ()):
+    keys = []
+    for i, (module, _) in enumerate(validators):
+        if not mask & (1 << i):
+            continue
+        params = inspect.signature(module.is_clean).parameters.values()
+        for p in params:
+            if (p.kind == p.POSITIONAL_OR_KEYWORD and p.name not in keys
+                    and p.name not in game_keys):
+                keys.append(p.name)
+    return keys
+
+# (module, names of the validators whose verdicts it computes) of the
+# modules outside the validators that hold verdict logic: every verdict is
+# read from a RunView, and evaluate_batch runs the first two validators
+# through batch_cleaning
+helpers = [(runview, names),
+           (batch_cleaning, ['basic_cleaning', 'campfire_shop_cleaning'])]
+
+def _source_hash(module):
+    with open(inspect.getsourcefile(module), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# sha1 of the source of each validator module and of the helpers it uses, to
+# detect changed logic
+def module_hashes():
+    helper_hashes = [(_source_hash(helper), users)
+                     for helper, users in helpers]
+    hashes = {}
+    for module, _ in validators:
+        name = module.__name__
+        h = hashlib.sha1(_source_hash(module).encode())
+        for digest, users in helper_hashes:
+            if name in users:
+                h.update(digest.encode())
+        hashes[name] = h.hexdigest()
+    return hashes
+
+# Change stamps of the reference tables and validator modules that the
+# stored verdicts were computed with, kept in the CleaningState table.
+def create_state_table(sqlcur):
+    sqlcur.execute('CREATE TABLE IF NOT EXISTS CleaningState('
+                   'Name TEXT PRIMARY KEY, Stamp TEXT)')
+
+def current_state(sqlcur):
+    state = {}
+    for table, stamp in gamedata.table_stamps(sqlcur).items():
+        state['table:' + table] = json.dumps(stamp)
+    for module, digest in module_hashes().items():
+        state['module:' + module] = digest
+    return state
+
+def load_state(sqlcur):
+    return dict(sqlcur.execute('SELECT Name, Stamp FROM CleaningState'))
+
+def save_state(sqlcur, state):
+    sqlcur.execute('DELETE FROM CleaningState')
+    sqlcur.executemany('INSERT INTO CleaningState VALUES (?, ?)',
+                       list(state.items()))
+
+# records the current state if none is stored yet. Once stored, the state
+# is only replaced by reclean, so changes made between imports are not
+# missed.
+def init_state(sqlcur):
+    create_state_table(sqlcur)
+    if sqlcur.execute('SELECT COUNT(*) FROM CleaningState').fetchone()[0] == 0:
+        save_state(sqlcur, current_state(sqlcur))
+
+# (changed reference tables, changed validator modules) since the stored
+# state
+def changes(sqlcur):
+    stored = load_state(sqlcur)
+    changed = [name for name, stamp in current_state(sqlcur).items()
+               if stored.get(name) != stamp]
+    tables = [n[len('table:'):] for n in changed if n.startswith('table:')]
+    modules = [n[len('module:'):] for n in changed
+               if n.startswith('module:')]
+    return (tables, modules)
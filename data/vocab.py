@@ -0,0 +1,258 @@
+# Item vocabulary shared by the importers and the item matrix builders.
+# Every card, relic and potion has a stable integer id in the Items table,
+# with its type ('Card', 'Relic' or 'Potion') and character once it is in
+# one of the reference tables. ItemNames maps every spelling seen so far to
+# an id and an upgrade count: the item's own name, upgraded card names
+# ('Searing Blow+3' -> (id of Searing Blow, 3)) and known aliases (display
+# names such as 'Hand of Greed'). Ids are never reassigned, so they can be
+# stored with the runs.
+#
+# The importers store MasterDeck and Relics as packed item codes as well
+# (MasterDeckIds and RelicIds): little-endian uint32 values of
+# (id << 8) | upgrades, upgrades capped at 255. See pack and unpack.
+#
+# usage: python vocab.py DBPATH [--table TABLE]
+import argparse
+import json
+import sqlite3
+import numpy as np
+
+# item name: display name, as used by the item clustering notebooks
+aliases = {'Venomology':'Alchemize', 'Night Terror':'Nightmare',
+           'Crippling Poison':'Crippling Cloud',
+           'Underhanded Strike':'Sneaky Strike', 'Lockon':'Bullseye',
+           'Steam':'Steam Barrier', 'Steam Power':'Overclock',
+           'Redo':'Recursion', 'Undo':'Equilibrium', 'Gash':'Claw',
+           'ClearTheMind':'Tranquility', 'Wireheading':'Foresight',
+           'Vengeance':'Simmering Fury', 'Adaptation':'Rushdown',
+           'PathToVictory':'Pressure Points', 'Ghostly':'Apparition',
+           'Snake Skull':'Snecko Skull', 'GremlinMask':'Gremlin Visage',
+           'NlothsMask':'N\'loth\'s Hungry Face',
+           'Molten Egg 2':'Molten Egg', 'Toxic Egg 2':'Toxic Egg',
+           'Wraith Form v2':'Wraith Form', 'Frozen Egg 2':'Frozen Egg',
+           'CurseOfTheBell':'Curse of the Bell',
+           'NeowsBlessing':'Neow\'s Lament', 'Fasting2':'Fasting',
+           'FlurryOfBlows':'Flurry of Blows',
+           'WaveOfTheHand':'Wave of the Hand',
+           'SandsOfTime':'Sands of Time',
+           'TalkToTheHand':'Talk to the Hand',
+           'HandOfGreed':'Hand of Greed', 'All For One':'All for One'}
+
+# reference table: (item type, whether it has a Character column)
+_reference_tables = {'Cards':('Card', True), 'Relics':('Relic', True),
+                     'Potions':('Potion', False)}
+
+# columns of the run tables that are stored as packed item codes
+packed_cols = {'MasterDeckIds':'master_deck', 'RelicIds':'relics'}
+
+_max_upgrades = 255
+
+def create_tables(sqlcur):
+    sqlcur.execute('CREATE TABLE IF NOT EXISTS Items('
+                   'ItemId INTEGER PRIMARY KEY, Name TEXT UNIQUE NOT NULL)')
+    known = set(r[1] for r in sqlcur.execute('PRAGMA table_info(Items)'))
+    for col in ('Type', 'Character'):
+        if col not in known:
+            sqlcur.execute('ALTER TABLE Items ADD COLUMN {} TEXT'.format(col))
+    sqlcur.execute('CREATE TABLE IF NOT EXISTS ItemNames('
+                   'Name TEXT PRIMARY KEY, ItemId INT NOT NULL, '
+                   'Upgrades INT NOT NULL)')
+
+# splits the upgrade suffix off a card name: 'Searing Blow+3' ->
+# ('Searing Blow', 3)
+def split_upgrades(name):
+    ind_plus = name.find('+')
+    if ind_plus < 0:
+        return (name, 0)
+    upgrades = name[ind_plus + 1:]
+    return (name[:ind_plus], int(upgrades) if upgrades.isdigit() else 0)
+
+# Adds the items of the reference tables with their type and character,
+# and the aliases of items in the vocabulary. Runs in its own transaction
+# unless one is open.
+def sync(sqlcur):
+    create_tables(sqlcur)
+    tables = set(r[0] for r in sqlcur.execute(
+        'SELECT name FROM sqlite_master WHERE type = \'table\''))
+    own = not sqlcur.connection.in_transaction
+    if own:
+        sqlcur.execute('BEGIN')
+    try:
+        for table, (itype, has_char) in _reference_tables.items():
+            if table not in tables:
+                continue
+            char = 'Character' if has_char else 'NULL'
+            rows = list(sqlcur.execute('SELECT Name, {} FROM {}'
+                                       .format(char, table)))
+            sqlcur.executemany('INSERT OR IGNORE INTO Items(Name) '
+                               'VALUES (?)', [(r[0],) for r in rows])
+            sqlcur.executemany('UPDATE Items SET Type = ?, Character = ? '
+                               'WHERE Name = ?',
+                               [(itype, r[1], r[0]) for r in rows])
+        sqlcur.execute('INSERT OR IGNORE INTO ItemNames '
+                       'SELECT Name, ItemId, 0 FROM Items')
+        sqlcur.executemany('INSERT OR IGNORE INTO ItemNames '
+                           'SELECT ?, ItemId, 0 FROM Items WHERE Name = ?',
+                           [(alias, name) for name, alias in aliases.items()])
+        if own:
+            sqlcur.execute('COMMIT')
+    except Exception as err:
+        if own and sqlcur.connection.in_transaction:
+            sqlcur.execute('ROLLBACK')
+        raise err
+    forget(sqlcur)
+
+# ItemNames by connection: {id(con):(con, {name:(id, upgrades)})}
+_names = {}
+
+def _name_codes(sqlcur):
+    con = sqlcur.connection
+    if id(con) not in _names:
+        codes = {r[0]:(r[1], r[2]) for r in sqlcur.execute(
+            'SELECT Name, ItemId, Upgrades FROM ItemNames')}
+        _names[id(con)] = (con, codes)
+    return _names[id(con)][1]
+
+# (id, upgrades) of an item name. Names not in the vocabulary yet are added
+# (a new item unless the name is an upgrade or alias of a known one).
+def lookup(sqlcur, name):
+    codes = _name_codes(sqlcur)
+    entry = codes.get(name)
+    if entry is not None:
+        return entry
+    base, upgrades = split_upgrades(name)
+    base_entry = codes.get(base)
+    if base_entry is None:
+        sqlcur.execute('INSERT INTO Items(Name) VALUES (?)', (base,))
+        base_entry = (sqlcur.lastrowid, 0)
+        sqlcur.execute('INSERT INTO ItemNames VALUES (?, ?, 0)',
+                       (base, base_entry[0]))
+        codes[base] = base_entry
+    entry = (base_entry[0], base_entry[1] + upgrades)
+    if name != base:
+        sqlcur.execute('INSERT INTO ItemNames VALUES (?, ?, ?)',
+                       (name,) + entry)
+        codes[name] = entry
+    return entry
+
+def item_id(sqlcur, name):
+    return lookup(sqlcur, name)[0]
+
+# drops cached names, e.g. after a rollback has undone new items
+def forget(sqlcur):
+    _names.pop(id(sqlcur.connection), None)
+
+def code(item_id, upgrades = 0):
+    return (item_id << 8) | min(upgrades, _max_upgrades)
+
+# packed item codes of a list of names, or None if it is not a list of
+# names
+def pack(sqlcur, names):
+    if type(names) is not list:
+        return None
+    codes = []
+    for name in names:
+        if type(name) is not str:
+            return None
+        codes.append(code(*lookup(sqlcur, name)))
+    return np.array(codes, dtype = '<u4').tobytes()
+
+# item codes of a packed column value as a uint32 array
+def unpack(blob):
+    if blob is None:
+        return np.zeros(0, dtype = np.uint32)
+    return np.frombuffer(blob, dtype = '<u4').astype(np.uint32)
+
+def ids(codes):
+    return codes >> 8
+
+def upgrades(codes):
+    return codes & _max_upgrades
+
+# The vocabulary as arrays indexed by item id, for readers of the packed
+# columns: names, types and characters (None where unknown), and
+# {name:(id, upgrades)} for every spelling.
+class Vocab:
+    def __init__(self, sqlcur):
+        rows = list(sqlcur.execute('SELECT ItemId, Name, Type, Character '
+                                   'FROM Items'))
+        size = max((r[0] for r in rows), default = 0) + 1
+        self.names = np.full(size, None, dtype = object)
+        self.types = np.full(size, None, dtype = object)
+        self.characters = np.full(size, None, dtype = object)
+        for iid, name, itype, char in rows:
+            self.names[iid] = name
+            self.types[iid] = itype
+            self.characters[iid] = char
+        self.codes = {r[0]:(r[1], r[2]) for r in sqlcur.execute(
+            'SELECT Name, ItemId, Upgrades FROM ItemNames')}
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_of(self, name):
+        entry = self.codes.get(name)
+        if entry is None:
+            entry = self.codes.get(split_upgrades(name)[0])
+        return None if entry is None else entry[0]
+
+# fills the packed item columns of runs already in the database, chunk_size
+# runs at a time
+def build(dbpath, table = 'MegaCritData', chunk_size = 10000,
+          verbose = True):
+    con = sqlite3.connect(dbpath, isolation_level = None)
+    cur = con.cursor()
+    try:
+        sync(cur)
+        known = set(r[1] for r in cur.execute(
+            'PRAGMA table_info({})'.format(table)))
+        for col in packed_cols:
+            if col not in known:
+                cur.execute('ALTER TABLE {} ADD COLUMN {} BLOB'
+                            .format(table, col))
+        query = ('SELECT rowid, MasterDeck, Relics FROM {} WHERE rowid > ? '
+                 'ORDER BY rowid LIMIT ?'.format(table))
+        update = ('UPDATE {} SET MasterDeckIds = ?, RelicIds = ? '
+                  'WHERE rowid = ?'.format(table))
+        cur.execute('BEGIN')
+        lastrow = 0
+        nruns = 0
+        while True:
+            chunk = con.execute(query, (lastrow, chunk_size)).fetchall()
+            if len(chunk) == 0:
+                break
+            lastrow = chunk[-1][0]
+            updates = []
+            for rowid, deck, relics in chunk:
+                updates.append((pack(cur, _from_json(deck)),
+                                pack(cur, _from_json(relics)), rowid))
+            cur.executemany(update, updates)
+            nruns += len(chunk)
+            if verbose:
+                print('runs processed: {}'.format(nruns))
+        cur.execute('COMMIT')
+    except Exception as err:
+        if con.in_transaction:
+            cur.execute('ROLLBACK')
+        raise err
+    finally:
+        forget(cur)
+        con.close()
+
+def _from_json(v):
+    try:
+        return json.loads(v)
+    except (TypeError, ValueError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description = 'fill the packed item '
+                                     'columns of runs already in the '
+                                     'database')
+    parser.add_argument('dbpath')
+    parser.add_argument('--table', default = 'MegaCritData')
+    args = parser.parse_args()
+    build(args.dbpath, table = args.table)
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,20 @@
 import numpy as np
 from cor_cluster import bootstrap_pearsonr
 from joblib import Parallel, delayed
+import item_mats
 
 file_in = 'FWWR_A20_act3_items.npz'
 file_out = 'FWWR_A20_act3_boot'
 
-item_data = np.load(file_in)
-ironclad_data = item_data['ironclad_mat']
-ironclad_labels = item_data['ironclad_items']
-silent_data = item_data['silent_mat']
-silent_labels = item_data['silent_items']
-defect_data = item_data['defect_mat']
-defect_labels = item_data['defect_items']
-watcher_data = item_data['watcher_mat']
-watcher_labels = item_data['watcher_items']
+item_data = item_mats.load(file_in)
+ironclad_data = item_data['ironclad'].toarray()
+ironclad_labels = item_data['ironclad'].items
+silent_data = item_data['silent'].toarray()
+silent_labels = item_data['silent'].items
+defect_data = item_data['defect'].toarray()
+defect_labels = item_data['defect'].items
+watcher_data = item_data['watcher'].toarray()
+watcher_labels = item_data['watcher'].items
 
 data = [ironclad_data, silent_data, defect_data, watcher_data]
 labels = [ironclad_labels, silent_labels, defect_labels, watcher_labels]
@@ -202,47 +202,62 @@ def _ward_test_average(D, flat, cluster_sizes, null_pair):
     ests = comps[0]
     return 1 - sps.norm.cdf(np.abs(ests) / se_boot)
 
-# estimates flattened correlation matrix from data
-def _flat_pearsonr(data, flat):
-    n = len(data)
-    D = np.zeros(len(flat))
-    p = data.mean(axis = 0)
-    for (j, k), l in flat.items():
-        pxy = (data[:, j] * data[:, k]).sum() / n
-        num = pxy - p[j] * p[k]
-        den = np.sqrt(p[j] * p[k] * (1 - p[j]) * (1 - p[k]))
-        D[l] = max(min(num / den, 1), -1)
-    return D
+# Co-occurrence counts of binary columns are exact in float32 BLAS products
+# below this many rows, and in float64 ones otherwise
+_float32_rows = 2 ** 24
+
+# Estimates the flattened (condensed upper triangle) correlation matrix of
+# binary data. The co-occurrence counts of the columns come from one matrix
+# product per block of block_size columns, so at most block_size x d counts
+# are held at a time. dtype is the dtype of the output. If flat (a mapping
+# from (j, k) to flat indices) is given, the output is in its order instead.
+def _flat_pearsonr(data, flat = None, dtype = np.float64, block_size = 512):
+    n, d = data.shape
+    work = np.float32 if n < _float32_rows else np.float64
+    X = np.asarray(data, dtype = work)
+    p = X.sum(axis = 0, dtype = np.float64) / n
+    D = np.empty(d * (d - 1) // 2, dtype = dtype)
+    start = 0
+    for a in range(0, d, block_size):
+        b = min(a + block_size, d)
+        counts = X[:, a:b].T @ X[:, a:]
+        rows, cols = np.triu_indices(b - a, 1, d - a)
+        pj = p[a:b][rows]
+        pk = p[a:][cols]
+        num = counts[rows, cols].astype(np.float64) / n - pj * pk
+        den = np.sqrt(pj * pk * (1 - pj) * (1 - pk))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            D[start:start + len(rows)] = np.clip(num / den, -1, 1)
+        start += len(rows)
+    if flat is None:
+        return D
+    j, k = np.array(list(flat.keys()), dtype = np.int64).reshape(-1, 2).T
+    D_flat = np.empty(len(flat), dtype = dtype)
+    D_flat[list(flat.values())] = D[j * d - j * (j + 1) // 2 + k - j - 1]
+    return D_flat
 
 # Bootstrap flattened Pearson correlation matrices. The matrix for the
-# original data is recorded as the first row of the output.
-def bootstrap_pearsonr(data, b = 500, verbose = False):
+# original data is recorded as the first row of the output. dtype and
+# block_size are passed on to _flat_pearsonr; float32 halves the memory of
+# the output.
+def bootstrap_pearsonr(data, b = 500, verbose = False, dtype = np.float64,
+                       block_size = 512):
     d = data.shape[1]
-    # mappings between matrix and flat indexing
-    flat = {}
-    k = 0
-    for i in range(d):
-        for j in range(i + 1, d):
-            flat[(i, j)] = k
-            k += 1
-            
     if verbose:
         pm = _ProgressMeter(b)
         print('Bootstrapping b = {} replicates...'.format(b))
     
-    D_boot = np.zeros((b, len(flat)))
+    D = np.zeros(((b + 1), d * (d - 1) // 2), dtype = dtype)
+    D[0] = _flat_pearsonr(data, dtype = dtype, block_size = block_size)
     for i in range(b):
         boot_inds = np.random.choice(len(data), size = len(data),
                                      replace = True)
-        D_boot[i] = _flat_pearsonr(data[boot_inds], flat)
+        D[i + 1] = _flat_pearsonr(data[boot_inds], dtype = dtype,
+                                  block_size = block_size)
         
         if verbose:
             pm.tick(True)
                                   
-    D_og = _flat_pearsonr(data, flat)
-    D = np.zeros(((b + 1), len(flat)))
-    D[0] = D_og
-    D[1:] = D_boot
     return D
     
 
@@ -0,0 +1,380 @@
+# Streaming builder of the item matrices used by the clustering scripts. An
+# item matrix has a row for each run and a column for each item (the cards
+# and relics of a character, see character_items), with a 1 where the run
+# ended with the item in its deck or relics. Runs are read from the query
+# cursor chunk_size at a time and their packed item codes (MasterDeckIds and
+# RelicIds, see data/vocab.py) go straight into the output, without a list
+# of item names per run: either a bit-packed uint8 matrix (np.packbits
+# layout, 1 bit per cell) or, with sparse = True, CSR column indices. Runs
+# imported before the packed columns existed are read from their json names
+# instead.
+#
+# build_filtered makes the matrices of several run filters (e.g. A20 act 4
+# wins and high win rate players) for every character in a single scan of
+# MegaCritData. save and load write and read matrices as .npz files,
+# together with their item names and ids (mat_cache.py keeps them as
+# memory-mapped .npy files that are rebuilt when the database changes).
+# ItemMatrix.toarray() gives the dense 0/1 matrix.
+#
+# A filter can also select runs by play id (e.g. the players of the chains
+# found in chaining/). The ids are loaded into an indexed temporary table
+# that MegaCritData is joined against through its PlayId index, instead of
+# being spelled out in the query. read_play_ids reads them from a csv file
+# or from the json output of the chaining scripts.
+#
+# usage: python item_mats.py DBPATH FILTERS [--sparse] [--out-dir DIR]
+# FILTERS is a json file with a list of filters, each an object with a
+# name, an SQL condition on MegaCritData (where), and optionally its params,
+# characters, play_ids (a list) or play_ids_file (read with read_play_ids,
+# keeping the rows whose play_ids_min values are at least the given ones).
+# The matrices of each filter are saved to NAME.npz.
+import argparse
+import csv
+import json
+import os
+import sqlite3
+from json import loads
+import numpy as np
+
+characters = ['IRONCLAD', 'THE_SILENT', 'DEFECT', 'WATCHER']
+# name of each character's matrix in the .npz files
+prefixes = {'IRONCLAD':'ironclad', 'THE_SILENT':'silent', 'DEFECT':'defect',
+            'WATCHER':'watcher'}
+
+# (name, character) of reference table entries left out of the matrices
+excluded_cards = [('SKIP', 'ALL'), ('Singing Bowl', 'ALL')]
+excluded_relics = [('PrismaticShard', 'ALL')]
+
+def trim(s):
+    return s.split('+')[0]
+
+# (cards, relics) of the reference tables as (name, character) pairs,
+# without the excluded ones
+def reference_items(con):
+    cards = [r for r in con.execute('SELECT Name, Character FROM Cards')
+             if r not in excluded_cards]
+    relics = [r for r in con.execute('SELECT Name, Character FROM Relics')
+              if r not in excluded_relics]
+    return (cards, relics)
+
+# matrix columns of a character: its cards and the colorless ones, then its
+# relics and the shared ones
+def character_items(cards, relics, character):
+    return ([n for n, c in cards if c == character or c == 'ALL']
+            + [n for n, c in relics if c == character or c == 'ALL'])
+
+class ItemMatrix:
+    # items: column names, ids: their item ids (-1 for items not in the
+    # vocabulary), nrows: number of runs. The ones are stored either as
+    # packed rows (bits) or as CSR row offsets and column indices (indptr,
+    # indices).
+    def __init__(self, items, ids, nrows, bits = None, indptr = None,
+                 indices = None):
+        self.items = np.asarray(items)
+        self.ids = np.asarray(ids)
+        self.nrows = nrows
+        self.bits = bits
+        self.indptr = indptr
+        self.indices = indices
+
+    @property
+    def shape(self):
+        return (self.nrows, len(self.items))
+
+    @property
+    def sparse(self):
+        return self.bits is None
+
+    def toarray(self, dtype = np.uint8):
+        if not self.sparse:
+            M = np.unpackbits(self.bits, axis = 1, count = len(self.items))
+            return M.astype(dtype, copy = False)
+        M = np.zeros(self.shape, dtype = dtype)
+        rows = np.repeat(np.arange(self.nrows), np.diff(self.indptr))
+        M[rows, self.indices] = 1
+        return M
+
+    # the arrays of the matrix as .npz entries named name_*
+    def arrays(self, name):
+        arrays = {name + '_items':self.items, name + '_ids':self.ids,
+                  name + '_shape':np.array(self.shape)}
+        if self.sparse:
+            arrays[name + '_indptr'] = self.indptr
+            arrays[name + '_indices'] = self.indices
+        else:
+            arrays[name + '_bits'] = self.bits
+        return arrays
+
+# Accumulates the rows of an item matrix chunk by chunk. Only the packed
+# rows (or CSR indices) of the chunks added so far are kept.
+class MatrixBuilder:
+    # items: column names, item_names: {name:item id} (the ItemNames table)
+    def __init__(self, items, item_names, sparse = False):
+        self.items = np.array(items)
+        self.ids = np.array([item_names.get(n, -1) for n in items],
+                            dtype = np.int64)
+        self.sparse = sparse
+        self.nrows = 0
+        self._parts = []
+        # matrix column of each item id, -1 for items not in the matrix
+        self._col = np.full(max(item_names.values(), default = 0) + 1, -1)
+        for i, iid in enumerate(self.ids):
+            if iid >= 0:
+                self._col[iid] = i
+
+    # adds runs given as the item ids of all runs concatenated (ids) and the
+    # number of ids of each run (lengths)
+    def add(self, ids, lengths):
+        n = len(lengths)
+        owners = np.repeat(np.arange(n), lengths)
+        known = ids < len(self._col)
+        cols = self._col[ids[known]]
+        owners = owners[known]
+        keep = cols >= 0
+        dense = np.zeros((n, len(self.items)), dtype = bool)
+        dense[owners[keep], cols[keep]] = True
+        if self.sparse:
+            self._parts.append((dense.sum(axis = 1),
+                                np.nonzero(dense)[1].astype(np.int32)))
+        else:
+            self._parts.append(np.packbits(dense, axis = 1))
+        self.nrows += n
+
+    def matrix(self):
+        if not self.sparse:
+            nbytes = (len(self.items) + 7) // 8
+            bits = np.concatenate([np.zeros((0, nbytes), dtype = np.uint8)]
+                                  + self._parts)
+            return ItemMatrix(self.items, self.ids, self.nrows, bits = bits)
+        counts = np.concatenate([np.zeros(0, dtype = np.int64)]
+                                + [c for c, _ in self._parts])
+        indptr = np.zeros(self.nrows + 1, dtype = np.int64)
+        np.cumsum(counts, out = indptr[1:])
+        indices = np.concatenate([np.zeros(0, dtype = np.int32)]
+                                 + [i for _, i in self._parts])
+        return ItemMatrix(self.items, self.ids, self.nrows, indptr = indptr,
+                          indices = indices)
+
+# packed item codes of a run without the packed columns, from the names in
+# its json columns
+def _json_codes(deck, relics, item_names):
+    ids = [item_names.get(n, item_names.get(trim(n)))
+           for n in loads(deck) + loads(relics)]
+    ids = np.array([i for i in ids if i is not None], dtype = '<u4')
+    return (ids << 8).tobytes()
+
+# item ids of a chunk of (MasterDeckIds, RelicIds, MasterDeck, Relics) rows,
+# as (ids of all runs concatenated, number of ids of each run)
+def chunk_ids(rows, item_names):
+    blobs = [deck_ids + relic_ids
+             if deck_ids is not None and relic_ids is not None
+             else _json_codes(deck, relics, item_names)
+             for deck_ids, relic_ids, deck, relics in rows]
+    lengths = np.fromiter(map(len, blobs), dtype = np.int64,
+                          count = len(blobs)) // 4
+    codes = np.frombuffer(b''.join(blobs), dtype = '<u4')
+    return ((codes >> 8).astype(np.int64), lengths)
+
+# ids and lengths (see chunk_ids) of the runs where mask is True
+def _select(ids, lengths, owners, mask):
+    return (ids[mask[owners]], lengths[mask])
+
+# Fills builders from the rows of cur, chunk_size at a time. The columns of
+# the rows are MasterDeckIds, RelicIds, MasterDeck, Relics, CharacterChosen
+# and one flag per filter; builders maps (flag index, character) to the
+# builder of the runs of that character with the flag set (all runs of the
+# character if the flag index is None).
+def _fill(cur, builders, item_names, chunk_size):
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if len(rows) == 0:
+            break
+        ids, lengths = chunk_ids([r[:4] for r in rows], item_names)
+        owners = np.repeat(np.arange(len(rows)), lengths)
+        chars = np.array([r[4] for r in rows], dtype = object)
+        flags = np.array([r[5:] for r in rows], dtype = bool)
+        char_masks = {}
+        for (flag, character), builder in builders.items():
+            if character not in char_masks:
+                char_masks[character] = chars == character
+            mask = char_masks[character]
+            if flag is not None:
+                mask = mask & flags[:, flag]
+            if mask.any():
+                builder.add(*_select(ids, lengths, owners, mask))
+
+def _builders(con, keys, sparse):
+    item_names = dict(con.execute('SELECT Name, ItemId FROM ItemNames'))
+    cards, relics = reference_items(con)
+    builders = {key:MatrixBuilder(character_items(cards, relics, key[1]),
+                                  item_names, sparse)
+                for key in keys}
+    return (builders, item_names)
+
+# Builds the item matrix of each character from the runs of a query whose
+# columns are MasterDeckIds, RelicIds, MasterDeck, Relics and
+# CharacterChosen. Returns {character:ItemMatrix}.
+def build(con, query, params = (), characters = characters, sparse = False,
+          chunk_size = 10000):
+    builders, item_names = _builders(con, [(None, c) for c in characters],
+                                     sparse)
+    _fill(con.execute(query, params), builders, item_names, chunk_size)
+    return {c:b.matrix() for (_, c), b in builders.items()}
+
+# A named run filter: an SQL condition on the columns of MegaCritData with
+# its ? params, and the characters to build matrices for. If play_ids is
+# given, only runs with one of these play ids pass the filter.
+class Filter:
+    def __init__(self, name, where = '1', params = (),
+                 characters = characters, play_ids = None):
+        self.name = name
+        self.where = where
+        self.params = tuple(params)
+        self.characters = list(characters)
+        self.play_ids = play_ids
+
+# Loads play ids into a temporary table of con (replacing it if it exists),
+# keyed by PlayId so that lookups and joins use its index
+def _id_table(con, table, play_ids):
+    con.execute('DROP TABLE IF EXISTS temp.{}'.format(table))
+    con.execute('CREATE TEMP TABLE {}(PlayId TEXT PRIMARY KEY) '
+                'WITHOUT ROWID'.format(table))
+    con.executemany('INSERT OR IGNORE INTO temp.{} VALUES (?)'.format(table),
+                    ((str(pid),) for pid in play_ids))
+
+# Builds the item matrices of several filters in a single scan of table.
+# SQLite evaluates every filter's condition on each run; runs that pass
+# none of them are not read. Play id sets are loaded into temporary tables
+# for the scan. Returns {filter name:{character:ItemMatrix}}.
+def build_filtered(con, filters, sparse = False, chunk_size = 10000,
+                   table = 'MegaCritData'):
+    if len(filters) == 0:
+        return {}
+    own = not con.in_transaction
+    id_tables = []
+    try:
+        conds = []
+        for i, f in enumerate(filters):
+            if f.play_ids is None:
+                conds.append('({})'.format(f.where))
+                continue
+            id_table = 'item_mats_ids_{}'.format(i)
+            _id_table(con, id_table, f.play_ids)
+            id_tables.append(id_table)
+            conds.append('(({}) AND PlayId IN (SELECT PlayId FROM temp.{}))'
+                         .format(f.where, id_table))
+        query = ('SELECT MasterDeckIds, RelicIds, MasterDeck, Relics, '
+                 'CharacterChosen, {} FROM {} WHERE {}'
+                 .format(', '.join('COALESCE({}, 0)'.format(c)
+                                   for c in conds),
+                         table, ' OR '.join(conds)))
+        params = [p for f in filters for p in f.params] * 2
+        keys = [(i, c) for i, f in enumerate(filters) for c in f.characters]
+        builders, item_names = _builders(con, keys, sparse)
+        _fill(con.execute(query, params), builders, item_names, chunk_size)
+    finally:
+        for id_table in id_tables:
+            con.execute('DROP TABLE IF EXISTS temp.{}'.format(id_table))
+        if own and con.in_transaction:
+            con.commit()
+    mats = {f.name:{} for f in filters}
+    for (i, c), builder in builders.items():
+        mats[filters[i].name][c] = builder.matrix()
+    return mats
+
+# Play ids of a csv file with a play_id column, or of the chains in the json
+# output of the chaining scripts (lists of objects with play_ids). If
+# minimums ({column or key:value}) is given, only rows or chains with at
+# least these values count; empty csv values do not.
+def read_play_ids(path, column = 'play_id', minimums = None):
+    minimums = minimums or {}
+    if path.endswith('.json'):
+        with open(path) as f:
+            chains = json.load(f)
+        return [pid for ch in chains
+                if all(ch[k] >= v for k, v in minimums.items())
+                for pid in ch['play_ids']]
+    with open(path, newline = '') as f:
+        return [row[column] for row in csv.DictReader(f)
+                if all(row[k] != '' and float(row[k]) >= v
+                       for k, v in minimums.items())]
+
+# saves {name:ItemMatrix} to an .npz file. With dense = True the dense 0/1
+# int matrices of the older scripts are saved as well (as name_mat), for
+# readers of their files; they take the memory and disk space of the dense
+# matrices.
+def save(file_out, mats, dense = False):
+    arrays = {}
+    for name, M in mats.items():
+        arrays.update(M.arrays(name))
+        if dense:
+            arrays[name + '_mat'] = M.toarray(dtype = int)
+    np.savez(file_out, **arrays)
+
+# {name:ItemMatrix} of an .npz file written by save. Files of the older
+# scripts (dense name_mat and name_items arrays only) are read as well.
+def load(file_in):
+    data = np.load(file_in)
+    mats = {}
+    for key in data.files:
+        if not key.endswith('_items'):
+            continue
+        name = key[:-len('_items')]
+        items = data[key]
+        if name + '_shape' not in data.files:
+            dense = data[name + '_mat']
+            mats[name] = ItemMatrix(items, np.full(len(items), -1),
+                                    len(dense),
+                                    bits = np.packbits(dense != 0, axis = 1))
+            continue
+        nrows = int(data[name + '_shape'][0])
+        if name + '_bits' in data.files:
+            mats[name] = ItemMatrix(items, data[name + '_ids'], nrows,
+                                    bits = data[name + '_bits'])
+        else:
+            mats[name] = ItemMatrix(items, data[name + '_ids'], nrows,
+                                    indptr = data[name + '_indptr'],
+                                    indices = data[name + '_indices'])
+    return mats
+
+# filters of a json file (see the usage above)
+def load_filters(path):
+    with open(path) as f:
+        specs = json.load(f)
+    filters = []
+    for s in specs:
+        play_ids = s.get('play_ids')
+        if 'play_ids_file' in s:
+            play_ids = read_play_ids(s['play_ids_file'],
+                                     minimums = s.get('play_ids_min'))
+        filters.append(Filter(s['name'], s.get('where', '1'),
+                              s.get('params', ()),
+                              s.get('characters', characters), play_ids))
+    return filters
+
+def main():
+    parser = argparse.ArgumentParser(description = 'build the item matrices '
+                                     'of several run filters in a single '
+                                     'scan of the database')
+    parser.add_argument('dbpath')
+    parser.add_argument('filters', help = 'json file with the filters')
+    parser.add_argument('--sparse', action = 'store_true',
+                        help = 'store CSR indices instead of packed bits')
+    parser.add_argument('--out-dir', default = '.')
+    parser.add_argument('--chunk-size', type = int, default = 10000)
+    args = parser.parse_args()
+    filters = load_filters(args.filters)
+    con = sqlite3.connect(args.dbpath)
+    try:
+        mats = build_filtered(con, filters, sparse = args.sparse,
+                              chunk_size = args.chunk_size)
+    finally:
+        con.close()
+    for name, char_mats in mats.items():
+        save(os.path.join(args.out_dir, name),
+             {prefixes.get(c, c):M for c, M in char_mats.items()})
+        print('{}: {}'.format(name, ', '.join(
+            '{} {}x{}'.format(c, *M.shape) for c, M in char_mats.items())))
+
+if __name__ == '__main__':
+    main()
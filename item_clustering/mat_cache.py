@@ -0,0 +1,190 @@
+# On-disk cache of item matrices (see item_mats.py), so that the clustering
+# scripts and notebooks can open the matrices of a filter without rebuilding
+# them or copying them into memory. Each cached filter is a directory of raw
+# .npy files (one per array of each character's ItemMatrix) that are opened
+# memory-mapped, plus a meta.json with the matrix shapes and the filter.
+#
+# An entry is keyed by a hash of the filter spec (condition, params,
+# characters, play ids, storage), the vocabulary version (size of the Items
+# and ItemNames tables) and a change stamp of the database file (its size
+# and modification time, and those of its -wal file). Any write to the
+# database, a new item or a changed filter gives a new key; the entry is
+# then rebuilt, in one scan for all stale filters, and the older entries of
+# the filter are removed. Databases without a file (e.g. :memory:) are not
+# cached.
+#
+# usage: python mat_cache.py DBPATH FILTERS [--cache-dir DIR] [--sparse]
+#                            [--rebuild]
+# FILTERS is a json file of filters as for item_mats.py.
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+import item_mats
+
+# bumped when the layout of the entries changes
+_format = 1
+
+# (size, modification time) of the database file of con and of its -wal
+# file, None if the database has no file
+def db_stamp(con):
+    path = next((r[2] for r in con.execute('PRAGMA database_list')
+                 if r[1] == 'main'), '')
+    if not path:
+        return None
+    stamp = []
+    for p in (path, path + '-wal'):
+        if os.path.exists(p):
+            st = os.stat(p)
+            stamp.append([st.st_size, st.st_mtime_ns])
+        else:
+            stamp.append(None)
+    return stamp
+
+# (number of items, largest item id, number of item names) of the
+# vocabulary of con, None if it has none
+def vocab_version(con):
+    tables = set(r[0] for r in con.execute(
+        'SELECT name FROM sqlite_master WHERE type = \'table\''))
+    if 'Items' not in tables or 'ItemNames' not in tables:
+        return None
+    return (list(con.execute('SELECT COUNT(*), MAX(ItemId) FROM Items')
+                 .fetchone())
+            + [con.execute('SELECT COUNT(*) FROM ItemNames').fetchone()[0]])
+
+# the parts of a filter and of the build settings its matrices depend on
+def filter_spec(f, sparse = False, table = 'MegaCritData'):
+    play_ids = None
+    if f.play_ids is not None:
+        ids = sorted(set(str(pid) for pid in f.play_ids))
+        play_ids = hashlib.sha1('\n'.join(ids).encode()).hexdigest()
+    return {'format':_format, 'table':table, 'where':f.where,
+            'params':list(f.params), 'characters':f.characters,
+            'play_ids':play_ids, 'sparse':sparse,
+            'excluded':[item_mats.excluded_cards, item_mats.excluded_relics]}
+
+def fingerprint(spec, vocab, stamp):
+    key = json.dumps([spec, vocab, stamp], sort_keys = True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def _entry(cache_dir, name, key):
+    return os.path.join(cache_dir, name, key)
+
+def _is_entry(path):
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+# writes the matrices of a filter to a new directory that is moved into
+# place once complete, then removes the other entries of the filter. Files
+# still mapped by another process may not be removable (on Windows); they
+# are left for a later rebuild.
+def _store(cache_dir, name, key, mats, spec):
+    filter_dir = os.path.join(cache_dir, name)
+    os.makedirs(filter_dir, exist_ok = True)
+    tmp = tempfile.mkdtemp(dir = filter_dir, prefix = '.tmp-')
+    try:
+        meta = {'spec':spec, 'matrices':[]}
+        for c, M in mats.items():
+            for array_name, array in M.arrays(c).items():
+                if not array_name.endswith('_shape'):
+                    np.save(os.path.join(tmp, array_name + '.npy'), array,
+                            allow_pickle = False)
+            meta['matrices'].append({'character':c, 'nrows':M.nrows,
+                                     'sparse':M.sparse})
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent = 2)
+        entry = _entry(cache_dir, name, key)
+        shutil.rmtree(entry, ignore_errors = True)
+        os.replace(tmp, entry)
+    except Exception as err:
+        shutil.rmtree(tmp, ignore_errors = True)
+        raise err
+    for other in os.listdir(filter_dir):
+        if other != key and not other.startswith('.tmp-'):
+            shutil.rmtree(os.path.join(filter_dir, other),
+                          ignore_errors = True)
+
+# {character:ItemMatrix} of a cache entry, with memory-mapped arrays
+def read_entry(path, mmap_mode = 'r'):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    def array(name):
+        return np.load(os.path.join(path, name + '.npy'),
+                       mmap_mode = mmap_mode, allow_pickle = False)
+    mats = {}
+    for m in meta['matrices']:
+        c = m['character']
+        if m['sparse']:
+            mats[c] = item_mats.ItemMatrix(array(c + '_items'),
+                                           array(c + '_ids'), m['nrows'],
+                                           indptr = array(c + '_indptr'),
+                                           indices = array(c + '_indices'))
+        else:
+            mats[c] = item_mats.ItemMatrix(array(c + '_items'),
+                                           array(c + '_ids'), m['nrows'],
+                                           bits = array(c + '_bits'))
+    return mats
+
+# Item matrices of the filters (item_mats.Filter), as
+# {filter name:{character:ItemMatrix}}. Filters with a fresh entry in
+# cache_dir are read from it, memory-mapped; the others (all of them with
+# rebuild = True) are built in a single scan of table and stored first.
+# Names of the filters that were built are appended to built if it is
+# given.
+def cached(con, filters, cache_dir, sparse = False, chunk_size = 10000,
+           table = 'MegaCritData', rebuild = False, built = None):
+    stamp = db_stamp(con)
+    if stamp is None:
+        if built is not None:
+            built += [f.name for f in filters]
+        return item_mats.build_filtered(con, filters, sparse, chunk_size,
+                                        table)
+    vocab = vocab_version(con)
+    specs = {f.name:filter_spec(f, sparse, table) for f in filters}
+    keys = {name:fingerprint(spec, vocab, stamp)
+            for name, spec in specs.items()}
+    stale = [f for f in filters if rebuild
+             or not _is_entry(_entry(cache_dir, f.name, keys[f.name]))]
+    if len(stale) > 0:
+        mats = item_mats.build_filtered(con, stale, sparse, chunk_size,
+                                        table)
+        for f in stale:
+            _store(cache_dir, f.name, keys[f.name], mats[f.name],
+                   specs[f.name])
+        if built is not None:
+            built += [f.name for f in stale]
+    return {f.name:read_entry(_entry(cache_dir, f.name, keys[f.name]))
+            for f in filters}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'build or refresh the '
+                                     'cached item matrices of run filters')
+    parser.add_argument('dbpath')
+    parser.add_argument('filters', help = 'json file with the filters')
+    parser.add_argument('--cache-dir', default = 'item_mats_cache')
+    parser.add_argument('--sparse', action = 'store_true',
+                        help = 'store CSR indices instead of packed bits')
+    parser.add_argument('--rebuild', action = 'store_true',
+                        help = 'rebuild fresh entries as well')
+    parser.add_argument('--chunk-size', type = int, default = 10000)
+    args = parser.parse_args()
+    filters = item_mats.load_filters(args.filters)
+    built = []
+    con = sqlite3.connect(args.dbpath)
+    try:
+        mats = cached(con, filters, args.cache_dir, sparse = args.sparse,
+                      chunk_size = args.chunk_size, rebuild = args.rebuild,
+                      built = built)
+    finally:
+        con.close()
+    for name, char_mats in mats.items():
+        print('{} ({}): {}'.format(
+            name, 'built' if name in built else 'cached', ', '.join(
+                '{} {}x{}'.format(c, *M.shape)
+                for c, M in char_mats.items())))
+
+if __name__ == '__main__':
+    main()